@@ -38,6 +38,14 @@ FILE_DOWNLOAD_CHUNK_SIZE = 32768
 # Size of the chunks when downloading over http
 HTTP_DOWNLOAD_CHUNK_SIZE = 32768
 
+# Number of connections kept open to each http server
+HTTP_DOWNLOAD_POOL_SIZE = 8
+
+# Timeouts (in seconds) to connect to a http server and between two reads: a
+# stalled download fails and can be resumed later on
+HTTP_DOWNLOAD_CONNECT_TIMEOUT = 30
+HTTP_DOWNLOAD_READ_TIMEOUT = 120
+
 # Size of the chunks when downloading over scp
 SCP_DOWNLOAD_CHUNK_SIZE = 32768
 
@@ -46,6 +54,21 @@ SCP_DOWNLOAD_CHUNK_SIZE = 32768
 # Files here are for download using the Apache /tmp alias.
 DISPATCHER_DOWNLOAD_DIR = "/var/lib/lava/dispatcher/tmp"
 
+# Shared download cache, only used when "download_cache" is set in the
+# dispatcher configuration. The size is in bytes.
+DISPATCHER_DOWNLOAD_CACHE_DIR = "/var/lib/lava/dispatcher/cache"
+DISPATCHER_DOWNLOAD_CACHE_SIZE = 20 * 1024 * 1024 * 1024
+
+# Number of files downloaded concurrently in each deploy action, can be
+# overridden by "download_concurrency" in the dispatcher configuration.
+DISPATCHER_DOWNLOAD_CONCURRENCY = 4
+
+# Number of ranges of a http file downloaded in parallel, when the server
+# accepts ranges, can be overridden by "download_segments" in the dispatcher
+# configuration. Each range is at least HTTP_DOWNLOAD_SEGMENT_SIZE bytes.
+DISPATCHER_DOWNLOAD_SEGMENTS = 1
+HTTP_DOWNLOAD_SEGMENT_SIZE = 32 * 1024 * 1024
+
 # Distinctive prompt characters which can
 # help distinguish status messages from shell prompts.
 DISTINCTIVE_PROMPT_CHARACTERS = "\\:"
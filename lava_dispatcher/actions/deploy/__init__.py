@@ -1,3 +1,6 @@
+import concurrent.futures
+
+from lava_common.constants import DISPATCHER_DOWNLOAD_CONCURRENCY
 from lava_dispatcher.action import Action
 
 
@@ -15,3 +18,43 @@ class DeployAction(Action):
     """
 
     name = "deploy"
+
+    def _downloads(self, pipeline):
+        """
+        Return the actions of the pipeline (recursively) that can download in
+        the background.
+        """
+        downloads = []
+        for action in pipeline.actions:
+            if hasattr(action, "prefetch"):
+                downloads.append(action)
+            if action.internal_pipeline is not None:
+                downloads.extend(self._downloads(action.internal_pipeline))
+        return downloads
+
+    def run(self, connection, max_end_time):
+        """
+        Start all the downloads of the deploy block at once, in the
+        background, before running the actions. Each download action then
+        only waits for its own file.
+        """
+        downloads = []
+        if self.internal_pipeline is not None:
+            downloads = self._downloads(self.internal_pipeline)
+        concurrency = self.job.parameters.get("dispatcher", {}).get(
+            "download_concurrency", DISPATCHER_DOWNLOAD_CONCURRENCY
+        )
+        if len(downloads) < 2 or concurrency < 2:
+            return super().run(connection, max_end_time)
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        started = []
+        try:
+            for action in downloads:
+                if action.prefetch(executor):
+                    started.append(action)
+            return super().run(connection, max_end_time)
+        finally:
+            for action in started:
+                action.cancel_prefetch()
+            executor.shutdown(wait=False)
@@ -24,12 +24,15 @@
 
 import contextlib
 import errno
+import functools
 import math
 import os
 import shutil
+import threading
 import time
 import hashlib
 import requests
+import requests.adapters
 import subprocess  # nosec - verified.
 from lava_dispatcher.power import ResetDevice
 from lava_dispatcher.protocols.lxc import LxcProtocol
@@ -39,15 +42,26 @@ from lava_dispatcher.connections.serial import ConnectDevice
 from lava_common.exceptions import InfrastructureError, JobError, LAVABug
 from lava_dispatcher.action import Action, Pipeline
 from lava_dispatcher.logical import Deployment, RetryAction
-from lava_dispatcher.utils.compression import untar_file
+from lava_dispatcher.utils.cache import DownloadCache, cache_key, clone_file
+from lava_dispatcher.utils.compression import (
+    StreamDecompressor,
+    stream_decompressors,
+    untar_file,
+)
+from lava_dispatcher.utils.stream import Stage, StreamPipeline
 from lava_dispatcher.utils.filesystem import (
     copy_to_lxc,
     lava_lxc_home,
     copy_overlay_to_lxc,
 )
 from lava_common.constants import (
+    DISPATCHER_DOWNLOAD_SEGMENTS,
     FILE_DOWNLOAD_CHUNK_SIZE,
     HTTP_DOWNLOAD_CHUNK_SIZE,
+    HTTP_DOWNLOAD_CONNECT_TIMEOUT,
+    HTTP_DOWNLOAD_POOL_SIZE,
+    HTTP_DOWNLOAD_READ_TIMEOUT,
+    HTTP_DOWNLOAD_SEGMENT_SIZE,
     SCP_DOWNLOAD_CHUNK_SIZE,
 )
 from lava_dispatcher.actions.boot.fastboot import EnterFastbootAction
@@ -58,6 +72,19 @@ from urllib.parse import urlparse
 # pylint: disable=logging-not-lazy
 
 
+def file_reader(filename):
+    with open(filename, "rb") as f_in:
+        buff = f_in.read(FILE_DOWNLOAD_CHUNK_SIZE)
+        while buff:
+            yield buff
+            buff = f_in.read(FILE_DOWNLOAD_CHUNK_SIZE)
+
+
+def remove_file(filename):
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(filename)
+
+
 class DownloaderAction(RetryAction):
     """
     The retry pipeline for downloads.
@@ -119,6 +146,8 @@ class DownloadHandler(Action):  # pylint: disable=too-many-instance-attributes
     description = "download action"
     summary = "download-action"
     timeout_exception = InfrastructureError
+    # Use the download cache of the dispatcher, when configured
+    cacheable = False
 
     def __init__(self, key, path, url, uniquify=True):
         super().__init__()
@@ -128,11 +157,45 @@ class DownloadHandler(Action):  # pylint: disable=too-many-instance-attributes
         # path unique.
         self.path = os.path.join(path, key) if uniquify else path
         self.size = -1
-        self.decompress_command_map = {"xz": "unxz", "gz": "gunzip", "bz2": "bunzip2"}
+        self.decompress_command_map = {
+            "xz": "unxz",
+            "gz": "gunzip",
+            "bz2": "bunzip2",
+            "zstd": "unzstd",
+            "lz4": "unlz4",
+        }
 
     def reader(self):  # pylint: disable=no-self-use
         raise LAVABug("'reader' function unimplemented")
 
+    def download_cache(self, remote):
+        """
+        Return (cache, key) for this download or (None, None) when the
+        download cache is not used.
+        """
+        if not self.cacheable:
+            return (None, None)
+        cache = DownloadCache.from_config(self.job.parameters.get("dispatcher", {}))
+        if cache is None:
+            return (None, None)
+        key = cache_key(
+            remote["url"],
+            md5sum=remote.get("md5sum"),
+            sha256sum=remote.get("sha256sum"),
+            validators=self.cache_validators(),
+        )
+        if key is None:
+            return (None, None)
+        return (cache, key)
+
+    def cache_validators(self):  # pylint: disable=no-self-use
+        """
+        Return the values identifying the remote content, used as the cache
+        key when no checksum is given. None if the content cannot be cached
+        without a checksum.
+        """
+        return None
+
     def cleanup(self, connection):
         if os.path.exists(self.path):
             self.logger.debug("Cleaning up download directory: %s", self.path)
@@ -200,7 +263,7 @@ class DownloadHandler(Action):  # pylint: disable=too-many-instance-attributes
                 action="download-action", label=self.key, key="overlay", value=overlay
             )
         if compression:
-            if compression not in ["gz", "bz2", "xz", "zip"]:
+            if compression not in ["gz", "bz2", "xz", "zip", "zstd", "lz4"]:
                 self.errors = "Unknown 'compression' format '%s'" % compression
         if archive:
             if archive not in ["tar"]:
@@ -278,26 +341,16 @@ class DownloadHandler(Action):  # pylint: disable=too-many-instance-attributes
         if os.path.exists(fname):
             os.remove(fname)
 
-        self.logger.info("downloading %s", remote["url"])
-        self.logger.debug("saving as %s", fname)
+        (cache, key) = self.download_cache(remote)
 
         downloaded_size = 0
-        beginning = time.time()
-        # Choose the progress bar (is the size known?)
-        if self.size == -1:
-            self.logger.debug("total size: unknown")
-            last_value = -25 * 1024 * 1024
-            progress = progress_unknown_total
-        else:
-            self.logger.debug(
-                "total size: %d (%dMB)" % (self.size, int(self.size / (1024 * 1024)))
-            )
-            last_value = -5
-            progress = progress_known_total
-
         decompress_command = None
+        stream_decompress = False
         if compression:
-            if compression in self.decompress_command_map:
+            if compression in stream_decompressors:
+                stream_decompress = True
+                self.logger.info("Decompressing %s while downloading", compression)
+            elif compression in self.decompress_command_map:
                 decompress_command = self.decompress_command_map[compression]
                 self.logger.info(
                     "Using %s to decompress %s", decompress_command, compression
@@ -310,81 +363,193 @@ class DownloadHandler(Action):  # pylint: disable=too-many-instance-attributes
         else:
             self.logger.debug("No compression specified")
 
-        def update_progress():
-            nonlocal downloaded_size, last_value, md5, sha256
-            downloaded_size += len(buff)
-            (printing, new_value, msg) = progress(downloaded_size, last_value)
-            if printing:
-                last_value = new_value
-                self.logger.debug(msg)
-            md5.update(buff)
-            sha256.update(buff)
-
-        if compression and decompress_command:
-            try:
-                with open(fname, "wb") as dwnld_file:
-                    proc = subprocess.Popen(  # nosec - internal.
-                        [decompress_command], stdin=subprocess.PIPE, stdout=dwnld_file
+        # Concurrent jobs downloading the same file wait for the first one and
+        # then use the cached copy.
+        with contextlib.ExitStack() as stack:
+            cached = None
+            cache_file = None
+            if key is not None:
+                stack.enter_context(cache.lock(key))
+                cached = cache.get(key)
+                if cached is None:
+                    cache_file = stack.enter_context(cache.tempfile())
+                    stack.callback(remove_file, cache_file.name)
+
+            if cached is None:
+                self.logger.info("downloading %s", remote["url"])
+                reader = self.reader
+            else:
+                self.logger.info(
+                    "downloading %s (from the download cache)", remote["url"]
+                )
+                reader = functools.partial(file_reader, cached[0])
+            self.logger.debug("saving as %s", fname)
+
+            beginning = time.time()
+            # Choose the progress bar (is the size known?)
+            if self.size == -1:
+                self.logger.debug("total size: unknown")
+                last_value = -25 * 1024 * 1024
+                progress = progress_unknown_total
+            else:
+                self.logger.debug(
+                    "total size: %d (%dMB)"
+                    % (self.size, int(self.size / (1024 * 1024)))
+                )
+                last_value = -5
+                progress = progress_known_total
+
+            def update_progress():
+                nonlocal downloaded_size, last_value
+                downloaded_size += len(buff)
+                (printing, new_value, msg) = progress(downloaded_size, last_value)
+                if printing:
+                    last_value = new_value
+                    self.logger.debug(msg)
+
+            def hash_data(data):
+                md5.update(data)
+                sha256.update(data)
+                if cache_file is not None:
+                    cache_file.write(data)
+
+            stats = []
+            if cached is not None and not (stream_decompress or decompress_command):
+                try:
+                    clone_file(cached[0], fname)
+                except OSError as exc:
+                    raise InfrastructureError(
+                        "Unable to copy %s: %s" % (cached[0], str(exc))
                     )
-            except OSError as exc:
-                msg = "Unable to open %s: %s" % (fname, exc.strerror)
-                self.logger.error(msg)
-                raise InfrastructureError(msg)
-
-            with proc.stdin as pipe:
-                for buff in self.reader():
-                    update_progress()
-                    try:
-                        pipe.write(buff)
-                    except BrokenPipeError as exc:
-                        error_message = str(exc)
-                        self.logger.exception(error_message)
-                        msg = (
-                            "Make sure the 'compression' is corresponding "
-                            "to the image file type."
-                        )
-                        self.logger.error(msg)
-                        raise JobError(error_message)
-            proc.wait()
-        else:
-            with open(fname, "wb") as dwnld_file:
-                for buff in self.reader():
-                    update_progress()
-                    dwnld_file.write(buff)
-
-        # Log the download speed
-        ending = time.time()
-        self.logger.info(
-            "%dMB downloaded in %0.2fs (%0.2fMB/s)"
-            % (
-                downloaded_size / (1024 * 1024),
-                round(ending - beginning, 2),
-                round(downloaded_size / (1024 * 1024 * (ending - beginning)), 2),
+                downloaded_size = cached[1]["size"]
+                md5_digest = cached[1]["md5"]
+                sha256_digest = cached[1]["sha256"]
+            else:
+                try:
+                    dwnld_file = open(fname, "wb")
+                except OSError as exc:
+                    msg = "Unable to open %s: %s" % (fname, exc.strerror)
+                    self.logger.error(msg)
+                    raise InfrastructureError(msg)
+
+                # The network read, the hashing and the decompression run
+                # concurrently.
+                with contextlib.ExitStack() as file_stack:
+                    file_stack.enter_context(dwnld_file)
+                    decompressor = None
+                    if stream_decompress:
+                        decompressor = StreamDecompressor(compression)
+
+                        def write_data(data):
+                            for piece in decompressor.decompress(data):
+                                dwnld_file.write(piece)
+
+                    elif decompress_command:
+                        try:
+                            proc = subprocess.Popen(  # nosec - internal.
+                                [decompress_command],
+                                stdin=subprocess.PIPE,
+                                stdout=dwnld_file,
+                            )
+                        except OSError as exc:
+                            msg = "Unable to run %s: %s" % (
+                                decompress_command,
+                                exc.strerror,
+                            )
+                            self.logger.error(msg)
+                            raise InfrastructureError(msg)
+                        file_stack.callback(proc.wait)
+                        pipe = file_stack.enter_context(proc.stdin)
+
+                        def write_data(data):
+                            try:
+                                pipe.write(data)
+                            except BrokenPipeError as exc:
+                                raise JobError(
+                                    "%s. Make sure the 'compression' is "
+                                    "corresponding to the image file type." % str(exc)
+                                )
+
+                    else:
+                        write_data = dwnld_file.write
+
+                    stages = [Stage("hash", hash_data), Stage("write", write_data)]
+                    with StreamPipeline(stages) as pipeline:
+                        for buff in reader():
+                            update_progress()
+                            pipeline.put(buff)
+                    if decompressor is not None:
+                        decompressor.close()
+                    stats = pipeline.stats()
+                md5_digest = md5.hexdigest()
+                sha256_digest = sha256.hexdigest()
+
+            # Log the download speed
+            ending = time.time()
+            self.logger.info(
+                "%dMB downloaded in %0.2fs (%0.2fMB/s)"
+                % (
+                    downloaded_size / (1024 * 1024),
+                    round(ending - beginning, 2),
+                    round(
+                        downloaded_size
+                        / (1024 * 1024 * max(ending - beginning, 0.001)),
+                        2,
+                    ),
+                )
             )
-        )
-
-        # If the remote server uses "Content-Encoding: gzip", this calculation will be wrong
-        # because requests will decompress the file on the fly, creating a larger file than
-        # LAVA expects.
-        if self.size:
-            if self.size != downloaded_size:
-                raise InfrastructureError(
-                    "Download finished (%i bytes) but was not expected size (%i bytes), check your networking."
-                    % (downloaded_size, self.size)
+            # Time spent by each stage: the slowest one limits the download
+            for (name, size, elapsed) in stats:
+                self.logger.debug(
+                    "%s: %dMB in %0.2fs (%0.2fMB/s)",
+                    name,
+                    size / (1024 * 1024),
+                    elapsed,
+                    size / (1024 * 1024 * max(elapsed, 0.001)),
                 )
 
+            # If the remote server uses "Content-Encoding: gzip", this calculation will be wrong
+            # because requests will decompress the file on the fly, creating a larger file than
+            # LAVA expects.
+            if self.size:
+                if self.size != downloaded_size:
+                    raise InfrastructureError(
+                        "Download finished (%i bytes) but was not expected size (%i bytes), check your networking."
+                        % (downloaded_size, self.size)
+                    )
+
+            # Only cache the files matching the expected checksums
+            if cache_file is not None:
+                cache_file.close()
+                if md5sum in [None, md5_digest] and sha256sum in [None, sha256_digest]:
+                    self.logger.debug("Adding %s to the download cache", remote["url"])
+                    try:
+                        cache.insert(
+                            key,
+                            cache_file.name,
+                            {
+                                "url": remote["url"],
+                                "size": downloaded_size,
+                                "md5": md5_digest,
+                                "sha256": sha256_digest,
+                            },
+                        )
+                    except OSError as exc:
+                        self.logger.warning(
+                            "Unable to add %s to the download cache: %s",
+                            remote["url"],
+                            str(exc),
+                        )
+
         # set the dynamic data into the context
         self.set_namespace_data(
             action="download-action", label=self.key, key="file", value=fname
         )
         self.set_namespace_data(
-            action="download-action", label=self.key, key="md5", value=md5.hexdigest()
+            action="download-action", label=self.key, key="md5", value=md5_digest
         )
         self.set_namespace_data(
-            action="download-action",
-            label=self.key,
-            key="sha256",
-            value=sha256.hexdigest(),
+            action="download-action", label=self.key, key="sha256", value=sha256_digest
         )
 
         # handle archive files
@@ -500,6 +665,8 @@ class DownloadHandler(Action):  # pylint: disable=too-many-instance-attributes
                 )
             ),
         }
+        if key is not None:
+            self.results["cache"] = "miss" if cached is None else "hit"
         return connection
 
 
@@ -539,6 +706,246 @@ class FileDownloadAction(DownloadHandler):
                 reader.close()
 
 
+class HttpFetch:
+    """
+    Download a http resource into a local file, in background threads, while
+    the action reads the file as it grows.
+
+    The download continues after the first offset bytes already in the file
+    (Range and If-Range) and can be split in several ranges downloaded in
+    parallel. When the server ignores the range, or the content changed, the
+    file is downloaded again from the start.
+
+    session is called, in each thread, to get the requests session of that
+    thread.
+    """
+
+    def __init__(
+        self, session, url, filename, offset=0, validator=None, size=-1, segments=1
+    ):
+        self.session = session
+        self.url = url
+        self.filename = filename
+        # A partial content can only be completed if it cannot have changed
+        self.offset = offset if validator else 0
+        self.validator = validator
+        self.size = size
+        self.segments = segments
+        # [start, end, received] for each range being downloaded
+        self.ranges = []
+        # Number of contiguous bytes in the file, None until the server answered
+        self.available = None
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self.condition = threading.Condition()
+        # Created here so that the reader can always open it
+        try:
+            os.truncate(self.filename, self.offset)
+        except OSError:
+            self.offset = 0
+            open(self.filename, "wb").close()
+
+    def _get(self, start, end=None):
+        # Disable gzip: the ranges are offsets in the raw content
+        headers = {"Accept-Encoding": ""}
+        if start or end is not None:
+            headers["Range"] = "bytes=%d-%s" % (start, "" if end is None else end - 1)
+            if self.validator:
+                headers["If-Range"] = self.validator
+        # FIXME: When requests 3.0 is released, use the enforce_content_length
+        # parameter to raise an exception the file is not fully downloaded
+        return self.session().get(
+            self.url,
+            allow_redirects=True,
+            stream=True,
+            headers=headers,
+            timeout=(HTTP_DOWNLOAD_CONNECT_TIMEOUT, HTTP_DOWNLOAD_READ_TIMEOUT),
+        )
+
+    def _check_range(self, res, start):
+        content_range = res.headers.get("content-range", "")
+        if not content_range.startswith("bytes %d-" % start):
+            raise InfrastructureError(
+                "Unable to download '%s': invalid Content-Range '%s'"
+                % (self.url, content_range)
+            )
+
+    def _set_ranges(self, ranges):
+        with self.condition:
+            self.ranges = ranges
+            self._update()
+
+    def _update(self):
+        # Called with the condition held
+        position = self.ranges[0][0]
+        for (start, end, received) in self.ranges:
+            position = start + received
+            if end is None or position < end:
+                break
+        self.available = position
+        self.condition.notify_all()
+
+    def _fail(self, message):
+        # Only the first error is reported, the others are consequences
+        with self.condition:
+            if self.error is None:
+                self.error = message
+            self.condition.notify_all()
+
+    def _write(self, res, index):
+        start = self.ranges[index][0]
+        length = int(res.headers.get("content-length", -1))
+        with open(self.filename, "r+b", buffering=0) as f_out:
+            f_out.seek(start)
+            for buff in res.iter_content(HTTP_DOWNLOAD_CHUNK_SIZE):
+                if self.cancelled or self.error is not None:
+                    return
+                f_out.write(buff)
+                with self.condition:
+                    self.ranges[index][2] += len(buff)
+                    self._update()
+        if length >= 0 and self.ranges[index][2] != length:
+            raise InfrastructureError(
+                "Unable to download '%s': connection closed after %d bytes"
+                % (self.url, start + self.ranges[index][2])
+            )
+
+    def _run_stream(self):
+        res = self._get(self.offset)
+        if self.offset and res.status_code == requests.codes.partial:
+            self._run_response(res, self.offset)
+        elif res.status_code == requests.codes.OK:  # pylint: disable=no-member
+            # The server ignored the range or the content changed
+            self._run_response(res, 0)
+        else:
+            res.close()
+            # This is an Infrastructure error because the validate function
+            # checked that the file does exist.
+            raise InfrastructureError(
+                "Unable to download '%s' (%d)" % (self.url, res.status_code)
+            )
+
+    def _run_response(self, res, start):
+        try:
+            if start:
+                self._check_range(res, start)
+            self._set_ranges([[start, None, 0]])
+            self._write(res, 0)
+        finally:
+            res.close()
+
+    def _run_range(self, index, res=None):
+        (start, end, _) = self.ranges[index]
+        try:
+            if res is None:
+                res = self._get(start, end)
+            if res.status_code != requests.codes.partial:
+                raise InfrastructureError(
+                    "Unable to download '%s' (%d)" % (self.url, res.status_code)
+                )
+            self._check_range(res, start)
+            self._write(res, index)
+        except requests.RequestException as exc:
+            self._fail("Unable to download '%s': %s" % (self.url, str(exc)))
+        except Exception as exc:  # pylint: disable=broad-except
+            self._fail(str(exc))
+        finally:
+            if res is not None:
+                res.close()
+
+    def _run_segments(self):
+        length = math.ceil((self.size - self.offset) / self.segments)
+        ranges = [
+            [start, min(start + length, self.size), 0]
+            for start in range(self.offset, self.size, length)
+        ]
+        # The first request tells if the content is still the same
+        res = self._get(ranges[0][0], ranges[0][1])
+        if res.status_code == requests.codes.OK:  # pylint: disable=no-member
+            self._run_response(res, 0)
+            return
+        if res.status_code != requests.codes.partial:
+            res.close()
+            raise InfrastructureError(
+                "Unable to download '%s' (%d)" % (self.url, res.status_code)
+            )
+        self._set_ranges(ranges)
+        threads = [
+            threading.Thread(
+                target=self._run_range,
+                args=(index, res if index == 0 else None),
+                name="http-range-%d" % index,
+                daemon=True,
+            )
+            for index in range(len(ranges))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run(self):
+        """
+        Download the file, to be called in a background thread.
+        """
+        try:
+            if not self.cancelled:
+                if self.segments > 1 and self.size > self.offset:
+                    self._run_segments()
+                else:
+                    self._run_stream()
+        except requests.RequestException as exc:
+            self._fail("Unable to download '%s': %s" % (self.url, str(exc)))
+        except Exception as exc:  # pylint: disable=broad-except
+            self._fail(str(exc))
+        finally:
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def read(self):
+        """
+        Yield the content of the file, waiting for the download.
+        """
+        with open(self.filename, "rb") as f_in:
+            position = 0
+            while True:
+                with self.condition:
+                    while not self.done and self.error is None:
+                        if self.available is not None and position < self.available:
+                            break
+                        self.condition.wait(1)
+                    (available, done, error) = (self.available, self.done, self.error)
+                if error is not None:
+                    raise InfrastructureError(error)
+                if available is not None and position < available:
+                    buff = f_in.read(
+                        min(available - position, FILE_DOWNLOAD_CHUNK_SIZE)
+                    )
+                    position += len(buff)
+                    yield buff
+                elif done:
+                    return
+
+    def stop(self, timeout=5):
+        """
+        Stop the download and wait for the threads.
+        Return the number of contiguous bytes in the file that can be reused
+        by a later download, 0 if none.
+        """
+        with self.condition:
+            self.cancelled = True
+            self.condition.wait_for(lambda: self.done, timeout)
+            if not self.done or not self.validator or not self.available:
+                return 0
+            available = self.available
+        with contextlib.suppress(OSError):
+            os.truncate(self.filename, available)
+            return available
+        return 0
+
+
 class HttpDownloadAction(DownloadHandler):
     """
     Download a resource over http or https using requests module
@@ -547,6 +954,111 @@ class HttpDownloadAction(DownloadHandler):
     name = "http-download"
     description = "use http to download the file"
     summary = "http download"
+    cacheable = True
+    # requests.Session is not thread-safe: one session per thread, all of them
+    # sharing the connection pools of the same adapter.
+    adapter = None
+    sessions = threading.local()
+    sessions_lock = threading.Lock()
+
+    def __init__(self, key, path, url, uniquify=True):
+        super().__init__(key, path, url, uniquify)
+        self.validators = None
+        self.accept_ranges = False
+        self.prefetched = None
+        # (filename, size) of the content received before a failure
+        self.partial = None
+
+    @classmethod
+    def http_session(cls):
+        session = getattr(cls.sessions, "session", None)
+        if session is None:
+            with cls.sessions_lock:
+                if cls.adapter is None:
+                    cls.adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=HTTP_DOWNLOAD_POOL_SIZE,
+                        pool_maxsize=HTTP_DOWNLOAD_POOL_SIZE,
+                    )
+            session = requests.Session()
+            session.mount("http://", cls.adapter)
+            session.mount("https://", cls.adapter)
+            cls.sessions.session = session
+        return session
+
+    def cache_validators(self):
+        return self.validators
+
+    def prefetch(self, executor):
+        """
+        Start the download in the background, using the given executor.
+        Return True if the download was started.
+        """
+        if self.prefetched is not None:
+            return False
+        if "images" in self.parameters and self.key in self.parameters["images"]:
+            remote = self.parameters["images"][self.key]
+        else:
+            remote = self.parameters[self.key]
+        # The cached files are downloaded by run(), holding the lock of the
+        # cache entry, so that the jobs of the dispatcher download each file
+        # only once.
+        (_, key) = self.download_cache(remote)
+        if key is not None:
+            return False
+        try:
+            self.prefetched = self.fetch()
+        except OSError as exc:
+            self.logger.warning("Unable to prefetch %s: %s", self.key, str(exc))
+            return False
+        executor.submit(self.prefetched.run)
+        return True
+
+    def cancel_prefetch(self):
+        if self.prefetched is not None:
+            self.prefetched.stop()
+            remove_file(self.prefetched.filename)
+            self.prefetched = None
+
+    def fetch(self):
+        """
+        Return the HttpFetch for the file, continuing the previous attempt if
+        any.
+        """
+        segments = 1
+        if self.accept_ranges and self.size > 0:
+            config = self.job.parameters.get("dispatcher", {})
+            segments = min(
+                int(config.get("download_segments", DISPATCHER_DOWNLOAD_SEGMENTS)),
+                self.size // HTTP_DOWNLOAD_SEGMENT_SIZE,
+            )
+        validator = None
+        if self.validators is not None:
+            # Weak ETags cannot be used with If-Range
+            etag = self.validators["etag"]
+            if etag and not etag.startswith("W/"):
+                validator = etag
+            else:
+                validator = self.validators["last-modified"]
+
+        (partial, self.partial) = (self.partial, None)
+        if partial is not None and validator is not None:
+            (filename, offset) = partial
+        else:
+            if partial is not None:
+                remove_file(partial[0])
+            filename = os.path.join(
+                self.mkdtemp(), os.path.basename(self.url.path) or self.key
+            )
+            offset = 0
+        return HttpFetch(
+            self.http_session,
+            self.url.geturl(),
+            filename,
+            offset=offset,
+            validator=validator,
+            size=self.size,
+            segments=max(segments, 1),
+        )
 
     def validate(self):
         super().validate()
@@ -554,19 +1066,23 @@ class HttpDownloadAction(DownloadHandler):
         try:
             self.logger.debug("Validating that %s exists", self.url.geturl())
             # Force the non-use of Accept-Encoding: gzip, this will permit to know the final size
-            res = requests.head(
-                self.url.geturl(), allow_redirects=True, headers={"Accept-Encoding": ""}
+            res = self.http_session().head(
+                self.url.geturl(),
+                allow_redirects=True,
+                headers={"Accept-Encoding": ""},
+                timeout=(HTTP_DOWNLOAD_CONNECT_TIMEOUT, HTTP_DOWNLOAD_READ_TIMEOUT),
             )
             if res.status_code != requests.codes.OK:  # pylint: disable=no-member
                 # try using (the slower) get for services with broken redirect support
                 self.logger.debug("Using GET because HEAD is not supported properly")
                 res.close()
                 # Like for HEAD, we need get a size, so disable gzip
-                res = requests.get(
+                res = self.http_session().get(
                     self.url.geturl(),
                     allow_redirects=True,
                     stream=True,
                     headers={"Accept-Encoding": ""},
+                    timeout=(HTTP_DOWNLOAD_CONNECT_TIMEOUT, HTTP_DOWNLOAD_READ_TIMEOUT),
                 )
                 if res.status_code != requests.codes.OK:  # pylint: disable=no-member
                     self.errors = "Resource unavailable at '%s' (%d)" % (
@@ -575,6 +1091,17 @@ class HttpDownloadAction(DownloadHandler):
                     )
 
             self.size = int(res.headers.get("content-length", -1))
+            self.accept_ranges = res.headers.get("accept-ranges", "") == "bytes"
+            # Without ETag or Last-Modified, the content can only be cached
+            # when the checksum is known.
+            etag = res.headers.get("etag")
+            last_modified = res.headers.get("last-modified")
+            if etag or last_modified:
+                self.validators = {
+                    "etag": etag,
+                    "last-modified": last_modified,
+                    "size": self.size,
+                }
         except requests.Timeout:
             self.logger.error("Request timed out")
             self.errors = "'%s' timed out" % (self.url.geturl())
@@ -586,26 +1113,32 @@ class HttpDownloadAction(DownloadHandler):
                 res.close()
 
     def reader(self):
-        res = None
+        # Follow the download started in the background if any. In case of
+        # failure, the content received so far is kept: the retry reads it
+        # again from the disk and only downloads the missing bytes.
+        (fetch, self.prefetched) = (self.prefetched, None)
+        if fetch is not None:
+            self.logger.debug("Using the download started with the deploy action")
+        else:
+            fetch = self.fetch()
+            threading.Thread(
+                target=fetch.run, name="http-download", daemon=True
+            ).start()
+        if fetch.offset:
+            self.logger.info("Resuming the download after %d bytes", fetch.offset)
+        if fetch.segments > 1:
+            self.logger.debug("Downloading %d ranges in parallel", fetch.segments)
+
+        completed = False
         try:
-            # FIXME: When requests 3.0 is released, use the enforce_content_length
-            # parameter to raise an exception the file is not fully downloaded
-            res = requests.get(self.url.geturl(), allow_redirects=True, stream=True)
-            if res.status_code != requests.codes.OK:  # pylint: disable=no-member
-                # This is an Infrastructure error because the validate function
-                # checked that the file does exist.
-                raise InfrastructureError(
-                    "Unable to download '%s'" % (self.url.geturl())
-                )
-            for buff in res.iter_content(HTTP_DOWNLOAD_CHUNK_SIZE):
-                yield buff
-        except requests.RequestException as exc:
-            raise InfrastructureError(
-                "Unable to download '%s': %s" % (self.url.geturl(), str(exc))
-            )
+            yield from fetch.read()
+            completed = True
         finally:
-            if res is not None:
-                res.close()
+            available = fetch.stop()
+            if completed or not available:
+                remove_file(fetch.filename)
+            else:
+                self.partial = (fetch.filename, available)
 
 
 class ScpDownloadAction(DownloadHandler):
@@ -616,6 +1149,7 @@ class ScpDownloadAction(DownloadHandler):
     name = "scp-download"
     description = "Use scp to copy the file"
     summary = "scp download"
+    cacheable = True
 
     def validate(self):
         super().validate()
@@ -33,6 +33,7 @@ from lava_dispatcher.actions.deploy.testdef import (
 from lava_dispatcher.logical import Deployment
 from lava_dispatcher.utils.contextmanager import chdir
 from lava_dispatcher.utils.filesystem import check_ssh_identity_file
+from lava_dispatcher.utils.fragments import OverlayTarball
 from lava_dispatcher.utils.shell import which
 from lava_dispatcher.utils.network import rpcinfo_nfs
 from lava_dispatcher.protocols.multinode import MultinodeProtocol
@@ -519,17 +520,24 @@ class CompressOverlay(Action):
             self.logger.error(self.errors)
             return connection
         connection = super().run(connection, max_end_time)
+        # Compressed content of the test definitions restored from the cache
+        cached = self.get_namespace_data(action="test", label="shared", key="fragments")
         with chdir(location):
             try:
-                with tarfile.open(output, "w:gz") as tar:
+                with OverlayTarball(output, cached) as tar:
                     tar.add(".%s" % lava_test_results_dir)
                     # ssh authorization support
                     if os.path.exists("./root/"):
                         tar.add(".%s" % "/root/")
-            except tarfile.TarError as exc:
+            except (OSError, tarfile.TarError) as exc:
                 raise InfrastructureError(
                     "Unable to create lava overlay tarball: %s" % exc
                 )
+        if tar.reused:
+            self.logger.debug(
+                "Reused the compressed content of %d bytes of test definitions",
+                tar.reused,
+            )
 
         self.set_namespace_data(
             action=self.name, label="output", key="file", value=output
@@ -18,6 +18,7 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import contextlib
 import os
 import io
 import re
@@ -26,11 +27,18 @@ import base64
 import hashlib
 import tarfile
 import shutil
+import zlib
 from collections import OrderedDict
 from nose.tools import nottest
 from lava_common.exceptions import InfrastructureError, JobError, LAVABug, TestError
 from lava_dispatcher.action import Action, Pipeline
 from lava_dispatcher.actions.test import TestAction
+from lava_dispatcher.utils.cache import DownloadCache, cache_key, link_file
+from lava_dispatcher.utils.fragments import (
+    build_fragment,
+    fragment_files,
+    restore_fragment,
+)
 from lava_dispatcher.utils.strings import indices
 from lava_dispatcher.utils.vcs import BzrHelper, GitHelper
 from lava_common.constants import DEFAULT_TESTDEF_NAME_CLASS, DISPATCHER_DOWNLOAD_DIR
@@ -262,6 +270,95 @@ class GitRepoAction(RepoAction):  # pylint: disable=too-many-public-methods
     def accepts(cls, repo_type):
         return repo_type == "git"
 
+    def clone(self, runner_path, shallow, revision, branch, history):
+        """
+        Clone the repository, or restore the clone from the download cache
+        when the same commit was already cloned on this dispatcher. The
+        compressed files are then reused by the compress-overlay action.
+        """
+        cache = DownloadCache.from_config(self.job.parameters.get("dispatcher", {}))
+        commit = None
+        if cache is not None:
+            commit = self.vcs.resolve(revision=revision, branch=branch)
+        if commit is None:
+            return self.vcs.clone(
+                runner_path,
+                shallow=shallow,
+                revision=revision,
+                branch=branch,
+                history=history,
+            )
+
+        repository = self.parameters["repository"]
+        key = cache_key(
+            repository,
+            validators={
+                "commit": commit,
+                "branch": branch,
+                "shallow": shallow,
+                "history": history,
+            },
+        )
+        fragment = os.path.join(self.mkdtemp(), "fragment")
+        with cache.lock(key):
+            entry = cache.get(key)
+            if entry is not None:
+                (filename, metadata) = entry
+                self.logger.info("Using the cached clone of %s", repository)
+                try:
+                    link_file(filename, fragment)
+                    files = restore_fragment(fragment, metadata["members"], runner_path)
+                except (OSError, KeyError, ValueError, zlib.error) as exc:
+                    self.logger.warning("Invalid cache entry %s: %s", key, str(exc))
+                    cache.remove(key)
+                    if os.path.exists(runner_path):
+                        shutil.rmtree(runner_path)
+                    entry = None
+            if entry is None:
+                commit_id = self.vcs.clone(
+                    runner_path,
+                    shallow=shallow,
+                    revision=revision,
+                    branch=branch,
+                    history=history,
+                )
+                # The branch moved after the call to resolve()
+                if commit_id != commit:
+                    return commit_id
+                f_tmp = cache.tempfile()
+                try:
+                    with f_tmp:
+                        members = build_fragment(runner_path, f_tmp)
+                    link_file(f_tmp.name, fragment)
+                    cache.insert(
+                        key,
+                        f_tmp.name,
+                        {
+                            "url": repository,
+                            "commit": commit,
+                            "size": os.stat(fragment).st_size,
+                            "members": members,
+                        },
+                    )
+                except OSError as exc:
+                    self.logger.warning(
+                        "Unable to store %s in the download cache: %s",
+                        repository,
+                        str(exc),
+                    )
+                    with contextlib.suppress(OSError):
+                        os.unlink(f_tmp.name)
+                    return commit_id
+                files = fragment_files(fragment, members, runner_path)
+
+        cached = self.get_namespace_data(action="test", label="shared", key="fragments")
+        cached = dict(cached or {})
+        cached.update(files)
+        self.set_namespace_data(
+            action="test", label="shared", key="fragments", value=cached
+        )
+        return commit
+
     def run(self, connection, max_end_time):
         """
         Clones the git repo into a directory name constructed from the mount_path,
@@ -298,7 +395,7 @@ class GitRepoAction(RepoAction):  # pylint: disable=too-many-public-methods
         if not revision:
             shallow = self.parameters.get("shallow", True)
 
-        commit_id = self.vcs.clone(
+        commit_id = self.clone(
             runner_path,
             shallow=shallow,
             revision=revision,
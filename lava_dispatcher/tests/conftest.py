@@ -26,7 +26,7 @@ import requests
 
 @pytest.fixture(autouse=True)
 def no_network(monkeypatch, request):
-    def get(url, allow_redirects, stream, headers):
+    def get(url, allow_redirects, stream, headers, timeout=None):
         assert allow_redirects is True  # nosec - unit test support
         assert stream is True  # nosec - unit test support
         res = requests.Response()
@@ -34,7 +34,7 @@ def no_network(monkeypatch, request):
         res.close = lambda: None
         return res
 
-    def head(url, allow_redirects, headers):
+    def head(url, allow_redirects, headers, timeout=None):
         assert allow_redirects is True  # nosec - unit test support
         print(url)
         res = requests.Response()
@@ -45,10 +45,19 @@ def no_network(monkeypatch, request):
     # List of tests that should have access to the network
     # When pytest is mandatory, we can use pytest marks
     # See https://stackoverflow.com/a/38763328
-    skip_tests = set(["test_download_decompression", "TestChecksum", "test_xz_nfs"])
+    skip_tests = set(
+        ["test_download_decompression", "TestChecksum", "test_xz_nfs", "TestHttpFetch"]
+    )
     if not skip_tests & set(request.keywords.keys()):
         monkeypatch.setattr(requests, "head", head)
         monkeypatch.setattr(requests, "get", get)
+        # The downloads use a requests.Session
+        monkeypatch.setattr(
+            requests.Session, "head", lambda session, url, **kwargs: head(url, **kwargs)
+        )
+        monkeypatch.setattr(
+            requests.Session, "get", lambda session, url, **kwargs: get(url, **kwargs)
+        )
 
     # Fake netifaces to always return the same results
     def gateways():
@@ -18,13 +18,19 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import bz2
 import copy
+import gzip
+import lzma
 import os
 import hashlib
-from lava_common.exceptions import InfrastructureError
+from lava_common.exceptions import InfrastructureError, JobError
 from lava_dispatcher.tests.test_basic import Factory, StdoutTestCase
 from lava_dispatcher.utils.compression import decompress_file
 from lava_dispatcher.utils.compression import decompress_command_map
+from lava_dispatcher.utils.compression import StreamDecompressor
+from lava_dispatcher.utils.compression import DECOMPRESS_CHUNK_SIZE
+from lava_dispatcher.utils.stream import Stage, StreamPipeline
 
 
 class TestDecompression(StdoutTestCase):
@@ -109,3 +115,80 @@ class TestDecompression(StdoutTestCase):
         with self.assertRaises(InfrastructureError):
             decompress_file("/tmp/test.xz", "zip")  # nosec - unit test only.
         self.assertEqual(copy_of_command_map, decompress_command_map)
+
+
+class TestStreamDecompression(StdoutTestCase):
+    def decompress(self, compression, data, chunk_size=4096):
+        decompressor = StreamDecompressor(compression)
+        output = b"".join(
+            piece
+            for i in range(0, len(data), chunk_size)
+            for piece in decompressor.decompress(data[i : i + chunk_size])
+        )
+        decompressor.close()
+        return output
+
+    def test_formats(self):
+        data = os.urandom(100000) + b"lava" * 100000
+        for (compression, compress) in [
+            ("gz", gzip.compress),
+            ("bz2", bz2.compress),
+            ("xz", lzma.compress),
+        ]:
+            self.assertEqual(self.decompress(compression, compress(data)), data)
+            # Concatenated streams, with padding
+            self.assertEqual(
+                self.decompress(
+                    compression, compress(data) + b"\0" * 4 + compress(data)
+                ),
+                data * 2,
+            )
+
+    def test_bounded_output(self):
+        # Sparse images are highly compressible: the output of a single input
+        # chunk should not be decompressed in memory at once.
+        data = b"\0" * (32 * DECOMPRESS_CHUNK_SIZE)
+        for (compression, compress) in [
+            ("gz", gzip.compress),
+            ("bz2", bz2.compress),
+            ("xz", lzma.compress),
+        ]:
+            decompressor = StreamDecompressor(compression)
+            compressed = compress(data)
+            size = 0
+            for piece in decompressor.decompress(compressed):
+                self.assertLessEqual(len(piece), DECOMPRESS_CHUNK_SIZE)
+                self.assertEqual(piece.count(b"\0"), len(piece))
+                size += len(piece)
+            decompressor.close()
+            self.assertEqual(size, len(data), compression)
+
+    def test_errors(self):
+        with self.assertRaises(JobError):
+            self.decompress("xz", b"not compressed" * 100)
+        with self.assertRaises(JobError):
+            self.decompress("gz", gzip.compress(b"lava" * 1000)[:-10])
+
+
+class TestStreamPipeline(StdoutTestCase):
+    def test_stages(self):
+        (first, second) = ([], [])
+        stages = [Stage("first", first.append), Stage("second", second.append)]
+        with StreamPipeline(stages, chunk_size=10) as pipeline:
+            for _ in range(25):
+                pipeline.put(b"1234")
+        self.assertEqual(b"".join(first), b"1234" * 25)
+        self.assertEqual(b"".join(second), b"1234" * 25)
+        # The chunks are grouped
+        self.assertEqual(len(first), 9)
+        self.assertEqual(pipeline.stats()[0][:2], ("first", 100))
+
+    def test_error(self):
+        def fail(data):
+            raise JobError("failure")
+
+        stages = [Stage("first", lambda data: None), Stage("second", fail)]
+        with self.assertRaises(JobError):
+            with StreamPipeline(stages, chunk_size=1) as pipeline:
+                for _ in range(100):
+                    pipeline.put(b"1234")
@@ -18,14 +18,22 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import concurrent.futures
+import http.server
 import os
+import shutil
+import tempfile
+import threading
 import unittest
 from lava_dispatcher.device import NewDevice
 from lava_dispatcher.parser import JobParser
-from lava_common.exceptions import JobError
+from lava_common.exceptions import InfrastructureError, JobError
 from lava_dispatcher.tests.test_basic import Factory, StdoutTestCase
 from lava_dispatcher.actions.deploy import DeployAction
+from lava_dispatcher.actions.deploy import download
+from lava_dispatcher.actions.deploy.download import HttpDownloadAction, HttpFetch
 from lava_dispatcher.tests.utils import infrastructure_error_multi_paths
+from lava_dispatcher.utils.cache import DownloadCache, cache_key, clone_file
 
 
 class TestDownloadDeploy(StdoutTestCase):  # pylint: disable=too-many-public-methods
@@ -63,3 +71,218 @@ class TestDownloadDeploy(StdoutTestCase):  # pylint: disable=too-many-public-met
         job = self.factory.create_job("bbb-01.jinja2", "sample_jobs/download_dir.yaml")
         with self.assertRaises(JobError):
             job.validate()
+
+
+class TestDownloadCache(StdoutTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = DownloadCache(os.path.join(self.tmpdir, "cache"), 10)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def add(self, key, data):
+        with self.cache.lock(key):
+            with self.cache.tempfile() as f_tmp:
+                f_tmp.write(data)
+            self.cache.insert(
+                key,
+                f_tmp.name,
+                {"url": key, "size": len(data), "md5": "", "sha256": ""},
+            )
+
+    def test_key(self):
+        self.assertEqual(cache_key("http://a/b", sha256sum="ABC"), "sha256-abc")
+        self.assertEqual(cache_key("http://a/b", md5sum="abc"), "md5-abc")
+        self.assertIsNone(cache_key("http://a/b"))
+        key = cache_key("http://a/b", validators={"etag": "1"})
+        self.assertTrue(key.startswith("url-"))
+        self.assertNotEqual(key, cache_key("http://a/b", validators={"etag": "2"}))
+        self.assertNotEqual(key, cache_key("http://a/c", validators={"etag": "1"}))
+
+    def test_config(self):
+        self.assertIsNone(DownloadCache.from_config({}))
+        cache = DownloadCache.from_config({"download_cache": {"size": 42}})
+        self.assertEqual(cache.size, 42)
+        cache = DownloadCache.from_config({"download_cache": {"path": self.tmpdir}})
+        self.assertEqual(cache.path, self.tmpdir)
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get("md5-1"))
+        self.add("md5-1", b"hello")
+        (filename, metadata) = self.cache.get("md5-1")
+        self.assertEqual(metadata["size"], 5)
+        target = os.path.join(self.tmpdir, "target")
+        clone_file(filename, target)
+        with open(target, "rb") as f_in:
+            self.assertEqual(f_in.read(), b"hello")
+        # Modifying the copy does not change the cache
+        with open(target, "wb") as f_out:
+            f_out.write(b"world")
+        with open(filename, "rb") as f_in:
+            self.assertEqual(f_in.read(), b"hello")
+
+    def test_evict(self):
+        self.add("md5-1", b"12345")
+        os.utime(os.path.join(self.cache.path, "md5-1.json"), (0, 0))
+        self.add("md5-2", b"12345")
+        self.assertIsNotNone(self.cache.get("md5-1"))
+        self.assertIsNotNone(self.cache.get("md5-2"))
+        os.utime(os.path.join(self.cache.path, "md5-2.json"), (0, 0))
+        # md5-2 is now the least recently used
+        self.add("md5-3", b"123")
+        self.assertIsNotNone(self.cache.get("md5-1"))
+        self.assertIsNone(self.cache.get("md5-2"))
+        self.assertIsNotNone(self.cache.get("md5-3"))
+
+    def test_lock(self):
+        self.add("md5-1", b"12345")
+        self.add("md5-2", b"12345")
+        with self.cache.lock("md5-1"):
+            with self.cache.lock("md5-1", blocking=False) as locked:
+                self.assertFalse(locked)
+            # Locked entries are not evicted
+            self.add("md5-3", b"12345")
+            self.assertIsNotNone(self.cache.get("md5-1"))
+            self.assertIsNone(self.cache.get("md5-2"))
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve the content with a strong ETag, honoring Range and If-Range.
+    """
+
+    etag = '"lava-1"'
+    content = b""
+    requests = []
+    # Stop sending after this number of bytes, until the event is set
+    stall = None
+    resume = threading.Event()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path != "/image":
+            self.send_error(404)
+            return
+        (start, end) = (0, len(self.content))
+        ranges = self.headers.get("Range")
+        self.requests.append(ranges)
+        if ranges and self.headers.get("If-Range", self.etag) == self.etag:
+            (first, last) = ranges[len("bytes=") :].split("-")
+            start = int(first)
+            end = int(last) + 1 if last else len(self.content)
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes %d-%d/%d" % (start, end - 1, len(self.content))
+            )
+        else:
+            self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        if self.stall is not None:
+            self.wfile.write(self.content[start : start + self.stall])
+            self.wfile.flush()
+            self.resume.wait(5)
+            return
+        self.wfile.write(self.content[start:end])
+
+
+class TestHttpFetch(StdoutTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "image")
+        self.data = os.urandom(1024 * 1024)
+        RangeHandler.content = self.data
+        RangeHandler.requests = []
+        RangeHandler.stall = None
+        RangeHandler.resume.clear()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%d/image" % self.server.server_port
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        super().tearDown()
+        RangeHandler.resume.set()
+        self.executor.shutdown()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def fetch(self, url=None, **kwargs):
+        fetch = HttpFetch(
+            HttpDownloadAction.http_session,
+            url or self.url,
+            self.filename,
+            size=len(self.data),
+            **kwargs
+        )
+        self.executor.submit(fetch.run)
+        return fetch
+
+    def test_read(self):
+        fetch = self.fetch()
+        self.assertEqual(b"".join(fetch.read()), self.data)
+        self.assertEqual(fetch.stop(), 0)
+        self.assertEqual(RangeHandler.requests, [None])
+
+    def test_error(self):
+        fetch = self.fetch(url=self.url + ".missing")
+        with self.assertRaises(InfrastructureError):
+            b"".join(fetch.read())
+
+    def test_stalled(self):
+        # Complete chunks only: the last chunk is lost on timeout
+        RangeHandler.stall = 8 * download.HTTP_DOWNLOAD_CHUNK_SIZE
+        original = download.HTTP_DOWNLOAD_READ_TIMEOUT
+        download.HTTP_DOWNLOAD_READ_TIMEOUT = 0.5
+        try:
+            fetch = self.fetch()
+            with self.assertRaises(InfrastructureError):
+                b"".join(fetch.read())
+        finally:
+            download.HTTP_DOWNLOAD_READ_TIMEOUT = original
+        # The partial content is kept to resume the download
+        self.assertEqual(os.path.getsize(self.filename), RangeHandler.stall)
+
+    def test_resume(self):
+        with open(self.filename, "wb") as f_out:
+            f_out.write(self.data[:300000])
+        fetch = self.fetch(offset=300000, validator=RangeHandler.etag)
+        # The bytes already received are read again from the file
+        self.assertEqual(b"".join(fetch.read()), self.data)
+        self.assertEqual(RangeHandler.requests, ["bytes=300000-"])
+
+    def test_resume_changed(self):
+        with open(self.filename, "wb") as f_out:
+            f_out.write(b"0" * 300000)
+        fetch = self.fetch(offset=300000, validator='"lava-0"')
+        self.assertEqual(b"".join(fetch.read()), self.data)
+
+    def test_resume_without_validator(self):
+        with open(self.filename, "wb") as f_out:
+            f_out.write(b"0" * 300000)
+        fetch = self.fetch(offset=300000)
+        self.assertEqual(b"".join(fetch.read()), self.data)
+        self.assertEqual(RangeHandler.requests, [None])
+
+    def test_segments(self):
+        fetch = self.fetch(validator=RangeHandler.etag, segments=4)
+        self.assertEqual(b"".join(fetch.read()), self.data)
+        self.assertEqual(
+            sorted(RangeHandler.requests),
+            [
+                "bytes=0-262143",
+                "bytes=262144-524287",
+                "bytes=524288-786431",
+                "bytes=786432-1048575",
+            ],
+        )
+        self.assertEqual(fetch.stop(), len(self.data))
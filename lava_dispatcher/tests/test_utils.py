@@ -21,6 +21,7 @@
 import os
 import shutil
 import subprocess  # nosec - unit test support.
+import tarfile
 import tempfile
 import unittest
 
@@ -32,7 +33,7 @@ from lava_dispatcher.tests.utils import infrastructure_error
 from lava_common.exceptions import InfrastructureError, JobError
 from lava_common.utils import debian_filename_version
 from lava_dispatcher.action import Action
-from lava_dispatcher.utils import vcs, installers
+from lava_dispatcher.utils import fragments, vcs, installers
 from lava_dispatcher.utils.decorator import replace_exception
 from lava_dispatcher.utils.shell import which
 
@@ -184,6 +185,91 @@ class TestGit(StdoutTestCase):  # pylint: disable=too-many-public-methods
             os.path.exists(os.path.join(self.tmpdir, "git.clone1", ".git"))
         )
 
+    def test_resolve(self):
+        git = vcs.GitHelper("git")
+        self.assertEqual(git.resolve(), "a7af835862da0e0592eeeac901b90e8de2cf5b67")
+        self.assertEqual(
+            git.resolve(branch="testing"), "f2589a1b7f0cfc30ad6303433ba4d5db1a542c2d"
+        )
+        self.assertEqual(
+            git.resolve(revision="2f83e6d8189025e356a9563b8d78bdc8e2e9a3ed"),
+            "2f83e6d8189025e356a9563b8d78bdc8e2e9a3ed",
+        )
+        self.assertIsNone(git.resolve(revision="2f83e6d"))
+        self.assertIsNone(vcs.GitHelper("does_not_exists").resolve())
+
+
+class TestFragments(StdoutTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, "src")
+        os.makedirs(os.path.join(self.src, "tests"))
+        self.data = os.urandom(100000)
+        with open(os.path.join(self.src, "data"), "wb") as f_out:
+            f_out.write(self.data)
+        with open(os.path.join(self.src, "tests", "run.sh"), "w") as f_out:
+            f_out.write("#!/bin/sh\n")
+        os.chmod(os.path.join(self.src, "tests", "run.sh"), 0o755)
+        open(os.path.join(self.src, "empty"), "w").close()
+        os.symlink("data", os.path.join(self.src, "link"))
+        self.fragment = os.path.join(self.tmpdir, "fragment")
+        with open(self.fragment, "wb") as f_out:
+            self.members = fragments.build_fragment(self.src, f_out)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def overlay(self, cached):
+        output = os.path.join(self.tmpdir, "overlay.tar.gz")
+        cwd = os.getcwd()
+        os.chdir(os.path.join(self.tmpdir, "overlay"))
+        try:
+            with fragments.OverlayTarball(output, cached) as tar:
+                tar.add("./lava-1")
+        finally:
+            os.chdir(cwd)
+        return (output, tar.reused)
+
+    def test_restore(self):
+        dest = os.path.join(self.tmpdir, "overlay", "lava-1", "0", "tests", "0_test")
+        cached = fragments.restore_fragment(self.fragment, self.members, dest)
+        self.assertEqual(
+            sorted(cached),
+            [os.path.join(dest, "data"), os.path.join(dest, "tests", "run.sh")],
+        )
+        with open(os.path.join(dest, "data"), "rb") as f_in:
+            self.assertEqual(f_in.read(), self.data)
+        self.assertEqual(os.readlink(os.path.join(dest, "link")), "data")
+        self.assertEqual(os.stat(os.path.join(dest, "empty")).st_size, 0)
+        self.assertTrue(os.access(os.path.join(dest, "tests", "run.sh"), os.X_OK))
+
+        (output, reused) = self.overlay(cached)
+        self.assertEqual(reused, len(self.data) + len("#!/bin/sh\n"))
+        with tarfile.open(output) as tar:
+            self.assertEqual(
+                tar.extractfile("./lava-1/0/tests/0_test/data").read(), self.data
+            )
+            self.assertEqual(
+                tar.extractfile("./lava-1/0/tests/0_test/tests/run.sh").read(),
+                b"#!/bin/sh\n",
+            )
+            self.assertTrue(tar.getmember("./lava-1/0/tests/0_test/link").issym())
+
+    def test_modified(self):
+        dest = os.path.join(self.tmpdir, "overlay", "lava-1", "0", "tests", "0_test")
+        cached = fragments.restore_fragment(self.fragment, self.members, dest)
+        with open(os.path.join(dest, "data"), "wb") as f_out:
+            f_out.write(b"modified")
+        (output, reused) = self.overlay(cached)
+        # Only the unmodified file is reused
+        self.assertEqual(reused, len("#!/bin/sh\n"))
+        with tarfile.open(output) as tar:
+            self.assertEqual(
+                tar.extractfile("./lava-1/0/tests/0_test/data").read(), b"modified"
+            )
+
 
 @unittest.skipIf(infrastructure_error("bzr"), "bzr not installed")
 class TestBzr(StdoutTestCase):  # pylint: disable=too-many-public-methods
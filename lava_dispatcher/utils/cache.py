@@ -0,0 +1,218 @@
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+# Download cache shared by all the jobs running on a dispatcher.
+#
+# The entries are the files as downloaded (before any decompression):
+#   <key>.data   the content
+#   <key>.json   url, size, md5 and sha256 of the content
+#   <key>.lock   held while the entry is downloaded, used or removed
+# The key is the checksum given in the job definition when available,
+# otherwise a hash of the url and of the validators sent by the server.
+# The clones of the test definition repositories are stored as overlay
+# fragments (see fragments.py), the key being a hash of the url and commit.
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from lava_common.constants import (
+    DISPATCHER_DOWNLOAD_CACHE_DIR,
+    DISPATCHER_DOWNLOAD_CACHE_SIZE,
+)
+from lava_common.exceptions import InfrastructureError
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def cache_key(url, md5sum=None, sha256sum=None, validators=None):
+    """
+    Return the key of the entry or None if the content cannot be identified.
+    """
+    if sha256sum:
+        return "sha256-%s" % sha256sum.lower()
+    if md5sum:
+        return "md5-%s" % md5sum.lower()
+    if validators:
+        data = json.dumps([url, validators], sort_keys=True).encode("utf-8")
+        return "url-%s" % hashlib.sha256(data).hexdigest()
+    return None
+
+
+def clone_file(src, dst):
+    """
+    Copy src to dst, sharing the blocks (reflink) when the filesystem allows
+    it. Hardlinks are not used as some actions modify the images in place.
+    """
+    with open(src, "rb") as f_src:
+        with open(dst, "wb") as f_dst:
+            try:
+                fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+                return
+            except OSError:
+                pass
+            shutil.copyfileobj(f_src, f_dst, 1024 * 1024)
+
+
+def link_file(src, dst):
+    """
+    Make dst point to the content of src, even after src is removed from the
+    cache. Only for files that are never modified in place.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        clone_file(src, dst)
+
+
+class DownloadCache:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    @classmethod
+    def from_config(cls, dispatcher_config):
+        """
+        Return the cache configured in the dispatcher configuration, None if
+        the cache is disabled.
+        """
+        config = dispatcher_config.get("download_cache")
+        if config is None:
+            return None
+        if not isinstance(config, dict):
+            config = {}
+        return cls(
+            config.get("path", DISPATCHER_DOWNLOAD_CACHE_DIR),
+            int(config.get("size", DISPATCHER_DOWNLOAD_CACHE_SIZE)),
+        )
+
+    def _filename(self, key, ext):
+        return os.path.join(self.path, "%s.%s" % (key, ext))
+
+    @contextlib.contextmanager
+    def lock(self, key, blocking=True):
+        """
+        Lock the entry, waiting for any other process downloading it.
+        When blocking is False, yield False if the lock is already taken.
+        """
+        try:
+            os.makedirs(self.path, mode=0o755, exist_ok=True)
+            f_lock = open(self._filename(key, "lock"), "w")
+        except OSError as exc:
+            raise InfrastructureError(
+                "Unable to lock the download cache '%s': %s" % (self.path, str(exc))
+            )
+        with f_lock:
+            try:
+                fcntl.flock(f_lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f_lock, fcntl.LOCK_UN)
+
+    def get(self, key):
+        """
+        Return (filename, metadata) for the entry or None on a cache miss.
+        The caller should hold the lock.
+        """
+        try:
+            with open(self._filename(key, "json"), "r") as f_meta:
+                metadata = json.load(f_meta)
+            filename = self._filename(key, "data")
+            if os.stat(filename).st_size != metadata["size"]:
+                return None
+            # Mark the entry as recently used
+            os.utime(self._filename(key, "json"))
+        except (OSError, ValueError, KeyError):
+            return None
+        return (filename, metadata)
+
+    def tempfile(self):
+        """
+        Return a temporary file to download a new entry into.
+        """
+        try:
+            os.makedirs(self.path, mode=0o755, exist_ok=True)
+            return tempfile.NamedTemporaryFile(
+                dir=self.path, prefix=".download-", delete=False
+            )
+        except OSError as exc:
+            raise InfrastructureError(
+                "Unable to write to the download cache '%s': %s" % (self.path, str(exc))
+            )
+
+    def insert(self, key, tmp_filename, metadata):
+        """
+        Move the downloaded file into the cache and evict the least recently
+        used entries. The caller should hold the lock.
+        """
+        os.rename(tmp_filename, self._filename(key, "data"))
+        # The metadata is written last: the entry only exists once complete.
+        with open(self._filename(key, "json") + ".tmp", "w") as f_meta:
+            json.dump(metadata, f_meta)
+        os.rename(self._filename(key, "json") + ".tmp", self._filename(key, "json"))
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        Return the list of (last use, size, key) of the entries.
+        """
+        entries = []
+        with contextlib.suppress(OSError):
+            for name in os.listdir(self.path):
+                if not name.endswith(".data"):
+                    continue
+                key = name[: -len(".data")]
+                with contextlib.suppress(OSError):
+                    stat = os.stat(self._filename(key, "data"))
+                    used = stat.st_mtime
+                    # Incomplete entries (no metadata) are the first evicted
+                    with contextlib.suppress(OSError):
+                        used = os.stat(self._filename(key, "json")).st_mtime
+                    entries.append((used, stat.st_size, key))
+        return entries
+
+    def remove(self, key):
+        for ext in ["json", "data"]:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._filename(key, ext))
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits in its
+        size budget. Entries locked by another process are kept.
+        """
+        entries = sorted(self.entries())
+        total = sum(entry[1] for entry in entries)
+        for (_, size, key) in entries:
+            if total <= self.size:
+                break
+            if key == keep:
+                continue
+            with self.lock(key, blocking=False) as locked:
+                if locked:
+                    self.remove(key)
+                    total -= size
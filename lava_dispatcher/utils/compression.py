@@ -24,9 +24,12 @@
 # android images: tar + xz,bz2,gz, or just gz,xz,bzip2
 # vexpress recovery images: any compression though usually zip
 
+import bz2
+import lzma
 import os
 import subprocess  # nosec - internal use.
 import tarfile
+import zlib
 
 from lava_common.exceptions import InfrastructureError, JobError
 
@@ -47,6 +50,73 @@ decompress_command_map = {
     "zip": ["unzip"],
 }
 
+# Decompressors available in python, used when downloading
+stream_decompressors = {
+    "gz": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    "bz2": bz2.BZ2Decompressor,
+    "xz": lzma.LZMADecompressor,
+}
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+
+class StreamDecompressor:
+    """
+    Decompress a stream chunk by chunk, handling the files made of several
+    concatenated streams (like pigz or pxz outputs).
+    """
+
+    def __init__(self, compression):
+        self.compression = compression
+        self.factory = stream_decompressors[compression]
+        self.decompressor = None
+
+    def decompress(self, data):
+        """
+        Decompress data, yielding pieces of at most DECOMPRESS_CHUNK_SIZE
+        bytes: highly compressed data (like sparse images) should not be
+        expanded in memory at once.
+        """
+        try:
+            while data:
+                if self.decompressor is None:
+                    # Skip the padding between the streams
+                    data = data.lstrip(b"\0")
+                    if not data:
+                        break
+                    self.decompressor = self.factory()
+                yield from self._decompress(data)
+                if not self.decompressor.eof:
+                    break
+                data = self.decompressor.unused_data
+                self.decompressor = None
+        except (EOFError, OSError, lzma.LZMAError, zlib.error) as exc:
+            raise JobError(
+                "Unable to decompress the %s data: %s. Make sure the "
+                "'compression' is corresponding to the image file type."
+                % (self.compression, str(exc))
+            )
+
+    def _decompress(self, data):
+        decompressor = self.decompressor
+        while True:
+            output = decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+            if hasattr(decompressor, "needs_input"):
+                # bz2 and lzma keep the remaining input internally
+                data = b""
+                done = decompressor.eof or decompressor.needs_input
+            else:
+                # zlib returns the remaining input in unconsumed_tail
+                data = decompressor.unconsumed_tail
+                done = decompressor.eof or not (data or output)
+            if output:
+                yield output
+            if done:
+                return
+
+    def close(self):
+        if self.decompressor is not None:
+            raise JobError("Truncated %s data" % self.compression)
+
 
 def compress_file(infile, compression):
     if not compression:
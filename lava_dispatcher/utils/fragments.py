@@ -0,0 +1,253 @@
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+# Overlay fragments: a directory tree stored as the compressed content of
+# each of its files, so that the tree can be restored and then added to the
+# overlay tarball without compressing the same content again.
+#
+# The overlay tarball is a multi-member gzip file (RFC 1952), as accepted by
+# gzip, busybox and python: the tar headers are compressed for every job,
+# as the paths contain the job id, while the compressed content of the
+# unmodified files is copied from the fragments.
+#
+# A member of a fragment is the list:
+#   [name, type, mode, mtime, size, offset, length, linkname]
+# with the name relative to the root of the tree, the tarfile type and the
+# position of the compressed content (padded to the tar block size) in the
+# fragment file.
+
+import contextlib
+import io
+import os
+import stat
+import tarfile
+import zlib
+
+# Same compression level as tarfile.open(..., "w:gz")
+GZIP_LEVEL = 9
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def gzip_compressor(level=GZIP_LEVEL):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _copy(f_in, f_out, length, func=None):
+    while length:
+        data = f_in.read(min(length, COPY_CHUNK_SIZE))
+        if not data:
+            raise OSError("Truncated fragment '%s'" % f_in.name)
+        length -= len(data)
+        f_out.write(data if func is None else func(data))
+
+
+def build_fragment(directory, f_out):
+    """
+    Write the compressed content of the files of directory into f_out.
+    Return the list of members.
+    """
+    members = [_member(directory, ".", 0, 0)]
+    offset = 0
+    for (root, dirs, files) in os.walk(directory):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            path = os.path.join(root, name)
+            length = 0
+            if stat.S_ISREG(os.lstat(path).st_mode):
+                compressor = gzip_compressor()
+                size = 0
+                with open(path, "rb") as f_in:
+                    for data in iter(lambda: f_in.read(COPY_CHUNK_SIZE), b""):
+                        size += len(data)
+                        length += f_out.write(compressor.compress(data))
+                if size:
+                    # Pad the content to the tar block size
+                    padding = -size % tarfile.BLOCKSIZE
+                    length += f_out.write(compressor.compress(tarfile.NUL * padding))
+                    length += f_out.write(compressor.flush())
+            member = _member(
+                directory, os.path.relpath(path, directory), offset, length
+            )
+            offset += length
+            if member is not None:
+                members.append(member)
+    return members
+
+
+def _member(directory, relpath, offset, length):
+    path = os.path.join(directory, relpath)
+    st = os.lstat(path)
+    linkname = ""
+    if stat.S_ISLNK(st.st_mode):
+        (kind, linkname) = (tarfile.SYMTYPE, os.readlink(path))
+    elif stat.S_ISDIR(st.st_mode):
+        kind = tarfile.DIRTYPE
+    elif stat.S_ISREG(st.st_mode):
+        kind = tarfile.REGTYPE
+    else:
+        # Sockets, fifos and devices are not part of test definitions
+        return None
+    return [
+        relpath,
+        kind.decode("ascii"),
+        stat.S_IMODE(st.st_mode),
+        int(st.st_mtime),
+        st.st_size if kind == tarfile.REGTYPE else 0,
+        offset,
+        length,
+        linkname,
+    ]
+
+
+def restore_fragment(filename, members, directory):
+    """
+    Recreate the tree stored in the fragment, in directory.
+    Return {path: [filename, offset, length, size, mtime_ns]} for the files
+    whose content can be copied from the fragment into the overlay tarball.
+    """
+    directories = []
+    with open(filename, "rb") as f_in:
+        for (name, kind, mode, mtime, size, offset, length, linkname) in members:
+            path = os.path.normpath(os.path.join(directory, name))
+            kind = kind.encode("ascii")
+            if kind == tarfile.DIRTYPE:
+                os.makedirs(path, exist_ok=True)
+                directories.append((path, mode, mtime))
+                continue
+            if kind == tarfile.SYMTYPE:
+                os.symlink(linkname, path)
+                continue
+            with open(path, "wb") as f_out:
+                if length:
+                    f_in.seek(offset)
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    _copy(f_in, f_out, length, decompressor.decompress)
+                    # Remove the padding
+                    f_out.truncate(size)
+            os.chmod(path, mode)
+            os.utime(path, (mtime, mtime))
+    # Set the directories last, as creating the files changes their mtime
+    for (path, mode, mtime) in reversed(directories):
+        os.chmod(path, mode)
+        os.utime(path, (mtime, mtime))
+    return fragment_files(filename, members, directory)
+
+
+def fragment_files(filename, members, directory):
+    """
+    Return the files of directory, as created from the fragment, in the same
+    form as restore_fragment().
+    """
+    cached = {}
+    for (name, kind, _, _, size, offset, length, _) in members:
+        if kind.encode("ascii") != tarfile.REGTYPE or not length:
+            continue
+        path = os.path.normpath(os.path.join(directory, name))
+        with contextlib.suppress(OSError):
+            cached[path] = [filename, offset, length, size, os.lstat(path).st_mtime_ns]
+    return cached
+
+
+class OverlayTarball:
+    """
+    Write a tar.gz, copying the compressed content of the cached files
+    ({path: [filename, offset, length, size, mtime_ns]}) when they were not
+    modified since.
+    """
+
+    def __init__(self, filename, cached=None):
+        self.f_out = open(filename, "wb")
+        self.cached = cached or {}
+        self.buffer = io.BytesIO()
+        self.tar = tarfile.open(fileobj=self.buffer, mode="w")
+        self.compressor = gzip_compressor()
+        self.pending = False
+        self.reused = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f_out.close()
+        return False
+
+    def _drain(self):
+        data = self.buffer.getvalue()
+        if data:
+            self.f_out.write(self.compressor.compress(data))
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self.pending = True
+
+    def _end_member(self):
+        self._drain()
+        if self.pending:
+            self.f_out.write(self.compressor.flush())
+            self.compressor = gzip_compressor()
+            self.pending = False
+
+    def _cached(self, path, tarinfo):
+        entry = self.cached.get(os.path.abspath(path))
+        if entry is None or not tarinfo.isreg():
+            return None
+        (_, _, _, size, mtime_ns) = entry
+        st = os.lstat(path)
+        if st.st_size != size or st.st_mtime_ns != mtime_ns:
+            return None
+        return entry
+
+    def add(self, name):
+        """
+        Add name, recursively, like tarfile.TarFile.add().
+        """
+        tarinfo = self.tar.gettarinfo(name)
+        if tarinfo is None:
+            return
+        entry = self._cached(name, tarinfo)
+        if entry is None:
+            if tarinfo.isreg():
+                with open(name, "rb") as f_in:
+                    self.tar.addfile(tarinfo, f_in)
+            else:
+                self.tar.addfile(tarinfo)
+            self._drain()
+        else:
+            (filename, offset, length, _, _) = entry
+            self.buffer.write(
+                tarinfo.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+            )
+            self._end_member()
+            with open(filename, "rb") as f_in:
+                f_in.seek(offset)
+                _copy(f_in, self.f_out, length)
+            self.reused += tarinfo.size
+        if tarinfo.isdir():
+            for child in sorted(os.listdir(name)):
+                self.add(os.path.join(name, child))
+
+    def close(self):
+        if self.f_out.closed:
+            return
+        try:
+            self.tar.close()
+            self._end_member()
+        finally:
+            self.f_out.close()
@@ -0,0 +1,137 @@
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+# Process a stream of data in concurrent stages.
+#
+# Each stage runs in its own thread and receives every chunk of the stream
+# through a bounded queue, so a slow stage slows down the reader instead of
+# buffering the whole stream in memory. hashlib, zlib, bz2, lzma and the file
+# writes release the GIL on large buffers: the stages really run in parallel.
+
+import contextlib
+import queue
+import threading
+import time
+
+# The chunks are grouped before being sent to the stages, to lower the cost
+# of the queues.
+STAGE_CHUNK_SIZE = 1024 * 1024
+STAGE_QUEUE_SIZE = 16
+
+
+class Stage(threading.Thread):
+    def __init__(self, name, func, maxsize=STAGE_QUEUE_SIZE):
+        super().__init__(name="stage-%s" % name, daemon=True)
+        self.stage_name = name
+        self.func = func
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.aborted = False
+        self.size = 0
+        self.elapsed = 0.0
+
+    def run(self):
+        while not self.aborted:
+            data = self.queue.get()
+            if data is None:
+                return
+            # Drain the queue after an error so that the producer never blocks
+            if self.error is not None:
+                continue
+            start = time.monotonic()
+            try:
+                self.func(data)
+            except Exception as exc:  # pylint: disable=broad-except
+                self.error = exc
+            self.elapsed += time.monotonic() - start
+            self.size += len(data)
+
+    def put(self, data):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(data)
+
+    def close(self):
+        """
+        Wait for the stage to process all the data.
+        raise: the exception raised by the stage function, if any
+        """
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def abort(self):
+        self.aborted = True
+        with contextlib.suppress(queue.Full):
+            self.queue.put_nowait(None)
+
+
+class StreamPipeline:
+    """
+    Send every chunk of data to all the stages.
+    Use as a context manager: leaving the context waits for all the stages
+    and raises the first error, if any.
+    """
+
+    def __init__(self, stages, chunk_size=STAGE_CHUNK_SIZE):
+        self.stages = stages
+        self.chunk_size = chunk_size
+        self.buffers = []
+        self.buffered = 0
+
+    def __enter__(self):
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            for stage in self.stages:
+                stage.abort()
+            return False
+        try:
+            self._dispatch()
+            for stage in self.stages:
+                stage.close()
+        except BaseException:
+            for stage in self.stages:
+                stage.abort()
+            raise
+        return False
+
+    def _dispatch(self):
+        if not self.buffers:
+            return
+        data = b"".join(self.buffers)
+        self.buffers = []
+        self.buffered = 0
+        for stage in self.stages:
+            stage.put(data)
+
+    def put(self, data):
+        self.buffers.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            self._dispatch()
+
+    def stats(self):
+        """
+        Return the list of (name, size, busy time) for every stage.
+        """
+        return [(stage.stage_name, stage.size, stage.elapsed) for stage in self.stages]
@@ -20,6 +20,7 @@
 
 import logging
 import os
+import re
 import shutil
 import subprocess  # nosec - internal use.
 import yaml
@@ -153,6 +154,37 @@ class GitHelper(VCSHelper):
 
         return commit_id.decode("utf-8", errors="replace")
 
+    def resolve(self, revision=None, branch=None):
+        """
+        Return the commit that clone() would checkout, without cloning, or
+        None if it cannot be known for sure.
+        """
+        if revision is not None and re.match(r"^[0-9a-f]{40}$", str(revision)):
+            return str(revision)
+        ref = str(revision or branch or "HEAD")
+        logger = logging.getLogger("dispatcher")
+        try:
+            output = subprocess.check_output(  # nosec - internal use.
+                [self.binary, "ls-remote", self.url, ref], stderr=subprocess.STDOUT
+            ).decode("utf-8", errors="replace")
+        except subprocess.CalledProcessError as exc:
+            logger.warning("Unable to resolve '%s' in '%s': %s", ref, self.url, exc)
+            return None
+        refs = {}
+        for line in output.splitlines():
+            (commit, _, name) = line.partition("\t")
+            if not name:
+                continue
+            # For annotated tags, use the commit and not the tag object
+            if name.endswith("^{}"):
+                refs[name[: -len("^{}")]] = commit
+            else:
+                refs.setdefault(name, commit)
+        commits = set(refs.values())
+        if len(commits) != 1:
+            return None
+        return commits.pop()
+
 
 class TarHelper(VCSHelper):
     # TODO: implement TarHelper
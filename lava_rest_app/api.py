@@ -23,17 +23,18 @@ import tap
 
 from lava_scheduler_app.models import Device, DeviceType, TestJob
 from lava_results_app.models import TestSuite, TestCase
+from lava_results_app.utils import export_testcases, iter_testcases
 from lava_scheduler_app.views import filter_device_types
-from lava_scheduler_app.logutils import read_logs
+from lava_scheduler_app.logutils import query_logs, read_logs
 from linaro_django_xmlrpc.models import AuthToken
 
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 
 from rest_framework import routers, serializers, views, viewsets
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import detail_route
-from rest_framework.exceptions import NotFound, AuthenticationFailed
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound, AuthenticationFailed, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 
 
@@ -86,6 +87,22 @@ except ImportError:
             return Response(ret)
 
 
+# Query parameters of the logs that are resolved with the log indexes
+LOG_FILTERS = ("levels", "start_time", "end_time", "actions", "tail")
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = "id"
+
+
+def get_paginator(request):
+    # Keyset pagination when a cursor is given ("?cursor=" for the first
+    # page): the cost of a page does not depend on its position.
+    if "cursor" in request.query_params:
+        return IdCursorPagination()
+    return PageNumberPagination()
+
+
 class LavaApiRootView(APIRootView):
     pass
 
@@ -165,10 +182,25 @@ class TestJobViewSet(viewsets.ReadOnlyModelViewSet):
     * `/jobs/<job_id>/suites/`
     * `/jobs/<job_id>/tests/`
 
+    The logs can be filtered with `?levels=results,error`, `?actions=1.2,http-download`
+    (action levels or names) and `?start_time=` / `?end_time=` (ISO 8601). With
+    any of these filters, or with `?tail`, the `X-Lava-Next-Line` header gives
+    the `start` to use to only get the lines logged afterward.
+
     The test results are also available in JUnit and TAP13 at:
 
     * `/jobs/<job_id>/junit/`
     * `/jobs/<job_id>/tap13/`
+
+    And streamed in CSV, YAML and JSON lines at:
+
+    * `/jobs/<job_id>/csv/`
+    * `/jobs/<job_id>/yaml/`
+    * `/jobs/<job_id>/jsonl/`
+
+    The suites and tests lists are paginated by page number by default. Add
+    `?cursor=` to use a cursor pagination instead, which is faster for large
+    jobs.
     """
 
     queryset = TestJob.objects
@@ -202,6 +234,30 @@ class TestJobViewSet(viewsets.ReadOnlyModelViewSet):
             "tags", "failure_tags", "viewing_groups"
         ).visible_by_user(self.request.user)
 
+    def _export(self, fmt, content_type):
+        job = self.get_object()
+        test_cases = iter_testcases(TestCase.objects.filter(suite__job=job))
+        response = StreamingHttpResponse(
+            export_testcases(test_cases, fmt), content_type=content_type
+        )
+        response["Content-Disposition"] = "attachment; filename=job_%d.%s" % (
+            job.id,
+            fmt,
+        )
+        return response
+
+    @detail_route(methods=["get"], suffix="csv")
+    def csv(self, request, **kwargs):
+        return self._export("csv", "text/csv")
+
+    @detail_route(methods=["get"], suffix="jsonl")
+    def jsonl(self, request, **kwargs):
+        return self._export("jsonl", "application/x-ndjson")
+
+    @detail_route(methods=["get"], suffix="yaml")
+    def yaml(self, request, **kwargs):
+        return self._export("yaml", "application/yaml")
+
     @detail_route(methods=["get"], suffix="junit")
     def junit(self, request, **kwargs):
         suites = []
@@ -209,12 +265,7 @@ class TestJobViewSet(viewsets.ReadOnlyModelViewSet):
             cases = []
             for case in suite.testcase_set.all().order_by("id"):
                 # Grab the duration
-                md = case.action_metadata
-                duration = None
-                if md is not None:
-                    duration = md.get("duration")
-                    if duration is not None:
-                        duration = float(duration)
+                duration = case.duration
 
                 # Build the test case junit object
                 tc = junit_xml.TestCase(
@@ -252,6 +303,8 @@ class TestJobViewSet(viewsets.ReadOnlyModelViewSet):
     def logs(self, request, **kwargs):
         start = safe_str2int(request.query_params.get("start", 0))
         end = safe_str2int(request.query_params.get("end", None))
+        if any(key in request.query_params for key in LOG_FILTERS):
+            return self._query_logs(request, start, end)
         try:
             data = read_logs(self.get_object().output_dir, start, end)
             if not data:
@@ -264,10 +317,36 @@ class TestJobViewSet(viewsets.ReadOnlyModelViewSet):
         except FileNotFoundError:
             raise NotFound()
 
+    def _query_logs(self, request, start, end):
+        def as_list(key):
+            value = request.query_params.get(key)
+            return None if value is None else [v for v in value.split(",") if v]
+
+        try:
+            (data, next_line) = query_logs(
+                self.get_object().output_dir,
+                start,
+                end,
+                levels=as_list("levels"),
+                start_time=request.query_params.get("start_time"),
+                end_time=request.query_params.get("end_time"),
+                actions=as_list("actions"),
+            )
+        except ValueError as exc:
+            raise ValidationError(str(exc))
+        except FileNotFoundError:
+            raise NotFound()
+        response = HttpResponse(data, content_type="application/yaml")
+        response["Content-Disposition"] = (
+            "attachment; filename=job_%d.yaml" % self.get_object().id
+        )
+        response["X-Lava-Next-Line"] = str(next_line)
+        return response
+
     @detail_route(methods=["get"], suffix="suites")
     def suites(self, request, **kwargs):
         suites = self.get_object().testsuite_set.all().order_by("id")
-        paginator = PageNumberPagination()
+        paginator = get_paginator(request)
         page = paginator.paginate_queryset(suites, request)
         serializer = TestSuiteSerializer(page, many=True, context={"request": request})
         return paginator.get_paginated_response(serializer.data)
@@ -321,7 +400,7 @@ class TestJobViewSet(viewsets.ReadOnlyModelViewSet):
     @detail_route(methods=["get"], suffix="tests")
     def tests(self, request, **kwargs):
         tests = TestCase.objects.filter(suite__job=self.get_object()).order_by("id")
-        paginator = PageNumberPagination()
+        paginator = get_paginator(request)
         page = paginator.paginate_queryset(tests, request)
         serializer = TestCaseSerializer(page, many=True, context={"request": request})
         return paginator.get_paginated_response(serializer.data)
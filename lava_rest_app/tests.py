@@ -283,6 +283,25 @@ class TestRestApi:
         )
         assert len(data["results"]) == 2  # nosec - unit test support
 
+    def test_testjob_tests_cursor(self):
+        data = self.hit(
+            self.userclient,
+            reverse("api-root", args=[self.version])
+            + "jobs/%s/tests/?cursor=" % self.public_testjob1.id,
+        )
+        assert len(data["results"]) == 2  # nosec - unit test support
+        assert data["next"] is None  # nosec - unit test support
+
+    def test_testjob_jsonl(self):
+        response = self.userclient.get(
+            reverse("api-root", args=[self.version])
+            + "jobs/%s/jsonl/" % self.public_testjob1.id
+        )
+        assert response.status_code == 200  # nosec - unit test support
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        names = [json.loads(line)["name"] for line in lines]
+        assert names == ["foo", "bar"]  # nosec - unit test support
+
     def test_testjob_junit(self):
         data = self.hit(
             self.userclient,
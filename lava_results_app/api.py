@@ -19,6 +19,7 @@
 
 import csv
 import io
+import itertools
 import yaml
 import xmlrpc.client
 
@@ -37,8 +38,11 @@ from lava_results_app.models import (
     InvalidContentTypeError,
 )
 from lava_results_app.utils import (
+    EXPORT_BATCH_SIZE,
     export_testcase,
-    get_testcases_with_limit,
+    export_testcases,
+    iter_testcases,
+    iter_testcases_with_limit,
     testcase_export_fields,
 )
 from lava_scheduler_app.models import TestJob
@@ -263,9 +267,15 @@ class ResultsAPI(ExposedAPI):
                 "refresh all queries." % self.user.username,
             )
 
-        for query in Query.objects.all().filter(is_live=False):
+        # The queries read the most since their last refresh come first.
+        Query.flush_read_counts()
+        queries = Query.objects.filter(is_live=False).order_by(
+            "-read_count", "last_updated"
+        )
+        watermark = Query.get_watermark()
+        for query in queries:
             try:
-                query.refresh_view()
+                query.refresh_view(watermark=watermark)
             except QueryUpdatedError:
                 raise xmlrpc.client.Fault(
                     400,
@@ -309,16 +319,12 @@ class ResultsAPI(ExposedAPI):
                 raise xmlrpc.client.Fault(
                     401, "Permission denied for user to job %s" % job_id
                 )
-            yaml_list = []
-            for test_suite in job.testsuite_set.all():
-                for test_case in test_suite.testcase_set.all():
-                    yaml_list.append(export_testcase(test_case))
+            test_cases = iter_testcases(TestCase.objects.filter(suite__job=job))
+            return "".join(export_testcases(test_cases, "yaml"))
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
 
-        return yaml.dump(yaml_list)
-
     def get_testjob_metadata(self, job_id):
         """
         Name
@@ -397,22 +403,87 @@ class ResultsAPI(ExposedAPI):
                 raise xmlrpc.client.Fault(
                     401, "Permission denied for user to job %s" % job_id
                 )
-            output = io.StringIO()
-            writer = csv.DictWriter(
-                output,
-                quoting=csv.QUOTE_ALL,
-                extrasaction="ignore",
-                fieldnames=testcase_export_fields(),
-            )
-            writer.writeheader()
-            for test_suite in job.testsuite_set.all():
-                for row in test_suite.testcase_set.all():
-                    writer.writerow(export_testcase(row))
+            test_cases = iter_testcases(TestCase.objects.filter(suite__job=job))
+            return "".join(export_testcases(test_cases, "csv"))
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
 
-        return output.getvalue()
+    def export_testjob_results(
+        self, job_id, fmt="yaml", after=0, limit=EXPORT_BATCH_SIZE
+    ):
+        """
+        Name
+        ----
+        `export_testjob_results` (`job_id`, `fmt="yaml"`, `after=0`, `limit=1000`)
+
+        Description
+        -----------
+        Export the test cases of the given job, page by page. The test cases
+        are sorted by id and each page starts after the last test case of the
+        previous page, so every page costs the same whatever the size of the
+        job.
+
+        Arguments
+        ---------
+        `job_id`: string
+            Job id for which the results are required.
+        `fmt`: string
+            Export format: "yaml", "csv" or "jsonl" (one JSON object per line).
+        `after`: int
+            Only export the test cases with a greater id. Use 0 for the first
+            page and then the "after" value returned by the previous call.
+        `limit`: int
+            Maximum number of test cases in the page.
+
+        Return value
+        ------------
+        This function returns an XML-RPC dictionary, provided the user is
+        authenticated with an username and token:
+          data: the test cases in the requested format
+          after: the id of the last exported test case
+          complete: True if this was the last page
+        """
+
+        self._authenticate()
+        if not job_id:
+            raise xmlrpc.client.Fault(400, "Bad request: TestJob id was not specified.")
+        if fmt not in ["yaml", "csv", "jsonl"]:
+            raise xmlrpc.client.Fault(400, "Bad request: unknown format '%s'." % fmt)
+        try:
+            after = int(after)
+            limit = int(limit)
+        except ValueError:
+            raise xmlrpc.client.Fault(400, "Bad request: invalid after or limit.")
+        if limit <= 0 or limit > 10 * EXPORT_BATCH_SIZE:
+            raise xmlrpc.client.Fault(
+                400,
+                "Bad request: limit should be between 1 and %d."
+                % (10 * EXPORT_BATCH_SIZE),
+            )
+        try:
+            job = TestJob.get_by_job_number(job_id)
+            if not job.can_view(self.user):
+                raise xmlrpc.client.Fault(
+                    401, "Permission denied for user to job %s" % job_id
+                )
+        except TestJob.DoesNotExist:
+            raise xmlrpc.client.Fault(404, "Specified job not found.")
+
+        # Fetch one more test case to know if this is the last page
+        test_cases = list(
+            itertools.islice(
+                iter_testcases(TestCase.objects.filter(suite__job=job), after),
+                limit + 1,
+            )
+        )
+        complete = len(test_cases) <= limit
+        test_cases = test_cases[:limit]
+        return {
+            "data": "".join(export_testcases(test_cases, fmt)),
+            "after": test_cases[-1].id if test_cases else after,
+            "complete": complete,
+        }
 
     def get_testjob_suites_list_csv(self, job_id):
         """
@@ -537,18 +608,15 @@ class ResultsAPI(ExposedAPI):
                 raise xmlrpc.client.Fault(
                     401, "Permission denied for user to job %s" % job_id
                 )
-            yaml_list = []
             test_suite = job.testsuite_set.get(name=suite_name)
-            for test_case in get_testcases_with_limit(test_suite, limit, offset):
-                yaml_list.append(export_testcase(test_case))
+            test_cases = iter_testcases_with_limit(test_suite, limit, offset)
+            return "".join(export_testcases(test_cases, "yaml"))
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
         except TestSuite.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified test suite not found.")
 
-        return yaml.dump(yaml_list)
-
     def get_testsuite_results_csv(self, job_id, suite_name, limit=None, offset=None):
         """
         Name
@@ -585,25 +653,15 @@ class ResultsAPI(ExposedAPI):
                 raise xmlrpc.client.Fault(
                     401, "Permission denied for user to job %s" % job_id
                 )
-            output = io.StringIO()
-            writer = csv.DictWriter(
-                output,
-                quoting=csv.QUOTE_ALL,
-                extrasaction="ignore",
-                fieldnames=testcase_export_fields(),
-            )
-            writer.writeheader()
             test_suite = job.testsuite_set.get(name=suite_name)
-            for row in get_testcases_with_limit(test_suite, limit, offset):
-                writer.writerow(export_testcase(row))
+            test_cases = iter_testcases_with_limit(test_suite, limit, offset)
+            return "".join(export_testcases(test_cases, "csv"))
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
         except TestSuite.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified test suite not found.")
 
-        return output.getvalue()
-
     def get_testsuite_results_count(self, job_id, suite_name):
         """
         Name
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Set-based computation of the chart series.
+
+The results of the query are read once, with only the needed columns. All
+the related data (x-axis attribute, suites, test cases, metadata) is then
+fetched with a fixed number of grouped queries that use the results as a
+sub-query, whatever the number of results.
+
+The series are columnar: one list per column, every list having one value
+per point.
+"""
+
+import contextlib
+
+from django.db import models
+from django.urls import reverse
+
+from lava_results_app.models import TestCase, TestData, TestSuite
+from lava_results_app.utils import RESULT_NAMES
+from lava_scheduler_app.models import TestJob
+
+PASSFAIL_COLUMNS = [
+    "id",
+    "pk",
+    "link",
+    "date",
+    "attribute",
+    "pass",
+    "passes",
+    "failures",
+    "skip",
+    "unknown",
+    "total",
+]
+MEASUREMENT_COLUMNS = ["id", "pk", "link", "date", "attribute", "pass", "measurement"]
+ATTRIBUTES_COLUMNS = ["id", "pk", "attribute", "link", "date", "pass", "attr_value"]
+
+
+class Series:
+    def __init__(self, columns):
+        self.columns = {name: [] for name in columns}
+
+    def append(self, **values):
+        for (name, column) in self.columns.items():
+            column.append(values[name])
+
+
+class Item:  # pylint: disable=too-few-public-methods
+    """
+    One row of the query results, with the columns needed by the charts.
+    """
+
+    __slots__ = ("pk", "job_id", "link", "date", "row")
+
+    def __init__(self, pk, job_id, link, date, row):
+        self.pk = pk
+        self.job_id = job_id
+        self.link = link
+        self.date = date
+        self.row = row
+
+
+def _job_items(results):
+    for (pk, sub_id, end_time, health) in results.values_list(
+        "id", "sub_id", "end_time", "health"
+    ):
+        link = reverse("lava.scheduler.job.detail", args=[sub_id or pk])
+        yield Item(pk, pk, link, str(end_time), health)
+
+
+def _suite_items(results):
+    for (pk, name, job_id, end_time) in results.values_list(
+        "id", "name", "job_id", "job__end_time"
+    ):
+        link = reverse("lava.results.suite", args=[job_id, name])
+        yield Item(pk, job_id, link, str(end_time), name)
+
+
+def _case_items(results):
+    for row in results.values_list(
+        "id",
+        "suite__job_id",
+        "logged",
+        "name",
+        "measurement",
+        "result",
+        "metadata_json",
+    ):
+        link = reverse("lava.results.testcase", args=[row[0]])
+        yield Item(row[0], row[1], link, str(row[2]), row[3:])
+
+
+ITEMS = {TestJob: _job_items, TestSuite: _suite_items, TestCase: _case_items}
+JOB_FIELD = {TestJob: "id", TestSuite: "job_id", TestCase: "suite__job_id"}
+
+
+def _parse_float(value):
+    with contextlib.suppress(TypeError, ValueError):
+        return float(value)
+    return None
+
+
+class ChartData:
+    """
+    Compute the series of a chart from the (ordered) results of a query.
+    """
+
+    def __init__(self, model, results, xaxis_attribute=None, attributes=None):
+        self.model = model
+        self.results = results
+        self.xaxis_attribute = xaxis_attribute
+        self.attributes = [
+            x.strip() for x in (attributes or "").split(",") if x.strip()
+        ]
+
+    def _subquery(self, field):
+        return self.results.order_by().values(field)
+
+    def _items(self):
+        return list(ITEMS[self.model](self.results))
+
+    def _xaxis_values(self):
+        """
+        Return {job_id: value} for the x-axis attribute, taken from the first
+        TestData of each job.
+        """
+        jobs = self._subquery(JOB_FIELD[self.model])
+        first = (
+            TestData.objects.filter(testjob__in=jobs)
+            .order_by()
+            .values("testjob_id")
+            .annotate(first=models.Min("id"))
+            .values("first")
+        )
+        return dict(
+            TestData.objects.filter(
+                id__in=first, attributes__name=self.xaxis_attribute
+            ).values_list("testjob_id", "attributes__value")
+        )
+
+    def _points(self):
+        """
+        Yield (item, attribute) for the items that should be displayed.
+        """
+        items = self._items()
+        if not self.xaxis_attribute:
+            for item in items:
+                yield (item, item.date)
+            return
+        values = self._xaxis_values()
+        for item in items:
+            # Ignore the items without the x-axis attribute.
+            attribute = values.get(item.job_id)
+            if attribute:
+                yield (item, attribute)
+
+    def _suite_counts(self, suites):
+        """
+        Return {suite_id: counts} for the given suites rows:
+        (id, job_id, name, count_pass, count_fail, count_skip, count_unknown).
+        Suites without counters are aggregated in a single query.
+        """
+        counts = {}
+        missing = []
+        for row in suites:
+            if None in row[3:]:
+                missing.append(row[0])
+            else:
+                counts[row[0]] = dict(zip(RESULT_NAMES, row[3:]))
+        if missing:
+            for suite_id in missing:
+                counts[suite_id] = dict.fromkeys(RESULT_NAMES, 0)
+            aggregate = (
+                TestCase.objects.filter(suite_id__in=missing)
+                .order_by()
+                .values_list("suite_id", "result")
+                .annotate(models.Count("id"))
+            )
+            for (suite_id, result, count) in aggregate:
+                counts[suite_id][RESULT_NAMES[result]] = count
+        return counts
+
+    def _suites(self, field):
+        return list(
+            TestSuite.objects.filter(**{"%s__in" % field: self._subquery("id")})
+            .order_by("id")
+            .values_list(
+                "id", "job_id", "name", *["count_%s" % name for name in RESULT_NAMES]
+            )
+        )
+
+    def passfail_data(self):
+        series = Series(PASSFAIL_COLUMNS)
+        # Pass/fail charts for testcases do not make sense.
+        if self.model == TestCase:
+            return series.columns
+
+        suites = self._suites("job" if self.model == TestJob else "id")
+        counts = self._suite_counts(suites)
+        by_item = {}
+        for row in suites:
+            key = row[1] if self.model == TestJob else row[0]
+            # Suites with the same name are merged, the last one wins.
+            by_item.setdefault(key, {})[row[2]] = counts[row[0]]
+
+        for (item, attribute) in self._points():
+            for (name, count) in by_item.get(item.pk, {}).items():
+                if not name:
+                    continue
+                series.append(
+                    id=name,
+                    pk=item.pk,
+                    link=item.link,
+                    date=item.date,
+                    attribute=attribute,
+                    passes=count["pass"],
+                    failures=count["fail"],
+                    skip=count["skip"],
+                    unknown=count["unknown"],
+                    total=sum(count.values()),
+                    **{"pass": count["fail"] == 0}
+                )
+        return series.columns
+
+    def _job_measurements(self):
+        # Average measurement and number of failures of each suite.
+        failed = models.Case(
+            models.When(testcase__result=TestCase.RESULT_FAIL, then=1),
+            default=0,
+            output_field=models.IntegerField(),
+        )
+        rows = (
+            TestSuite.objects.filter(job__in=self._subquery("id"))
+            .order_by("id")
+            .values_list("id", "job_id", "name")
+            .annotate(
+                avg=models.Avg("testcase__measurement"), failures=models.Sum(failed)
+            )
+        )
+        measurements = {}
+        for (_, job_id, name, avg, failures) in rows:
+            measurements.setdefault(job_id, {})[name] = (avg, not failures)
+        return measurements
+
+    def _suite_measurements(self):
+        rows = (
+            TestCase.objects.filter(suite__in=self._subquery("id"))
+            .order_by("id")
+            .values_list("suite_id", "name", "measurement", "result")
+        )
+        measurements = {}
+        for (suite_id, name, measurement, result) in rows:
+            measurements.setdefault(suite_id, {})[name] = (
+                measurement,
+                result == TestCase.RESULT_PASS,
+            )
+        return measurements
+
+    def measurement_data(self):
+        series = Series(MEASUREMENT_COLUMNS)
+        if self.model == TestJob:
+            measurements = self._job_measurements()
+        elif self.model == TestSuite:
+            measurements = self._suite_measurements()
+        else:
+            measurements = None
+
+        for (item, attribute) in self._points():
+            if measurements is None:
+                (name, measurement, result) = item.row[:3]
+                values = {name: (measurement, result == TestCase.RESULT_PASS)}
+            else:
+                values = measurements.get(item.pk, {})
+            for (name, (measurement, passed)) in values.items():
+                if not name:
+                    continue
+                series.append(
+                    id=name,
+                    pk=item.pk,
+                    link=item.link,
+                    date=item.date,
+                    attribute=attribute,
+                    measurement=measurement,
+                    **{"pass": passed}
+                )
+        return series.columns
+
+    def _metadata_values(self, metadata):
+        """
+        Return {key: value} for the requested attributes with a numerical
+        value.
+        """
+        if not isinstance(metadata, dict):
+            return {}
+        values = {}
+        for key in self.attributes:
+            value = _parse_float(metadata.get(key))
+            if value is not None:
+                values[key] = value
+        return values
+
+    def _job_attributes(self):
+        first = (
+            TestData.objects.filter(testjob__in=self._subquery("id"))
+            .order_by()
+            .values("testjob_id")
+            .annotate(first=models.Min("id"))
+            .values("first")
+        )
+        rows = TestData.objects.filter(
+            id__in=first, attributes__name__in=self.attributes
+        ).values_list("testjob_id", "attributes__name", "attributes__value")
+        values = {}
+        for (job_id, name, value) in rows:
+            value = _parse_float(value)
+            if value is not None:
+                values.setdefault(job_id, {})[name] = value
+        return values
+
+    def _suite_attributes(self):
+        rows = (
+            TestCase.objects.filter(suite__in=self._subquery("id"))
+            .filter(metadata_json__has_any_keys=self.attributes)
+            .order_by("id")
+            .values_list("suite_id", "metadata_json", "result")
+        )
+        values = {}
+        for (suite_id, metadata, result) in rows:
+            suite = values.setdefault(suite_id, {})
+            for (key, value) in self._metadata_values(metadata).items():
+                # Use only the metadata from the first testcase atm.
+                if key not in suite:
+                    suite[key] = (value, result == TestCase.RESULT_PASS)
+        return values
+
+    def attributes_data(self):
+        series = Series(ATTRIBUTES_COLUMNS)
+        if not self.attributes:
+            return series.columns
+
+        values = {}
+        if self.model == TestJob:
+            values = self._job_attributes()
+        elif self.model == TestSuite:
+            values = self._suite_attributes()
+
+        for item in self._items():
+            if self.model == TestJob:
+                passed = item.row == TestJob.HEALTH_COMPLETE
+                item_values = {
+                    k: (v, passed) for (k, v) in values.get(item.pk, {}).items()
+                }
+            elif self.model == TestSuite:
+                item_values = values.get(item.pk, {})
+            else:
+                passed = item.row[2] == TestCase.RESULT_PASS
+                item_values = {
+                    k: (v, passed)
+                    for (k, v) in self._metadata_values(item.row[3]).items()
+                }
+            for (name, (value, passed)) in item_values.items():
+                series.append(
+                    id=name,
+                    pk=item.pk,
+                    attribute=item.date,
+                    link=item.link,
+                    date=item.date,
+                    attr_value=value,
+                    **{"pass": passed}
+                )
+        return series.columns
@@ -21,7 +21,6 @@
 # pylint: disable=too-many-return-statements,ungrouped-imports
 
 import hashlib
-import os
 import yaml
 import logging
 import decimal
@@ -30,6 +29,7 @@ from urllib.parse import quote
 from collections import OrderedDict  # pylint: disable=unused-import
 
 from lava_common.utils import debian_package_version
+from lava_results_app.metastore import MetadataStore
 from lava_results_app.models import (
     TestSuite,
     TestSet,
@@ -37,6 +37,7 @@ from lava_results_app.models import (
     TestData,
     ActionData,
     MetaType,
+    _metadata_columns,
 )
 from django.core.exceptions import MultipleObjectsReturned
 from lava_common.timeout import Timeout
@@ -49,13 +50,104 @@ def yaml_decimal_str(dumper, value):
 yaml.add_representer(decimal.Decimal, yaml_decimal_str)
 
 
-def _check_for_testset(result_dict, suite):
+class ResultsCache:
+    """
+    In-memory cache of the TestSuite and TestSet objects of a job.
+    The missing objects are created without accessing the database. They
+    are saved in bulk by save(), just before saving the test cases.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.suites = {s.name: s for s in TestSuite.objects.filter(job=job)}
+        by_id = {s.id: s for s in self.suites.values()}
+        self.test_sets = {}
+        for test_set in TestSet.objects.filter(suite__job=job):
+            test_set.suite = by_id[test_set.suite_id]
+            self.test_sets[(test_set.suite.name, test_set.name)] = test_set
+        self.new_suites = []
+        self.new_test_sets = []
+
+    def dirty(self):
+        return bool(self.new_suites or self.new_test_sets)
+
+    def suite(self, name):
+        suite = self.suites.get(name)
+        if suite is None:
+            suite = TestSuite(name=name, job=self.job)
+            self.suites[name] = suite
+            self.new_suites.append(suite)
+        return suite
+
+    def test_set(self, suite, name):
+        test_set = self.test_sets.get((suite.name, name))
+        if test_set is None:
+            test_set = TestSet(name=name, suite=suite)
+            self.test_sets[(suite.name, name)] = test_set
+            self.new_test_sets.append(test_set)
+        return test_set
+
+    def save(self):
+        """
+        Save the new suites and test sets. Rows created in the meantime by
+        another process are reused.
+        """
+        if self.new_suites:
+            names = [s.name for s in self.new_suites]
+            existing = dict(
+                TestSuite.objects.filter(job=self.job, name__in=names).values_list(
+                    "name", "id"
+                )
+            )
+            missing = []
+            for suite in self.new_suites:
+                if suite.name in existing:
+                    suite.id = existing[suite.name]
+                else:
+                    missing.append(suite)
+            TestSuite.objects.bulk_create(missing)
+            self.new_suites = []
+
+        if self.new_test_sets:
+            for test_set in self.new_test_sets:
+                test_set.suite_id = test_set.suite.id
+            existing = {
+                (suite_id, name): pk
+                for (suite_id, name, pk) in TestSet.objects.filter(
+                    suite_id__in={t.suite_id for t in self.new_test_sets},
+                    name__in={t.name for t in self.new_test_sets},
+                ).values_list("suite_id", "name", "id")
+            }
+            missing = []
+            for test_set in self.new_test_sets:
+                pk = existing.get((test_set.suite_id, test_set.name))
+                if pk is not None:
+                    test_set.id = pk
+                else:
+                    missing.append(test_set)
+            TestSet.objects.bulk_create(missing)
+            self.new_test_sets = []
+
+    @staticmethod
+    def prepare(test_cases):
+        """
+        Update the foreign keys of test cases built with a cache, once the
+        cache has been saved.
+        """
+        for test_case in test_cases:
+            test_case.suite_id = test_case.suite.id
+            if test_case.test_set is not None:
+                test_case.test_set_id = test_case.test_set.id
+
+
+def _check_for_testset(result_dict, suite, cache=None):
     """
     The presence of the test_set key indicates the start and usage of a TestSet.
     Get or create and populate the definition based on that set.
     # {date: pass, test_definition: install-ssh, test_set: first_set}
     :param result_dict: lava-test-shell results
     :param suite: current test suite
+    :param cache: ResultsCache of the job, if any
     """
     logger = logging.getLogger("lava-master")
     testset = None
@@ -66,7 +158,10 @@ def _check_for_testset(result_dict, suite):
             suite.job.set_failure_comment(msg)
             logger.warning(msg)
             return None
-        testset, _ = TestSet.objects.get_or_create(name=set_name, suite=suite)
+        if cache is None:
+            testset, _ = TestSet.objects.get_or_create(name=set_name, suite=suite)
+        else:
+            testset = cache.test_set(suite, set_name)
         logger.debug("%s", testset)
     return testset
 
@@ -78,10 +173,12 @@ def append_failure_comment(job, msg):
     job.save(update_fields=["failure_comment"])
 
 
-def create_metadata_store(results, job):
+def create_metadata_store(results, job, store=None):
     """
-    Uses the OrderedDict import to correctly handle
-    the yaml.load
+    Add the "extra" metadata of the result to the packed metadata store of
+    the job and return the reference to use in the test case metadata.
+    When no store is given, the payload is written immediately. Otherwise the
+    caller should flush the store before saving the test case.
     """
     if "extra" not in results:
         return None
@@ -90,34 +187,33 @@ def create_metadata_store(results, job):
         return None
 
     logger = logging.getLogger("lava-master")
-    stub = "%s-%s-%s.yaml" % (results["definition"], results["case"], level)
-    meta_filename = os.path.join(job.output_dir, "metadata", stub)
-    os.makedirs(os.path.dirname(meta_filename), mode=0o755, exist_ok=True)
-    if os.path.exists(meta_filename):
-        with open(meta_filename, "r") as existing_store:
-            data = yaml.load(existing_store)
-        data.update(results["extra"])
-    else:
-        data = results["extra"]
+    key = (results["definition"], results["case"], level)
     try:
-        with open(meta_filename, "w") as extra_store:
-            yaml.dump(data, extra_store)
-    except OSError as exc:  # LAVA-847
+        if store is None:
+            store = MetadataStore(job.output_dir)
+            reference = store.put(results["extra"], key)
+            store.flush()
+        else:
+            reference = store.put(results["extra"], key)
+    except (OSError, yaml.YAMLError) as exc:  # LAVA-847
         msg = "[%d] Unable to create metadata store: %s" % (job.id, exc)
         logger.error(msg)
         append_failure_comment(job, msg)
         return None
-    return meta_filename
+    return reference
 
 
 def map_scanned_results(
-    results, job, markers, meta_filename
+    results, job, markers, meta_filename, cache=None
 ):  # pylint: disable=too-many-branches,too-many-statements,too-many-return-statements
     """
     Sanity checker on the logged results dictionary
     :param results: results logged via the slave
     :param job: the current test job
-    :param meta_filename: YAML store for results metadata
+    :param meta_filename: reference to the "extra" metadata in the store
+    :param cache: ResultsCache of the job. When set, the suite and the test
+                  set are not saved: the caller should call cache.save() and
+                  ResultsCache.prepare() before saving the test case.
     :return: the TestCase object that should be saved to the database.
              None on error.
     """
@@ -137,14 +233,19 @@ def map_scanned_results(
         results["extra"] = meta_filename
 
     metadata = yaml.dump(results)
+    columns = _metadata_columns(results)
     if len(metadata) > 4096:  # bug 2471 - test_length unit test
         msg = "[%d] Result metadata is too long. %s" % (job.id, metadata)
         logger.error(msg)
         append_failure_comment(job, msg)
         metadata = ""
+        columns = _metadata_columns({})
 
-    suite, _ = TestSuite.objects.get_or_create(name=results["definition"], job=job)
-    testset = _check_for_testset(results, suite)
+    if cache is None:
+        suite, _ = TestSuite.objects.get_or_create(name=results["definition"], job=job)
+    else:
+        suite = cache.suite(results["definition"])
+    testset = _check_for_testset(results, suite, cache)
 
     name = results["case"].strip()
 
@@ -169,6 +270,7 @@ def map_scanned_results(
             measurement=measurement,
             units=units,
             result=result_val,
+            **columns
         )
 
     else:
@@ -210,6 +312,7 @@ def map_scanned_results(
                 units=units,
                 start_log_line=starttc,
                 end_log_line=endtc,
+                **columns
             )
         except decimal.InvalidOperation:
             logger.exception("[%d] Unable to create test case %s", job.id, name)
@@ -375,14 +478,13 @@ def build_action(action_data, testdata, submission):
     max_retry = action_data.get("max_retries")
 
     # find corresponding test case
-    match_case = None
-    test_cases = TestCase.objects.filter(
-        suite__job=testdata.testjob, suite__name="lava"
+    match_case = (
+        TestCase.objects.filter(
+            suite__job=testdata.testjob, suite__name="lava", level=action_data["level"]
+        )
+        .order_by("id")
+        .last()
     )
-    for case in test_cases:
-        if case.action_metadata:
-            if case.action_metadata.get("level") == action_data["level"]:
-                match_case = case
 
     # maps the static testdata derived from the definition to the runtime pipeline construction
     ActionData.objects.create(
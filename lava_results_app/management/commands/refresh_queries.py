@@ -18,6 +18,7 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import time
 from django.core.management.base import BaseCommand
 from lava_results_app.models import Query, QueryUpdatedError, RefreshLiveQueryError
 
@@ -37,6 +38,18 @@ class Command(BaseCommand):
         parser.add_argument(
             "--all", dest="all", action="store_true", help="Refresh all queries"
         )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Refresh the views even if the results did not change",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="With --all, keep running and refresh the queries every "
+            "INTERVAL seconds",
+        )
 
     def handle(self, *args, **options):
         if not options["name"] and not options["all"]:
@@ -59,12 +72,25 @@ class Command(BaseCommand):
                     % (query_name, options["username"])
                 )
                 sys.exit(1)
-            self._refresh_query(query)
+            self._refresh_query(query, options["force"])
         else:
-            for query in Query.objects.all().filter(is_live=False, is_archived=False):
-                self._refresh_query(query)
+            while True:
+                self._refresh_all(options["force"])
+                if not options["interval"]:
+                    break
+                time.sleep(options["interval"])
 
-    def _refresh_query(self, query):
+    def _refresh_all(self, force):
+        # The queries read the most since their last refresh come first.
+        Query.flush_read_counts()
+        queries = Query.objects.filter(is_live=False, is_archived=False).order_by(
+            "-read_count", "last_updated"
+        )
+        watermark = Query.get_watermark()
+        for query in queries:
+            self._refresh_query(query, force, watermark)
+
+    def _refresh_query(self, query, force, watermark=None):
         if query.is_archived:
             self.stderr.write(
                 "Query with name %s owned by user %s is archived."
@@ -72,7 +98,11 @@ class Command(BaseCommand):
             )
             return
         try:
-            query.refresh_view()
+            if query.refresh_view(force, watermark):
+                self.stdout.write(
+                    "Query with name %s owned by user %s refreshed."
+                    % (query.name, query.owner.username)
+                )
         except QueryUpdatedError as e:
             self.stderr.write(
                 "Query with name %s owned by user %s was recently refreshed."
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from lava_results_app.models import TestCase, TestSuite
+from lava_results_app.utils import RESULT_NAMES
+from lava_scheduler_app.models import TestJob
+
+
+def _missing(model):
+    query = Q()
+    for name in RESULT_NAMES:
+        query |= Q(**{"count_%s__isnull" % name: True})
+    return model.objects.filter(query)
+
+
+class Command(BaseCommand):
+    """
+    Compute the result counters of the test suites and test jobs.
+    """
+
+    help = "Compute the result counters of the test suites and test jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            default=False,
+            action="store_true",
+            help="Compute the counters again for every suite and job, "
+            "not only for the missing ones",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            default=1000,
+            type=int,
+            help="Number of rows updated by each transaction. Default: 1000",
+        )
+
+    def handle(self, *args, **options):
+        suites = TestSuite.objects.all() if options["all"] else _missing(TestSuite)
+        jobs = TestJob.objects.all() if options["all"] else _missing(TestJob)
+        # The jobs are computed from the suites, so get the list first
+        job_ids = list(jobs.values_list("id", flat=True).order_by("id"))
+        job_ids.extend(
+            suites.exclude(job_id__in=job_ids)
+            .values_list("job_id", flat=True)
+            .distinct()
+            .order_by()
+        )
+        suite_ids = list(suites.values_list("id", flat=True).order_by("id"))
+
+        self.stdout.write("Updating %d suites" % len(suite_ids))
+        counts = {
+            "count_%s"
+            % name: Coalesce(
+                Subquery(
+                    TestCase.objects.filter(suite=OuterRef("pk"), result=result)
+                    .order_by()
+                    .values("suite")
+                    .annotate(count=Count("id"))
+                    .values("count"),
+                    output_field=IntegerField(),
+                ),
+                0,
+            )
+            for (result, name) in enumerate(RESULT_NAMES)
+        }
+        self._update(TestSuite, suite_ids, counts, options["chunk_size"])
+
+        self.stdout.write("Updating %d jobs" % len(job_ids))
+        counts = {
+            "count_%s"
+            % name: Coalesce(
+                Subquery(
+                    TestSuite.objects.filter(job=OuterRef("pk"))
+                    .order_by()
+                    .values("job")
+                    .annotate(total=Sum("count_%s" % name))
+                    .values("total"),
+                    output_field=IntegerField(),
+                ),
+                0,
+            )
+            for name in RESULT_NAMES
+        }
+        self._update(TestJob, sorted(set(job_ids)), counts, options["chunk_size"])
+
+    def _update(self, model, ids, counts, chunk_size):
+        for index in range(0, len(ids), chunk_size):
+            with transaction.atomic():
+                model.objects.filter(id__in=ids[index : index + chunk_size]).update(
+                    **counts
+                )
+            self.stdout.write("* %d/%d" % (min(index + chunk_size, len(ids)), len(ids)))
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Packed store for the "extra" metadata of the test results.
+
+The payloads (YAML) of a job are appended to a single file:
+  metadata.pack         concatenated payloads
+  metadata.pack.idx     sha256 (32 bytes) | offset (uint64) | length (uint32)
+                        for every payload
+
+Identical payloads are only stored once. The test cases reference their
+payload as "<path to metadata.pack>:<offset>:<length>" so readers only need
+one seek.
+
+The writes are buffered in memory until flush() is called: the caller should
+flush the store before saving the test cases that reference it.
+"""
+
+import contextlib
+import hashlib
+import os
+import struct
+import yaml
+
+PACK_NAME = "metadata.pack"
+INDEX_FORMAT = "=32sQI"
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+
+
+def parse_reference(reference):
+    """
+    Return (filename, offset, length) for a reference to a packed payload or
+    None for any other value.
+    """
+    if not isinstance(reference, str):
+        return None
+    parts = reference.rsplit(":", 2)
+    if len(parts) != 3 or os.path.basename(parts[0]) != PACK_NAME:
+        return None
+    try:
+        return (parts[0], int(parts[1]), int(parts[2]))
+    except ValueError:
+        return None
+
+
+def read_extra(reference):
+    """
+    Load the "extra" metadata of a test case, either from the packed store or
+    from the YAML file created by older versions.
+    Return None when the data is not available.
+    """
+    parsed = parse_reference(reference)
+    try:
+        if parsed is not None:
+            (filename, offset, length) = parsed
+            with open(filename, "rb") as f_pack:
+                f_pack.seek(offset)
+                data = f_pack.read(length)
+            if len(data) != length:
+                return None
+            return yaml.load(data, Loader=yaml.CLoader)  # nosec - CLoader
+        if isinstance(reference, str) and os.path.exists(reference):
+            with open(reference, "r") as f_in:
+                return yaml.load(f_in, Loader=yaml.CLoader)  # nosec - CLoader
+    except (OSError, yaml.YAMLError):
+        return None
+    return None
+
+
+class MetadataStore:
+    def __init__(self, directory):
+        self.filename = os.path.join(directory, PACK_NAME)
+        # sha256 -> (offset, length), loaded on first use
+        self.digests = None
+        self.size = 0
+        # (definition, case, level) -> data, to merge the payloads of the same
+        # result
+        self.merged = {}
+        self.pending = []
+        self.pending_index = []
+
+    def _load(self):
+        self.digests = {}
+        self.size = _size(self.filename)
+        with contextlib.suppress(OSError):
+            with open(self.filename + ".idx", "rb") as f_idx:
+                data = f_idx.read()
+            # Drop a partially written entry and the entries pointing after
+            # the end of the pack (crash while flushing)
+            data = data[: len(data) - len(data) % INDEX_SIZE]
+            for (digest, offset, length) in struct.iter_unpack(INDEX_FORMAT, data):
+                if offset + length <= self.size:
+                    self.digests[digest] = (offset, length)
+
+    def put(self, data, key=None):
+        """
+        Add the payload to the store and return its reference.
+        When a key is given and the previous payload for this key and the new
+        one are both dictionaries, the payloads are merged.
+        """
+        if self.digests is None:
+            self._load()
+        if key is not None:
+            previous = self.merged.get(key)
+            if isinstance(previous, dict) and isinstance(data, dict):
+                data = dict(previous, **data)
+            self.merged[key] = data
+
+        payload = yaml.dump(data, Dumper=yaml.CDumper).encode("utf-8")
+        digest = hashlib.sha256(payload).digest()
+        if digest not in self.digests:
+            self.digests[digest] = (self.size, len(payload))
+            self.pending.append(payload)
+            self.pending_index.append(
+                struct.pack(INDEX_FORMAT, digest, self.size, len(payload))
+            )
+            self.size += len(payload)
+        (offset, length) = self.digests[digest]
+        return "%s:%d:%d" % (self.filename, offset, length)
+
+    def flush(self):
+        """
+        Write the pending payloads.
+        raise: OSError
+        """
+        if not self.pending:
+            return
+        os.makedirs(os.path.dirname(self.filename), mode=0o755, exist_ok=True)
+        # The pack is written first so that the index never points to missing
+        # data.
+        with open(self.filename, "ab") as f_pack:
+            f_pack.write(b"".join(self.pending))
+        with open(self.filename + ".idx", "ab") as f_idx:
+            f_idx.write(b"".join(self.pending_index))
+        self.pending = []
+        self.pending_index = []
+
+
+def _size(filename):
+    try:
+        return os.stat(filename).st_size
+    except OSError:
+        return 0
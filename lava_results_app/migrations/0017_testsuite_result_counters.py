@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+def counter(default):
+    return models.PositiveIntegerField(default=default, editable=False, null=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_results_app", "0016_add_testcase_start_end_tc")]
+
+    # The existing suites get NULL counters (computed by the result_counters
+    # command) while the new suites start at 0.
+    operations = [
+        migrations.AddField(
+            model_name="testsuite", name="count_pass", field=counter(None)
+        ),
+        migrations.AddField(
+            model_name="testsuite", name="count_fail", field=counter(None)
+        ),
+        migrations.AddField(
+            model_name="testsuite", name="count_skip", field=counter(None)
+        ),
+        migrations.AddField(
+            model_name="testsuite", name="count_unknown", field=counter(None)
+        ),
+        migrations.AlterField(
+            model_name="testsuite", name="count_pass", field=counter(0)
+        ),
+        migrations.AlterField(
+            model_name="testsuite", name="count_fail", field=counter(0)
+        ),
+        migrations.AlterField(
+            model_name="testsuite", name="count_skip", field=counter(0)
+        ),
+        migrations.AlterField(
+            model_name="testsuite", name="count_unknown", field=counter(0)
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_results_app", "0017_testsuite_result_counters")]
+
+    operations = [
+        migrations.AddField(
+            model_name="query",
+            name="refresh_watermark",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="query",
+            name="read_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
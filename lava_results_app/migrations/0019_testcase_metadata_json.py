@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import json
+
+import django.contrib.postgres.fields.jsonb
+import django.contrib.postgres.indexes
+from django.db import migrations, models, transaction
+import yaml
+
+
+# Copy of lava_results_app.models._metadata_columns at the time of this
+# migration
+def _metadata_columns(metadata):
+    if not isinstance(metadata, dict):
+        return {
+            "metadata_json": None,
+            "duration": None,
+            "level": None,
+            "extra": None,
+            "error_type": None,
+        }
+    # Only keep JSON types, like the YAML text does for Decimal
+    metadata = json.loads(json.dumps(metadata, default=str))
+    duration = None
+    with contextlib.suppress(TypeError, ValueError):
+        duration = float(metadata.get("duration"))
+
+    def string(key):
+        value = metadata.get(key)
+        return None if value is None else str(value)
+
+    return {
+        "metadata_json": metadata,
+        "duration": duration,
+        "level": string("level"),
+        "extra": string("extra"),
+        "error_type": string("error_type"),
+    }
+
+
+UPDATE_SQL = """
+UPDATE {table} AS t
+SET metadata_json = v.metadata_json, duration = v.duration, level = v.level,
+    extra = v.extra, error_type = v.error_type
+FROM (VALUES {values}) AS v(id, metadata_json, duration, level, extra, error_type)
+WHERE t.id = v.id
+"""
+UPDATE_VALUES = (
+    "(%s, %s::jsonb, %s::double precision, %s::varchar, %s::text, %s::varchar)"
+)
+
+
+def forwards_func(apps, schema_editor):
+    TestCase = apps.get_model("lava_results_app", "TestCase")
+    test_cases = (
+        TestCase.objects.exclude(metadata__isnull=True)
+        .exclude(metadata="")
+        .order_by("id")
+        .only("id", "metadata")
+    )
+    last_id = 0
+    while True:
+        # One transaction and one UPDATE for every batch
+        with transaction.atomic():
+            batch = list(test_cases.filter(id__gt=last_id)[:1000])
+            if not batch:
+                break
+            params = []
+            for test_case in batch:
+                try:
+                    metadata = yaml.load(test_case.metadata, Loader=yaml.CLoader)
+                except yaml.YAMLError:
+                    continue
+                columns = _metadata_columns(metadata)
+                if columns["metadata_json"] is not None:
+                    columns["metadata_json"] = json.dumps(columns["metadata_json"])
+                params.extend(
+                    [
+                        test_case.id,
+                        columns["metadata_json"],
+                        columns["duration"],
+                        columns["level"],
+                        columns["extra"],
+                        columns["error_type"],
+                    ]
+                )
+            if params:
+                sql = UPDATE_SQL.format(
+                    table=TestCase._meta.db_table,
+                    values=", ".join([UPDATE_VALUES] * (len(params) // 6)),
+                )
+                with schema_editor.connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+        last_id = batch[-1].id
+
+
+def backwards_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    # The test cases are updated by batches, each in its own transaction
+    atomic = False
+
+    dependencies = [("lava_results_app", "0018_query_refresh_watermark")]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcase",
+            name="metadata_json",
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="testcase",
+            name="duration",
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="testcase",
+            name="level",
+            field=models.CharField(
+                blank=True, editable=False, max_length=100, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="testcase",
+            name="extra",
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="testcase",
+            name="error_type",
+            field=models.CharField(
+                blank=True, editable=False, max_length=100, null=True
+            ),
+        ),
+        migrations.RunPython(forwards_func, backwards_func),
+        # The indexes are built once the columns are filled
+        migrations.AlterField(
+            model_name="testcase",
+            name="level",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=100, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testcase",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["metadata_json"], name="testcase_metadata_json_gin"
+            ),
+        ),
+    ]
@@ -29,6 +29,8 @@ TestCase is a single lava-test-case record or Action result.
 """
 
 from datetime import timedelta
+import hashlib
+import json
 import logging
 from nose.tools import nottest
 from urllib.parse import quote
@@ -40,11 +42,15 @@ from django.contrib.admin.models import LogEntry, ADDITION
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes import fields
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models, connection, transaction
 from django.db.models import Q, Lookup
 from django.db.models.fields import Field
-from django.db.models.signals import pre_save
+from django.db.models import F
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
@@ -55,9 +61,10 @@ from lava_scheduler_app.managers import (
     RestrictedTestJobQuerySet,
     RestrictedTestCaseQuerySet,
     RestrictedTestSuiteQuerySet,
+    visibility_class,
 )
 
-from lava_results_app.utils import help_max_length
+from lava_results_app.utils import RESULT_NAMES, help_max_length, result_counts
 
 
 class InvalidConditionsError(Exception):
@@ -111,45 +118,77 @@ class QueryMaterializedView(MaterializedView):
     class Meta:
         abstract = True
 
-    CREATE_VIEW = "CREATE MATERIALIZED VIEW %s%s AS %s;"
-    DROP_VIEW = "DROP MATERIALIZED VIEW IF EXISTS %s%s;"
-    REFRESH_VIEW = "REFRESH MATERIALIZED VIEW %s%s;"
-    VIEW_EXISTS = "SELECT EXISTS(SELECT * FROM pg_class WHERE relname='%s%s');"
+    CREATE_VIEW = "CREATE MATERIALIZED VIEW %s AS %s;"
+    # The unique index is required by REFRESH ... CONCURRENTLY
+    CREATE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS %s_id ON %s (id);"
+    DROP_VIEW = "DROP MATERIALIZED VIEW IF EXISTS %s;"
+    REFRESH_VIEW = "REFRESH MATERIALIZED VIEW CONCURRENTLY %s;"
+    RENAME_VIEW = "ALTER MATERIALIZED VIEW %s RENAME TO %s;"
+    RENAME_INDEX = "ALTER INDEX %s_id RENAME TO %s_id;"
+    VIEW_EXISTS = "SELECT EXISTS(SELECT * FROM pg_class WHERE relname='%s');"
     QUERY_VIEW_PREFIX = "query_"
 
+    @classmethod
+    def view_name(cls, query_id):
+        return "%s%s" % (cls.QUERY_VIEW_PREFIX, query_id)
+
+    @classmethod
+    def _create(cls, query, name):
+        sql, params = Query.get_queryset(
+            query.content_type, query.querycondition_set.all(), query.limit
+        ).query.sql_with_params()
+
+        sql = sql.replace("%s", "'%s'")
+        query_str = sql % params
+
+        # TODO: handle potential exceptions here. what to do if query
+        # view is not created? - new field update_status?
+        cursor = connection.cursor()
+        cursor.execute(cls.CREATE_VIEW % (name, query_str))
+        cursor.execute(cls.CREATE_INDEX % (name, name))
+
     @classmethod
     def create(cls, query):
         # Check if view for this query exists.
-        cursor = connection.cursor()
         if not cls.view_exists(query.id):  # create view
-            sql, params = Query.get_queryset(
-                query.content_type, query.querycondition_set.all(), query.limit
-            ).query.sql_with_params()
-
-            sql = sql.replace("%s", "'%s'")
-            query_str = sql % params
+            cls._create(query, cls.view_name(query.id))
 
-            # TODO: handle potential exceptions here. what to do if query
-            # view is not created? - new field update_status?
-            query_str = cls.CREATE_VIEW % (cls.QUERY_VIEW_PREFIX, query.id, query_str)
-            cursor.execute(query_str)
+    @classmethod
+    def replace(cls, query):
+        """
+        Build the view again, for instance when the conditions have changed.
+        The new view is built under a temporary name so that the current one
+        can be read until they are swapped.
+        """
+        name = cls.view_name(query.id)
+        tmp_name = "%s_new" % name
+        cursor = connection.cursor()
+        cursor.execute(cls.DROP_VIEW % tmp_name)
+        cls._create(query, tmp_name)
+        with transaction.atomic():
+            cursor.execute(cls.DROP_VIEW % name)
+            cursor.execute(cls.RENAME_VIEW % (tmp_name, name))
+            cursor.execute(cls.RENAME_INDEX % (tmp_name, name))
 
     @classmethod
     def refresh(cls, query_id):
-        refresh_sql = cls.REFRESH_VIEW % (cls.QUERY_VIEW_PREFIX, query_id)
+        name = cls.view_name(query_id)
         cursor = connection.cursor()
-        cursor.execute(refresh_sql)
+        # The views created before the index was added
+        cursor.execute(cls.CREATE_INDEX % (name, name))
+        # Readers are not blocked while refreshing
+        cursor.execute(cls.REFRESH_VIEW % name)
 
     @classmethod
     def drop(cls, query_id):
-        drop_sql = cls.DROP_VIEW % (cls.QUERY_VIEW_PREFIX, query_id)
+        drop_sql = cls.DROP_VIEW % cls.view_name(query_id)
         cursor = connection.cursor()
         cursor.execute(drop_sql)
 
     @classmethod
     def view_exists(cls, query_id):
         cursor = connection.cursor()
-        cursor.execute(cls.VIEW_EXISTS % (cls.QUERY_VIEW_PREFIX, query_id))
+        cursor.execute(cls.VIEW_EXISTS % cls.view_name(query_id))
         return cursor.fetchone()[0]
 
     def get_queryset(self):
@@ -195,19 +234,28 @@ class TestSuite(models.Model, Queryable):
         verbose_name=u"Suite name", blank=True, null=True, default=None, max_length=200
     )
 
+    # Number of test cases per result, updated when the test cases are
+    # created. NULL for the suites created before the counters were added,
+    # until the "result_counters" command is run.
+    count_pass = models.PositiveIntegerField(null=True, default=0, editable=False)
+    count_fail = models.PositiveIntegerField(null=True, default=0, editable=False)
+    count_skip = models.PositiveIntegerField(null=True, default=0, editable=False)
+    count_unknown = models.PositiveIntegerField(null=True, default=0, editable=False)
+
+    def result_counts(self):
+        return result_counts(
+            self,
+            lambda: self.testcase_set.order_by()
+            .values_list("result")
+            .annotate(models.Count("id")),
+        )
+
     def testcase_count(self, value):
-        return self.testcase_set.filter(result=TestCase.RESULT_MAP[value]).count()
+        return self.result_counts()[value]
 
     def get_passfail_results(self):
         # Get pass fail results per lava_results_app.testsuite.
-        return {
-            self.name: {
-                "pass": self.testcase_count("pass"),
-                "fail": self.testcase_count("fail"),
-                "skip": self.testcase_count("skip"),
-                "unknown": self.testcase_count("unknown"),
-            }
-        }
+        return {self.name: self.result_counts()}
 
     def get_measurement_results(self):
         # Get measurement values per lava_results_app.testcase.
@@ -285,6 +333,38 @@ class TestSet(models.Model):
         )
 
 
+def _metadata_columns(metadata):
+    """
+    Return the values of the structured metadata columns of a TestCase from
+    the (dictionary) metadata collected by the pipeline action.
+    """
+    if not isinstance(metadata, dict):
+        return {
+            "metadata_json": None,
+            "duration": None,
+            "level": None,
+            "extra": None,
+            "error_type": None,
+        }
+    # Only keep JSON types, like the YAML text does for Decimal
+    metadata = json.loads(json.dumps(metadata, default=str))
+    duration = None
+    with contextlib.suppress(TypeError, ValueError):
+        duration = float(metadata.get("duration"))
+
+    def string(key):
+        value = metadata.get(key)
+        return None if value is None else str(value)
+
+    return {
+        "metadata_json": metadata,
+        "duration": duration,
+        "level": string("level"),
+        "extra": string("extra"),
+        "error_type": string("error_type"),
+    }
+
+
 @nottest
 class TestCase(models.Model, Queryable):
     """
@@ -362,6 +442,20 @@ class TestCase(models.Model, Queryable):
         verbose_name=_(u"Action meta data as a YAML string"),
     )
 
+    # Structured copy of the metadata, along with the most common keys, so
+    # that the metadata can be used in queries without parsing the YAML.
+    metadata_json = JSONField(blank=True, null=True, editable=False)
+
+    duration = models.FloatField(blank=True, null=True, editable=False)
+
+    level = models.CharField(
+        blank=True, null=True, max_length=100, db_index=True, editable=False
+    )
+
+    extra = models.TextField(blank=True, null=True, editable=False)
+
+    error_type = models.CharField(blank=True, null=True, max_length=100, editable=False)
+
     suite = models.ForeignKey(TestSuite)
 
     # Store start and end of the TestCase in the log file
@@ -378,8 +472,15 @@ class TestCase(models.Model, Queryable):
 
     buglinks = fields.GenericRelation(BugLink)
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=["metadata_json"], name="testcase_metadata_json_gin")
+        ]
+
     @property
     def action_metadata(self):
+        if self.metadata_json is not None:
+            return self.metadata_json or None
         if not self.metadata:
             return None
         try:
@@ -747,6 +848,12 @@ class Query(models.Model):
 
     CONDITIONS_SEPARATOR = ","
     CONDITION_DIVIDER = "__"
+    # The views are fully refreshed at this interval, as the results older
+    # than the watermark can still be modified or deleted.
+    FULL_REFRESH_INTERVAL = timedelta(days=1)
+    # The reads are counted in the cache and saved by batches
+    READ_COUNT_KEY = "query-reads-%d"
+    READ_COUNT_FLUSH = 20
 
     @property
     def owner_name(self):
@@ -771,6 +878,15 @@ class Query(models.Model):
 
     last_updated = models.DateTimeField(blank=True, null=True)
 
+    # Every test job older than the watermark was finished at the last
+    # refresh: their results cannot change the view anymore.
+    refresh_watermark = models.PositiveIntegerField(
+        blank=True, null=True, editable=False
+    )
+
+    # Number of reads since the last refresh
+    read_count = models.PositiveIntegerField(default=0, editable=False)
+
     group_by_attribute = models.CharField(
         blank=True, null=True, max_length=20, verbose_name="group by attribute"
     )
@@ -807,20 +923,57 @@ class Query(models.Model):
                 .visible_by_user(user)
             )
         else:
-            if self.content_type.model_class() == TestJob:
-                view = TestJobViewFactory(self)
-            elif self.content_type.model_class() == TestCase:
-                view = TestCaseViewFactory(self)
-            elif self.content_type.model_class() == TestSuite:
-                view = TestSuiteViewFactory(self)
-
+            # Used to refresh the most read views first
+            self.count_read()
             return (
-                view.__class__.objects.all()
+                self.get_view_model()
+                .objects.all()
                 .exclude(id__in=omitted_list)
                 .order_by(*order_by)
                 .visible_by_user(user)
             )
 
+    def count_read(self):
+        key = self.READ_COUNT_KEY % self.pk
+        if cache.add(key, 1, None):
+            count = 1
+        else:
+            try:
+                count = cache.incr(key)
+            except ValueError:
+                return
+        # Needed when the cache is not shared with refresh_queries
+        if count >= self.READ_COUNT_FLUSH:
+            self._save_read_count(self.pk, count)
+
+    @classmethod
+    def _save_read_count(cls, pk, count):
+        with contextlib.suppress(ValueError):
+            cache.decr(cls.READ_COUNT_KEY % pk, count)
+        cls.objects.filter(pk=pk).update(read_count=F("read_count") + count)
+
+    @classmethod
+    def flush_read_counts(cls):
+        """
+        Save the reads counted in the cache into Query.read_count.
+        """
+        keys = {
+            cls.READ_COUNT_KEY % pk: pk
+            for pk in cls.objects.filter(is_live=False).values_list("id", flat=True)
+        }
+        for (key, count) in cache.get_many(list(keys.keys())).items():
+            if count:
+                cls._save_read_count(keys[key], count)
+
+    def get_view_model(self):
+        if self.content_type.model_class() == TestJob:
+            view = TestJobViewFactory(self)
+        elif self.content_type.model_class() == TestCase:
+            view = TestCaseViewFactory(self)
+        elif self.content_type.model_class() == TestSuite:
+            view = TestSuiteViewFactory(self)
+        return view.__class__
+
     @classmethod
     def get_queryset(cls, content_type, conditions, limit=None, order_by=["-id"]):
         """ Return list of QuerySet objects for class 'content_type'.
@@ -928,13 +1081,63 @@ class Query(models.Model):
 
         return query_results
 
-    def refresh_view(self):
+    @classmethod
+    def get_watermark(cls):
+        """
+        Return the id of the oldest test job that could still be modified.
+        Older jobs are finished, along with their suites and test cases.
+        """
+        hour_ago = timezone.now() - timedelta(hours=1)
+        # Results can still be received just after the end of the job.
+        running = TestJob.objects.filter(
+            ~Q(state=TestJob.STATE_FINISHED)
+            | Q(end_time__isnull=True)
+            | Q(end_time__gt=hour_ago)
+        )
+        watermark = running.aggregate(models.Min("id"))["id__min"]
+        if watermark is None:
+            watermark = (
+                TestJob.objects.aggregate(models.Max("id"))["id__max"] or 0
+            ) + 1
+        return watermark
+
+    def is_view_outdated(self):
+        """
+        Check whether the results of the jobs newer than the watermark of the
+        last refresh could modify the view. For the older results, the ids
+        selected by the query (within its limit) are compared with the ones
+        of the view and a full refresh is done every FULL_REFRESH_INTERVAL.
+        """
+        if self.refresh_watermark is None or self.last_updated is None:
+            return True
+        if timezone.now() - self.last_updated > self.FULL_REFRESH_INTERVAL:
+            return True
+        model = self.content_type.model_class()
+        field = {TestJob: "id", TestSuite: "job", TestCase: "suite__job"}[model]
+        recent = {"%s__gte" % field: self.refresh_watermark}
+        # New results or results that could match now
+        results = Query.get_queryset(self.content_type, self.querycondition_set.all())
+        if results.filter(**recent).exists():
+            return True
+        # Results that might not match anymore
+        view = self.get_view_model().objects
+        if view.filter(**recent).exists():
+            return True
+        # Older results that were deleted or modified: the view only holds
+        # the first "limit" results, so compare the same selection
+        ids = results.values_list("id", flat=True)[: self.limit]
+        return set(ids) != set(view.values_list("id", flat=True))
+
+    def refresh_view(self, force=False, watermark=None):
+        """
+        Refresh the materialized view. Unless force is set, the view is only
+        refreshed when it might be outdated.
+        Return True if the view was refreshed.
+        """
 
         if self.is_live:
             raise RefreshLiveQueryError("Refreshing live query not permitted.")
 
-        hour_ago = timezone.now() - timedelta(hours=1)
-
         with transaction.atomic():
             # Lock the selected row until the end of transaction.
             query = Query.objects.select_for_update().get(pk=self.id)
@@ -947,21 +1150,39 @@ class Query(models.Model):
                 query.is_updating = True
                 query.save()
 
+        # Computed before the refresh: the jobs modified in the meantime will
+        # be checked again next time.
+        if watermark is None:
+            watermark = self.get_watermark()
+        refreshed = False
         try:
             if not self.has_view():
                 QueryMaterializedView.create(self)
+                refreshed = True
             elif self.is_changed:
-                QueryMaterializedView.drop(self.id)
-                QueryMaterializedView.create(self)
-            else:
+                QueryMaterializedView.replace(self)
+                refreshed = True
+            elif force or self.is_view_outdated():
                 QueryMaterializedView.refresh(self.id)
+                refreshed = True
 
-            self.last_updated = timezone.now()
+            if refreshed:
+                self.last_updated = timezone.now()
+                self.read_count = 0
+                cache.delete(self.READ_COUNT_KEY % self.pk)
             self.is_changed = False
+            self.refresh_watermark = watermark
 
         finally:
             self.is_updating = False
-            self.save()
+            # Do not overwrite the read counter when the view is not refreshed
+            fields = ["is_updating", "is_changed", "last_updated", "refresh_watermark"]
+            if refreshed:
+                fields.append("read_count")
+            Query.objects.filter(pk=self.pk).update(
+                **{name: getattr(self, name) for name in fields}
+            )
+        return refreshed
 
     @classmethod
     def parse_conditions(cls, content_type, conditions):
@@ -1091,6 +1312,51 @@ class Query(models.Model):
         return ("lava.results.query_display", [self.owner.username, self.name])
 
 
+def update_result_counters(test_cases):
+    """
+    Add the given test cases, already saved, to the result counters of their
+    suites and jobs.
+    """
+    suites = {}
+    for test_case in test_cases:
+        counts = suites.setdefault(test_case.suite_id, dict.fromkeys(RESULT_NAMES, 0))
+        counts[RESULT_NAMES[test_case.result]] += 1
+
+    jobs = {}
+    suite_jobs = dict(
+        TestSuite.objects.filter(id__in=list(suites.keys())).values_list("id", "job_id")
+    )
+    for (suite_id, counts) in suites.items():
+        job_counts = jobs.setdefault(
+            suite_jobs[suite_id], dict.fromkeys(RESULT_NAMES, 0)
+        )
+        for (name, count) in counts.items():
+            job_counts[name] += count
+
+    def increments(counts):
+        return {
+            "count_%s" % name: F("count_%s" % name) + count
+            for (name, count) in counts.items()
+            if count
+        }
+
+    # NULL counters (not yet computed) are left untouched
+    for (suite_id, counts) in suites.items():
+        TestSuite.objects.filter(id=suite_id).update(**increments(counts))
+    for (job_id, counts) in jobs.items():
+        TestJob.objects.filter(id=job_id).update(**increments(counts))
+
+
+@receiver(post_save, sender=TestCase)
+def testcase_post_handler(
+    sender, instance, created, **kwargs
+):  # pylint: disable=unused-argument
+    # bulk_create does not send this signal: the callers should use
+    # update_result_counters.
+    if created:
+        update_result_counters([instance])
+
+
 @receiver(pre_save, sender=Query)
 def limit_update_signal(sender, instance, **kwargs):
     # If the object does not exists, this is a new query: ignore
@@ -1444,6 +1710,9 @@ class ChartQuery(models.Model):
 
     DATE_FORMAT = "%d/%m/%Y %H:%M"
 
+    # Cache the series of the materialized views for one hour at most
+    CACHE_TIMEOUT = 3600
+
     def get_data(self, user, content_type=None, conditions=None):
         """
         Pack data from filter to json format based on Chart options.
@@ -1458,29 +1727,61 @@ class ChartQuery(models.Model):
 
         # TODO: order by attribute if attribute is used for x-axis.
         if hasattr(self, "query"):
-            results = self.query.get_results(user).order_by(
-                self.ORDER_BY_MAP[self.query.content_type.model_class()]
-            )
+            key = self.get_cache_key(user)
+            data = cache.get(key) if key is not None else None
+            if data is None:
+                model = self.query.content_type.model_class()
+                results = self.query.get_results(user).order_by(
+                    self.ORDER_BY_MAP[model]
+                )
+                data = self.get_chart_data(user, model, results)
+                if key is not None and data is not None:
+                    cache.set(key, data, self.CACHE_TIMEOUT)
         # TODO: order by attribute if attribute is used for x-axis.
         else:
+            model = content_type.model_class()
             results = Query.get_queryset(
-                content_type,
-                conditions,
-                order_by=[self.ORDER_BY_MAP[content_type.model_class()]],
+                content_type, conditions, order_by=[self.ORDER_BY_MAP[model]]
             ).visible_by_user(user)
+            data = self.get_chart_data(user, model, results)
 
-        if self.chart_type == "pass/fail":
-            chart_data["data"] = self.get_chart_passfail_data(user, results)
+        if data is not None:
+            chart_data["data"] = data
+        return chart_data
+
+    def get_cache_key(self, user):
+        """
+        Key of the cached series. Only the charts of materialized views are
+        cached: the key changes when the view is refreshed, when the results
+        omitted from the query or the chart options are modified.
+        """
+        if self.query.is_live or self.query.last_updated is None:
+            return None
+        omitted = QueryOmitResult.objects.filter(query=self.query).aggregate(
+            count=models.Count("id"), last=models.Max("id")
+        )
+        options = (
+            visibility_class(user),
+            self.query.last_updated.isoformat(),
+            omitted["count"],
+            omitted["last"],
+            self.chart_type,
+            self.xaxis_attribute,
+            self.attributes,
+        )
+        digest = hashlib.sha1(repr(options).encode("utf-8")).hexdigest()  # nosec
+        return "chart-data-%d-%s" % (self.id, digest)
 
+    def get_chart_data(self, user, model, query_results):
+        if self.chart_type == "pass/fail":
+            return self.get_chart_passfail_data(user, model, query_results)
         elif self.chart_type == "measurement":
             # TODO: In case of job or suite, do avg measurement, and later add
             # option to do min/max/other.
-            chart_data["data"] = self.get_chart_measurement_data(user, results)
-
+            return self.get_chart_measurement_data(user, model, query_results)
         elif self.chart_type == "attributes":
-            chart_data["data"] = self.get_chart_attributes_data(user, results)
-
-        return chart_data
+            return self.get_chart_attributes_data(user, model, query_results)
+        return None
 
     def get_basic_chart_data(self):
         data = {}
@@ -1533,99 +1834,22 @@ class ChartQuery(models.Model):
 
         return data
 
-    def get_chart_passfail_data(self, user, query_results):
-
-        data = []
-        for item in query_results:
-
-            # Set attribute based on xaxis_attribute.
-            attribute = item.get_xaxis_attribute(self.xaxis_attribute)
-            # If xaxis attribute is set and this query item does not have
-            # this specific attribute, ignore it.
-            if self.xaxis_attribute and not attribute:
-                continue
-
-            date = str(item.get_end_datetime())
-            attribute = attribute if attribute is not None else date
-
-            passfail_results = item.get_passfail_results()
-            for result in passfail_results:
-
-                if result:
-                    chart_item = {
-                        "id": result,
-                        "pk": item.id,
-                        "link": item.get_absolute_url(),
-                        "date": date,
-                        "attribute": attribute,
-                        "pass": passfail_results[result]["fail"] == 0,
-                        "passes": passfail_results[result]["pass"],
-                        "failures": passfail_results[result]["fail"],
-                        "skip": passfail_results[result]["skip"],
-                        "unknown": passfail_results[result]["unknown"],
-                        "total": (
-                            passfail_results[result]["pass"]
-                            + passfail_results[result]["fail"]
-                            + passfail_results[result]["unknown"]
-                            + passfail_results[result]["skip"]
-                        ),
-                    }
-                    data.append(chart_item)
-
-        return data
-
-    def get_chart_measurement_data(self, user, query_results):
-
-        data = []
-        for item in query_results:
-
-            # Set attribute based on xaxis_attribute.
-            attribute = item.get_xaxis_attribute(self.xaxis_attribute)
-            # If xaxis attribute is set and this query item does not have
-            # this specific attribute, ignore it.
-            if self.xaxis_attribute and not attribute:
-                continue
+    def get_chart_passfail_data(self, user, model, query_results):
+        from lava_results_app.chartdata import ChartData
 
-            date = str(item.get_end_datetime())
-            attribute = attribute if attribute is not None else date
+        return ChartData(model, query_results, self.xaxis_attribute).passfail_data()
 
-            measurement_results = item.get_measurement_results()
-            for result in measurement_results:
+    def get_chart_measurement_data(self, user, model, query_results):
+        from lava_results_app.chartdata import ChartData
 
-                if result:
-                    chart_item = {
-                        "id": result,
-                        "pk": item.id,
-                        "link": item.get_absolute_url(),
-                        "date": date,
-                        "attribute": attribute,
-                        "pass": measurement_results[result]["fail"] == 0,
-                        "measurement": measurement_results[result]["measurement"],
-                    }
-                data.append(chart_item)
+        return ChartData(model, query_results, self.xaxis_attribute).measurement_data()
 
-        return data
-
-    def get_chart_attributes_data(self, user, query_results):
-
-        data = []
-        for item in query_results:
-
-            attribute_results = item.get_attribute_results(self.attributes)
-            for result in attribute_results:
-                if result:
-                    chart_item = {
-                        "id": result,
-                        "pk": item.id,
-                        "attribute": str(item.get_end_datetime()),
-                        "link": item.get_absolute_url(),
-                        "date": str(item.get_end_datetime()),
-                        "pass": attribute_results[result]["fail"] == 0,
-                        "attr_value": attribute_results[result]["value"],
-                    }
-                data.append(chart_item)
+    def get_chart_attributes_data(self, user, model, query_results):
+        from lava_results_app.chartdata import ChartData
 
-        return data
+        return ChartData(
+            model, query_results, attributes=self.attributes
+        ).attributes_data()
 
     def __str__(self):
         return self.name
@@ -26,6 +26,9 @@ $(document).ready(function () {
         this.plot = null;
         this.chart_id = chart_id;
         this.chart_data = chart_data;
+        if (chart_data.data) {
+            this.chart_data.data = unpack_columns(chart_data.data);
+        }
         this.legend_items = {};
     }
 
@@ -1238,6 +1241,23 @@ $(document).ready(function () {
                 parseInt($("#inner_container_" + chart.chart_id).children().first().css("width")) - 90 + "px");
     }
 
+    unpack_columns = function(columns) {
+        // The series are sent as one array per column, rebuild the rows.
+        var rows = [];
+        var names = Object.keys(columns);
+        if (names.length == 0) {
+            return rows;
+        }
+        for (var i = 0; i < columns[names[0]].length; i++) {
+            var row = {};
+            for (var j = 0; j < names.length; j++) {
+                row[names[j]] = columns[names[j]][i];
+            }
+            rows.push(row);
+        }
+        return rows;
+    }
+
     isNumeric = function(n) {
         return !isNaN(parseFloat(n)) && isFinite(n);
     }
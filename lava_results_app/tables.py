@@ -85,7 +85,7 @@ class ResultsTable(LavaTable):
     def render_total(self, record, table=None):
         if not self._check_job(record, table):
             return ""
-        return TestCase.objects.filter(suite__job=record.job, suite=record).count()
+        return sum(record.result_counts().values())
 
     def render_logged(self, record, table=None):
         if not self._check_job(record, table):
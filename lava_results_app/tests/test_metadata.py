@@ -20,6 +20,7 @@ from lava_results_app.dbutils import (
     create_metadata_store,
     _get_action_metadata,  # pylint: disable=protected-access
 )
+from lava_results_app.metastore import MetadataStore, parse_reference, read_extra
 from lava_results_app.models import ActionData, MetaType, TestData, TestCase, TestSuite
 from lava_results_app.utils import export_testcase, testcase_export_fields
 from lava_dispatcher.parser import JobParser
@@ -142,6 +143,31 @@ class TestMetaTypes(TestCaseWithFactory):
         metadata_yaml_ref = "{case: unit-test, definition: unit-test, measurement: '1234.5', result: pass}"
         self.assertEqual(metadata_yaml_ref, test_case.metadata.strip())
 
+    def test_metadata_columns(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        test_dict = {
+            "definition": "lava",
+            "case": "http-download",
+            "level": "1.2.1",
+            "duration": "12.50",
+            "error_type": "Infrastructure",
+            "measurement": decimal.Decimal(1234.5),
+            "result": "fail",
+        }
+        test_case = map_scanned_results(test_dict, job, {}, None)
+        test_case.save()
+        test_case = TestCase.objects.get(id=test_case.id)
+        self.assertEqual(test_case.level, "1.2.1")
+        self.assertEqual(test_case.duration, 12.5)
+        self.assertEqual(test_case.error_type, "Infrastructure")
+        self.assertIsNone(test_case.extra)
+        self.assertEqual(test_case.metadata_json["measurement"], "1234.5")
+        self.assertEqual(test_case.action_metadata, test_case.metadata_json)
+        self.assertEqual(
+            TestCase.objects.filter(metadata_json__error_type="Infrastructure").count(),
+            1,
+        )
+
     def test_case_as_url(self):
         job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
         test_dict = {
@@ -189,35 +215,36 @@ class TestMetaTypes(TestCaseWithFactory):
             "extra": range(int(field.max_length / 2)),
             "result": "pass",
         }
-        stub = "%s-%s-%s.yaml" % (results["definition"], results["case"], level)
         job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
-        meta_filename = os.path.join(job.output_dir, "metadata", stub)
-        filename = "%s/job-%s/pipeline/%s/%s-%s.yaml" % (
-            job.output_dir,
-            job.id,
-            level.split(".")[0],
-            level,
-            results["definition"],
+        mkdir(job.output_dir)
+        reference = create_metadata_store(results, job)
+        self.assertEqual(
+            parse_reference(reference)[0], os.path.join(job.output_dir, "metadata.pack")
         )
-
-        mkdir(os.path.dirname(filename))
-        if os.path.exists(meta_filename):
-            # isolate from other unit tests
-            os.unlink(meta_filename)
-        self.assertEqual(meta_filename, create_metadata_store(results, job))
-        ret = map_scanned_results(results, job, {}, meta_filename)
+        ret = map_scanned_results(results, job, {}, reference)
         self.assertIsNotNone(ret)
         ret.save()
         self.assertEqual(TestCase.objects.filter(name="unit-test").count(), 1)
         test_data = yaml.load(  # nosec - unit test
             TestCase.objects.filter(name="unit-test")[0].metadata, Loader=yaml.CLoader
         )
-        self.assertEqual(test_data["extra"], meta_filename)
-        self.assertTrue(os.path.exists(meta_filename))
-        with open(test_data["extra"], "r") as extra_file:
-            data = yaml.load(extra_file, Loader=yaml.CLoader)  # nosec - unit test
-        self.assertIsNotNone(data)
-        os.unlink(meta_filename)
+        self.assertEqual(test_data["extra"], reference)
+        self.assertEqual(list(read_extra(test_data["extra"])), list(results["extra"]))
+
+        # Identical payloads are only stored once
+        store = MetadataStore(job.output_dir)
+        self.assertEqual(store.put(results["extra"]), reference)
+        other = store.put({"kernel": "4.19"})
+        self.assertNotEqual(other, reference)
+        # Not written before flush()
+        self.assertIsNone(read_extra(other))
+        store.flush()
+        self.assertEqual(read_extra(other), {"kernel": "4.19"})
+        # Merge the payloads of the same result
+        store.put({"kernel": "4.19"}, key=("lava", "unit-test", level))
+        merged = store.put({"rootfs": "stretch"}, key=("lava", "unit-test", level))
+        store.flush()
+        self.assertEqual(read_extra(merged), {"kernel": "4.19", "rootfs": "stretch"})
         shutil.rmtree(job.output_dir)
 
     def test_repositories(self):  # pylint: disable=too-many-locals
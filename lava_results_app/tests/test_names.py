@@ -1,11 +1,28 @@
 import os
 import yaml
+from datetime import timedelta
 import logging
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
 from django.core.validators import URLValidator
-from lava_results_app.models import TestCase, TestSuite
-from lava_results_app.dbutils import map_scanned_results
+from django.utils import timezone
+from lava_results_app.models import (
+    Query,
+    TestCase,
+    TestSet,
+    TestSuite,
+    update_result_counters,
+)
+from lava_results_app.chartdata import ChartData
+from lava_results_app.dbutils import ResultsCache, map_scanned_results
+from lava_results_app.utils import (
+    EXPORT_BATCH_SIZE,
+    export_testcases,
+    iter_testcases,
+    iter_testcases_with_limit,
+)
 from lava_scheduler_app.models import TestJob, Device, DeviceType
+from lava_scheduler_app.managers import visibility_class
 from django_testscenarios.ubertest import TestCase as DjangoTestCase
 
 from six import string_types
@@ -231,3 +248,226 @@ class TestTestSuite(TestCaseWithFactory):
             self.assertTrue(testcase.name.startswith("linux-INLINE-"))
             val("http://localhost/%s" % testcase.get_absolute_url())
         self.factory.cleanup()
+
+    def test_results_cache(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        existing = TestSuite.objects.create(job=job, name="lava")
+        cache = ResultsCache(job)
+        result_samples = [
+            {"case": "validate", "definition": "lava", "result": "pass"},
+            {
+                "case": "linux-INLINE-lscpu",
+                "definition": "smoke-tests-basic",
+                "result": "pass",
+                "set": "listing",
+            },
+            {
+                "case": "linux-INLINE-lspci",
+                "definition": "smoke-tests-basic",
+                "result": "pass",
+                "set": "listing",
+            },
+        ]
+        test_cases = []
+        for sample in result_samples:
+            ret = map_scanned_results(
+                results=sample, job=job, markers={}, meta_filename=None, cache=cache
+            )
+            self.assertTrue(ret)
+            test_cases.append(ret)
+        # Nothing is created before the cache is saved
+        self.assertTrue(cache.dirty())
+        self.assertEqual(1, TestSuite.objects.filter(job=job).count())
+        self.assertEqual(0, TestSet.objects.filter(suite__job=job).count())
+
+        cache.save()
+        self.assertFalse(cache.dirty())
+        ResultsCache.prepare(test_cases)
+        TestCase.objects.bulk_create(test_cases)
+
+        self.assertEqual(2, TestSuite.objects.filter(job=job).count())
+        self.assertEqual(1, TestSet.objects.filter(suite__job=job).count())
+        self.assertEqual(1, TestCase.objects.filter(suite=existing).count())
+        suite = TestSuite.objects.get(job=job, name="smoke-tests-basic")
+        for testcase in TestCase.objects.filter(suite=suite):
+            self.assertEqual(testcase.test_set.name, "listing")
+        self.factory.cleanup()
+
+    def test_result_counters(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        suite = TestSuite.objects.create(job=job, name="smoke")
+        # save() updates the counters
+        TestCase.objects.create(name="a", suite=suite, result=TestCase.RESULT_PASS)
+        # bulk_create does not
+        test_cases = [
+            TestCase(name="b", suite=suite, result=TestCase.RESULT_FAIL),
+            TestCase(name="c", suite=suite, result=TestCase.RESULT_FAIL),
+        ]
+        TestCase.objects.bulk_create(test_cases)
+        update_result_counters(test_cases)
+
+        suite.refresh_from_db()
+        job.refresh_from_db()
+        expected = {"pass": 1, "fail": 2, "skip": 0, "unknown": 0}
+        self.assertEqual(suite.result_counts(), expected)
+        self.assertEqual(job.result_counts(), expected)
+        self.assertEqual(suite.get_passfail_results(), {"smoke": expected})
+
+        # Missing counters are computed from the test cases
+        TestSuite.objects.filter(id=suite.id).update(count_pass=None)
+        TestJob.objects.filter(id=job.id).update(count_fail=None)
+        suite.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual(suite.result_counts(), expected)
+        self.assertEqual(job.result_counts(), expected)
+        self.factory.cleanup()
+
+    def test_export_testcases(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        suite = TestSuite.objects.create(job=job, name="smoke")
+        count = EXPORT_BATCH_SIZE + 10
+        TestCase.objects.bulk_create(
+            [
+                TestCase(name="case-%d" % i, suite=suite, result=TestCase.RESULT_PASS)
+                for i in range(count)
+            ]
+        )
+        ids = list(suite.testcase_set.order_by("id").values_list("id", flat=True))
+
+        # Every test case, in order, across the batches
+        test_cases = TestCase.objects.filter(suite__job=job)
+        self.assertEqual([t.id for t in iter_testcases(test_cases)], ids)
+        self.assertEqual([t.id for t in iter_testcases(test_cases, ids[9])], ids[10:])
+
+        # The limit and the offset cross the batch boundary
+        offset = EXPORT_BATCH_SIZE - 5
+        test_cases = iter_testcases_with_limit(suite, 10, offset)
+        self.assertEqual([t.id for t in test_cases], ids[offset : offset + 10])
+        self.assertEqual(len(list(iter_testcases_with_limit(suite))), count)
+        self.assertEqual(list(iter_testcases_with_limit(suite, 10, count)), [])
+        self.assertEqual(list(iter_testcases_with_limit(suite, 10, -1)), [])
+
+        data = "".join(export_testcases(iter_testcases_with_limit(suite), "yaml"))
+        self.assertEqual([t["id"] for t in yaml.safe_load(data)], [str(i) for i in ids])
+        data = "".join(export_testcases(iter_testcases_with_limit(suite), "csv"))
+        self.assertEqual(len(data.splitlines()), count + 1)
+        # Nothing to export
+        data = "".join(
+            export_testcases(iter_testcases_with_limit(suite, 10, count), "yaml")
+        )
+        self.assertEqual(yaml.safe_load(data), [])
+        self.assertEqual(data, yaml.dump([]))
+        self.factory.cleanup()
+
+    def test_chart_data(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        suite = TestSuite.objects.create(job=job, name="smoke")
+        TestCase.objects.create(
+            name="a", suite=suite, result=TestCase.RESULT_PASS, measurement=1
+        )
+        TestCase.objects.create(
+            name="b", suite=suite, result=TestCase.RESULT_FAIL, measurement=3
+        )
+        jobs = TestJob.objects.filter(id=job.id)
+
+        data = ChartData(TestJob, jobs).passfail_data()
+        self.assertEqual(data["id"], ["smoke"])
+        self.assertEqual(data["pk"], [job.id])
+        self.assertEqual(data["passes"], [1])
+        self.assertEqual(data["failures"], [1])
+        self.assertEqual(data["total"], [2])
+        self.assertEqual(data["pass"], [False])
+
+        data = ChartData(TestJob, jobs).measurement_data()
+        self.assertEqual(data["id"], ["smoke"])
+        self.assertEqual(data["measurement"], [2])
+        self.assertEqual(data["pass"], [False])
+
+        data = ChartData(
+            TestSuite, TestSuite.objects.filter(id=suite.id)
+        ).measurement_data()
+        self.assertEqual(data["id"], ["a", "b"])
+        self.assertEqual(data["measurement"], [1, 3])
+        self.assertEqual(data["pass"], [True, False])
+
+        # Items without the x-axis attribute are ignored
+        data = ChartData(TestJob, jobs, xaxis_attribute="build").passfail_data()
+        self.assertEqual(data["id"], [])
+        self.factory.cleanup()
+
+    def test_query_watermark(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        # The job is not finished
+        self.assertEqual(Query.get_watermark(), job.id)
+        job.state = TestJob.STATE_FINISHED
+        job.end_time = timezone.now()
+        job.save()
+        # Results could still be added
+        self.assertEqual(Query.get_watermark(), job.id)
+        job.end_time = timezone.now() - timedelta(days=1)
+        job.save()
+        self.assertEqual(Query.get_watermark(), job.id + 1)
+        self.factory.cleanup()
+
+    def test_query_outdated(self):
+        jobs = [
+            TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+            for _ in range(25)
+        ]
+        TestJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            state=TestJob.STATE_FINISHED, end_time=timezone.now() - timedelta(days=1)
+        )
+        query = Query.objects.create(
+            owner=self.user,
+            name="query-outdated",
+            content_type=ContentType.objects.get_for_model(TestJob),
+            limit=20,
+        )
+        self.assertTrue(query.refresh_view())
+        self.assertEqual(query.get_view_model().objects.count(), 20)
+        # More results than the limit: the view is up to date
+        self.assertFalse(query.is_view_outdated())
+        self.assertFalse(query.refresh_view())
+        # Older results that were deleted
+        jobs[-1].delete()
+        self.assertTrue(query.is_view_outdated())
+        self.assertTrue(query.refresh_view())
+        self.assertFalse(query.is_view_outdated())
+        query.delete()
+        self.factory.cleanup()
+
+    def test_visible_by_user(self):
+        user = self.factory.make_user()
+        data = self.factory.make_job_data()
+        data["visibility"] = "personal"
+        job = TestJob.from_yaml_and_user(yaml.dump(data), self.user)
+        self.assertFalse(job.is_public)
+        suite = TestSuite.objects.create(job=job, name="smoke")
+        TestCase.objects.create(name="a", suite=suite, result=TestCase.RESULT_PASS)
+
+        def visible(user):
+            return (
+                TestJob.objects.visible_by_user(user).filter(id=job.id).count(),
+                TestSuite.objects.visible_by_user(user).filter(job=job).count(),
+                TestCase.objects.visible_by_user(user).filter(suite=suite).count(),
+            )
+
+        self.assertEqual(visible(self.user), (1, 1, 1))
+        self.assertEqual(visible(user), (0, 0, 0))
+        self.assertEqual(visible(None), (0, 0, 0))
+
+        group = Group.objects.create(name="viewers")
+        key = visibility_class(user)
+        user.groups.add(group)
+        # The cached charts depend on the groups
+        self.assertNotEqual(visibility_class(user), key)
+        job.viewing_groups.add(group)
+        job.visibility = TestJob.VISIBLE_GROUP
+        job.save()
+        self.assertEqual(visible(user), (1, 1, 1))
+
+        user.is_superuser = True
+        user.save()
+        job.viewing_groups.clear()
+        self.assertEqual(visible(user), (1, 1, 1))
+        self.factory.cleanup()
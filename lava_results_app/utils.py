@@ -18,13 +18,16 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import csv
+import itertools
 import os
+import simplejson
 import yaml
 import logging
-from django.db import DataError
 from django.utils.translation import ungettext_lazy
 from django.core.exceptions import PermissionDenied
 from linaro_django_xmlrpc.models import AuthToken
+from lava_results_app.metastore import read_extra
 
 
 def help_max_length(max_length):
@@ -33,6 +36,27 @@ def help_max_length(max_length):
     ).format(max_length)
 
 
+# Names of the results, indexed by TestCase.RESULT_* values
+RESULT_NAMES = ("pass", "fail", "skip", "unknown")
+
+
+def result_counts(obj, aggregate):
+    """
+    Return the number of test cases for each result, using the counters
+    stored on obj (a TestSuite or a TestJob).
+    When the counters are not available, aggregate is called: it should
+    return (result, count) pairs.
+    """
+    counts = {name: getattr(obj, "count_%s" % name) for name in RESULT_NAMES}
+    if None not in counts.values():
+        return counts
+    counts = dict.fromkeys(RESULT_NAMES, 0)
+    for (result, count) in aggregate():
+        if result is not None:
+            counts[RESULT_NAMES[result]] = count
+    return counts
+
+
 class StreamEcho:  # pylint: disable=too-few-public-methods
     def write(self, value):  # pylint: disable=no-self-use,
         return value
@@ -135,28 +159,6 @@ def check_request_auth(request, job):
         raise PermissionDenied()
 
 
-def get_testcases_with_limit(testsuite, limit=None, offset=None):
-    logger = logging.getLogger("lava_results_app")
-    if limit:
-        try:
-            if not offset:
-                testcases = list(testsuite.testcase_set.all().order_by("id")[:limit])
-            else:
-                testcases = list(
-                    testsuite.testcase_set.all().order_by("id")[offset:][:limit]
-                )
-        except ValueError as e:
-            logger.warning("Offset and limit must be integers: %s", str(e))
-            return []
-        except DataError as e:
-            logger.warning("Offset must be positive integer: %s", str(e))
-            return []
-    else:
-        testcases = list(testsuite.testcase_set.all().order_by("id"))
-
-    return testcases
-
-
 def testcase_export_fields():
     """
     Keep this list in sync with the keys in export_testcase
@@ -190,16 +192,10 @@ def export_testcase(testcase, with_buglinks=False):
     :return: Dictionary containing relevant information formatted for export
     """
     metadata = dict(testcase.action_metadata) if testcase.action_metadata else {}
-    extra_source = []
-    extra_data = metadata.get("extra")
-    if isinstance(extra_data, str) and os.path.exists(extra_data):
-        with open(metadata["extra"], "r") as extra_file:
-            # TODO: this can fail!
-            items = yaml.load(extra_file, Loader=yaml.CLoader)
+    items = read_extra(metadata.get("extra"))
+    if isinstance(items, dict):
         # hide the !!python OrderedDict prefix from the output.
-        for key, value in items.items():
-            extra_source.append({key: value})
-        metadata["extra"] = extra_source
+        metadata["extra"] = [{key: value} for (key, value) in items.items()]
     casedict = {
         "name": str(testcase.name),
         "job": str(testcase.suite.job_id),
@@ -218,8 +214,97 @@ def export_testcase(testcase, with_buglinks=False):
         "metadata": metadata,
     }
     if with_buglinks:
-        casedict["buglinks"] = [
-            str(url) for url in testcase.buglinks.values_list("url", flat=True)
-        ]
+        # all() uses the prefetched buglinks, if any
+        casedict["buglinks"] = [str(link.url) for link in testcase.buglinks.all()]
 
     return casedict
+
+
+# Number of test cases fetched by each query when exporting
+EXPORT_BATCH_SIZE = 1000
+
+
+def iter_testcases(test_cases, after=0, with_buglinks=False):
+    """
+    Iterate on the test cases of the queryset, ordered by id and starting
+    after the given id.
+    The test cases are fetched by batches, using the last id as the cursor.
+    Unlike offsets, the cost of each query does not depend on the position in
+    the results.
+    """
+    test_cases = test_cases.select_related("suite").order_by("id")
+    if with_buglinks:
+        test_cases = test_cases.prefetch_related("buglinks")
+    while True:
+        batch = list(test_cases.filter(id__gt=after)[:EXPORT_BATCH_SIZE])
+        yield from batch
+        if len(batch) < EXPORT_BATCH_SIZE:
+            return
+        after = batch[-1].id
+
+
+def iter_testcases_with_limit(testsuite, limit=None, offset=None):
+    """
+    Iterate on the test cases of the suite, ordered by id. When limit is
+    set, skip the first offset test cases and stop after limit test cases.
+    The test cases are fetched by batches, see iter_testcases().
+    """
+    logger = logging.getLogger("lava_results_app")
+    test_cases = testsuite.testcase_set.all()
+    if not limit:
+        return iter_testcases(test_cases)
+    try:
+        (limit, offset) = (int(limit), int(offset or 0))
+    except (TypeError, ValueError) as e:
+        logger.warning("Offset and limit must be integers: %s", str(e))
+        return iter([])
+    if offset < 0:
+        logger.warning("Offset must be positive integer: %d", offset)
+        return iter([])
+    after = 0
+    if offset:
+        # Id of the last skipped test case
+        ids = list(
+            test_cases.order_by("id").values_list("id", flat=True)[offset - 1 : offset]
+        )
+        if not ids:
+            return iter([])
+        after = ids[0]
+    return itertools.islice(iter_testcases(test_cases, after), limit)
+
+
+def export_testcases(test_cases, fmt, with_buglinks=False):
+    """
+    Generate the export of the test cases (an iterable, see iter_testcases),
+    one test case at a time.
+    fmt is one of "csv", "yaml" or "jsonl" (one JSON object per line).
+    """
+    if fmt == "csv":
+        fieldnames = testcase_export_fields()
+        writer = csv.DictWriter(
+            StreamEcho(),
+            quoting=csv.QUOTE_ALL,
+            extrasaction="ignore",
+            fieldnames=fieldnames,
+        )
+        # writer.writeheader does not return the string while writer.writerow
+        # does.
+        yield writer.writerow(dict(zip(fieldnames, fieldnames)))
+        for test_case in test_cases:
+            yield writer.writerow(export_testcase(test_case, with_buglinks))
+    elif fmt == "yaml":
+        empty = True
+        for test_case in test_cases:
+            empty = False
+            yield yaml.dump(
+                [export_testcase(test_case, with_buglinks)], Dumper=yaml.CDumper
+            )
+        # An empty list and not an empty document
+        if empty:
+            yield yaml.dump([], Dumper=yaml.CDumper)
+    elif fmt == "jsonl":
+        for test_case in test_cases:
+            data = export_testcase(test_case, with_buglinks)
+            yield simplejson.dumps(data, default=str) + "\n"
+    else:
+        raise ValueError("Unknown export format '%s'" % fmt)
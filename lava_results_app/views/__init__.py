@@ -24,7 +24,6 @@ Views for the Results application
 Keep to just the response rendering functions
 """
 
-import os
 import csv
 import logging
 import simplejson
@@ -50,6 +49,7 @@ from lava_results_app.tables import (
 )
 from lava_results_app.utils import StreamEcho
 from lava_results_app.dbutils import export_testsuite
+from lava_results_app.metastore import read_extra
 from lava_results_app.models import (
     BugLink,
     QueryCondition,
@@ -61,8 +61,9 @@ from lava_results_app.models import (
 from lava_results_app.utils import (
     check_request_auth,
     export_testcase,
-    get_testcases_with_limit,
-    testcase_export_fields,
+    export_testcases,
+    iter_testcases,
+    iter_testcases_with_limit,
 )
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.tables import pklink
@@ -203,24 +204,9 @@ def testjob(request, job):
 def testjob_csv(request, job):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
-
-    def testjob_stream(suites, pseudo_buffer):
-        fieldnames = testcase_export_fields()
-        writer = csv.DictWriter(pseudo_buffer, fieldnames=fieldnames)
-        # writer.writeheader does not return the string while writer.writerow
-        # does. Copy writeheader code from csv.py and yield the value.
-        yield writer.writerow(dict(zip(fieldnames, fieldnames)))
-
-        for test_suite in suites:
-            for test_case in test_suite.testcase_set.all():
-                yield writer.writerow(export_testcase(test_case))
-
-    suites = job.testsuite_set.all().prefetch_related(
-        "test_sets__test_cases__actionlevels"
-    )
-    pseudo_buffer = StreamEcho()
+    test_cases = iter_testcases(TestCase.objects.filter(suite__job=job))
     response = StreamingHttpResponse(
-        testjob_stream(suites, pseudo_buffer), content_type="text/csv"
+        export_testcases(test_cases, "csv"), content_type="text/csv"
     )
     filename = "lava_%s.csv" % job.id
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
@@ -230,16 +216,10 @@ def testjob_csv(request, job):
 def testjob_yaml(request, job):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
-    suites = job.testsuite_set.all().prefetch_related(
-        "test_sets__test_cases__actionlevels"
+    test_cases = iter_testcases(TestCase.objects.filter(suite__job=job))
+    response = StreamingHttpResponse(
+        export_testcases(test_cases, "yaml"), content_type="text/yaml"
     )
-
-    def test_case_stream():
-        for test_suite in suites:
-            for test_case in test_suite.testcase_set.all():
-                yield yaml.dump([export_testcase(test_case)], Dumper=yaml.CDumper)
-
-    response = StreamingHttpResponse(test_case_stream(), content_type="text/yaml")
     filename = "lava_%s.yaml" % job.id
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
     return response
@@ -301,19 +281,12 @@ def suite_csv(request, job, pk):
     querydict = request.GET
     offset = querydict.get("offset", default=None)
     limit = querydict.get("limit", default=None)
-    response = HttpResponse(content_type="text/csv")
+    test_cases = iter_testcases_with_limit(test_suite, limit, offset)
+    response = StreamingHttpResponse(
+        export_testcases(test_cases, "csv"), content_type="text/csv"
+    )
     filename = "lava_%s.csv" % test_suite.name
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
-    writer = csv.DictWriter(
-        response,
-        quoting=csv.QUOTE_ALL,
-        extrasaction="ignore",
-        fieldnames=testcase_export_fields(),
-    )
-    writer.writeheader()
-    testcases = get_testcases_with_limit(test_suite, limit, offset)
-    for row in testcases:
-        writer.writerow(export_testcase(row))
     return response
 
 
@@ -336,7 +309,7 @@ def suite_csv_stream(request, job, pk):
 
     pseudo_buffer = StreamEcho()
     writer = csv.writer(pseudo_buffer)
-    testcases = get_testcases_with_limit(test_suite, limit, offset)
+    testcases = iter_testcases_with_limit(test_suite, limit, offset)
     response = StreamingHttpResponse(
         (writer.writerow(export_testcase(row)) for row in testcases),
         content_type="text/csv",
@@ -353,14 +326,12 @@ def suite_yaml(request, job, pk):
     querydict = request.GET
     offset = querydict.get("offset", default=None)
     limit = querydict.get("limit", default=None)
-    response = HttpResponse(content_type="text/yaml")
+    test_cases = iter_testcases_with_limit(test_suite, limit, offset)
+    response = StreamingHttpResponse(
+        export_testcases(test_cases, "yaml"), content_type="text/yaml"
+    )
     filename = "lava_%s.yaml" % test_suite.name
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
-    yaml_list = []
-    testcases = get_testcases_with_limit(test_suite, limit, offset)
-    for test_case in testcases:
-        yaml_list.append(export_testcase(test_case))
-    yaml.dump(yaml_list, response, Dumper=yaml.CDumper)
     return response
 
 
@@ -368,7 +339,7 @@ def suite_testcase_count(request, job, pk):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
     test_suite = get_object_or_404(TestSuite, name=pk, job=job)
-    test_case_count = test_suite.testcase_set.all().count()
+    test_case_count = sum(test_suite.result_counts().values())
     return HttpResponse(test_case_count, content_type="text/plain")
 
 
@@ -462,26 +433,20 @@ def testcase(request, case_id, job=None, pk=None):
     extra_source = {}
     logger = logging.getLogger("lava-master")
     for extra_case in test_cases:
-        try:
-            f_metadata = yaml.load(extra_case.metadata, Loader=yaml.CLoader)
-            if not f_metadata:
-                continue
-        except TypeError:
+        f_metadata = extra_case.action_metadata
+        if not f_metadata:
+            continue
+        if not isinstance(f_metadata, dict):
             logger.info("Unable to load extra case metadata for %s", extra_case)
             continue
-        extra_data = f_metadata.get("extra")
-        try:
-            if extra_data and os.path.exists(extra_data):
-                with open(f_metadata["extra"], "r") as extra_file:
-                    items = yaml.load(extra_file, Loader=yaml.CLoader)
-                # hide the !!python OrderedDict prefix from the output.
-                for key, value in items.items():
-                    extra_source.setdefault(extra_case.id, "")
-                    extra_source[extra_case.id] += "%s: %s\n" % (key, value)
-        except TypeError:
-            # In some old version of LAVA, extra_data is not a string but an OrderedDict
-            # In this case, just skip it.
-            pass
+        items = read_extra(f_metadata.get("extra"))
+        # In some old version of LAVA, extra_data is not a string but an
+        # OrderedDict. In this case, just skip it.
+        if isinstance(items, dict):
+            # hide the !!python OrderedDict prefix from the output.
+            for key, value in items.items():
+                extra_source.setdefault(extra_case.id, "")
+                extra_source[extra_case.id] += "%s: %s\n" % (key, value)
     template = loader.get_template("lava_results_app/case.html")
     trail_id = case.id if case else test_sets.first().name
     return HttpResponse(
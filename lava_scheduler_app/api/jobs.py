@@ -27,7 +27,7 @@ from linaro_django_xmlrpc.models import ExposedV2API
 
 import lava_common.schemas as schemas
 from lava_scheduler_app.api import SchedulerAPI
-from lava_scheduler_app.logutils import read_logs
+from lava_scheduler_app.logutils import query_logs, read_logs
 from lava_scheduler_app.models import TestJob
 from lava_results_app.models import TestCase
 
@@ -363,6 +363,86 @@ class SchedulerJobsAPI(ExposedV2API):
         except OSError:
             return (job_finished, xmlrpc.client.Binary("[]".encode("utf-8")))
 
+    def query_logs(
+        self,
+        job_id,
+        start=0,
+        end=None,
+        levels=None,
+        start_time=None,
+        end_time=None,
+        actions=None,
+    ):
+        """
+        Name
+        ----
+        `scheduler.jobs.query_logs` (`job_id`, `start=0`, `end=None`,
+        `levels=None`, `start_time=None`, `end_time=None`, `actions=None`)
+
+        Description
+        -----------
+        Return the logs for the given job, filtered on the server
+
+        Arguments
+        ---------
+        `job_id`: str
+          Job id
+        `start`: int
+          Show only after the given line
+        `end`: int
+          Do not return after the given line
+        `levels`: list
+          Only return the lines with the given levels ("results", "error",
+          ...)
+        `start_time`: str
+          Only return the lines logged at or after the given date (ISO 8601,
+          in UTC)
+        `end_time`: str
+          Only return the lines logged before the given date
+        `actions`: list
+          Only return the lines logged by the given actions (action levels
+          like "1.2" or names like "http-download")
+
+        Return value
+        ------------
+        This function returns a dictionary with:
+        * finished: True if and only if the job is finished
+        * data: the log lines
+        * next: the line to use as `start` to only get the lines logged
+          afterward
+        """
+        try:
+            job = TestJob.get_by_job_number(job_id)
+        except TestJob.DoesNotExist:
+            raise xmlrpc.client.Fault(404, "Job '%s' was not found." % job_id)
+
+        if not job.can_view(self.user):
+            raise xmlrpc.client.Fault(
+                403, "Job '%s' not available to user '%s'." % (job_id, self.user)
+            )
+
+        job_finished = job.state == TestJob.STATE_FINISHED
+
+        try:
+            (data, next_line) = query_logs(
+                job.output_dir,
+                start,
+                end,
+                levels=levels,
+                start_time=start_time,
+                end_time=end_time,
+                actions=actions,
+            )
+        except ValueError as exc:
+            raise xmlrpc.client.Fault(400, str(exc))
+        except OSError:
+            (data, next_line) = ("", start)
+        return {
+            "finished": job_finished,
+            "data": xmlrpc.client.Binary(data.encode("utf-8")),
+            "next": next_line,
+        }
+
     def show(self, job_id):
         """
         Name
@@ -63,14 +63,29 @@ def match_vlan_interface(device, job_def):
         or not device
     ):
         return False
+    vland = {
+        vlan_name: vlan["tags"]
+        for (vlan_name, vlan) in job_def["protocols"]["lava-vland"].items()
+    }
+    return match_vlan_tags(device, vland)
+
+
+def match_vlan_tags(device, vland, device_dict=None):
+    """
+    Check that the device has one interface for each of the requested vlans.
+    :param vland: the tags required by each vlan, as stored in the job facts:
+        {vlan_name: [tags]}
+    :param device_dict: the rendered device configuration if already known
+    """
     interfaces = []
     logger = logging.getLogger("lava-master")
-    device_dict = device.load_configuration()
+    if device_dict is None:
+        device_dict = device.load_configuration()
     if not device_dict or device_dict.get("parameters", {}).get("interfaces") is None:
         return False
 
-    for vlan_name in job_def["protocols"]["lava-vland"]:
-        tag_list = job_def["protocols"]["lava-vland"][vlan_name]["tags"]
+    for vlan_name in vland:
+        tag_list = vland[vlan_name]
         for interface in device_dict["parameters"]["interfaces"]:
             tags = device_dict["parameters"]["interfaces"][interface]["tags"]
             if not tags:
@@ -97,11 +112,8 @@ def match_vlan_interface(device, job_def):
                 # matched, do not check any further interfaces of this device for this vlan
                 break
 
-    logger.info(
-        "Matched: %s",
-        (len(interfaces) == len(job_def["protocols"]["lava-vland"].keys())),
-    )
-    return len(interfaces) == len(job_def["protocols"]["lava-vland"].keys())
+    logger.info("Matched: %s", (len(interfaces) == len(vland.keys())))
+    return len(interfaces) == len(vland.keys())
 
 
 # TODO: check the list of exception that can be raised
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process-wide renderer for the device configurations.
+
+The jinja2 environment is shared by every device, so compiled templates are
+kept in memory (and in the jinja2 bytecode cache for the other processes).
+The configuration rendered without a job context, the "extends" of each
+device dictionary and the health-check definitions are memoised. Each entry
+is invalidated when one of the files it was built from is modified.
+"""
+
+import contextlib
+import copy
+import jinja2
+import jinja2.meta
+import logging
+import os
+import yaml
+
+
+def _stat_key(filename):
+    """
+    Return a value that changes each time the file is modified, or None if the
+    file does not exist.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class DeviceConfigRenderer:
+    def __init__(self):
+        self.environments = {}
+        # filename -> (stat key, referenced template names)
+        self.references = {}
+        # (search path, hostname) -> (signature, rendered dict)
+        self.configurations = {}
+        # filename -> (stat key, extends)
+        self.extends = {}
+        # filename -> (stat key, content)
+        self.health_checks = {}
+
+    def clear(self):
+        self.__init__()
+
+    def environment(self, search_path):
+        env = self.environments.get(search_path)
+        if env is None:
+            env = jinja2.Environment(  # nosec - YAML, not HTML, no XSS scope.
+                autoescape=False,
+                loader=jinja2.FileSystemLoader(list(search_path)),
+                bytecode_cache=jinja2.FileSystemBytecodeCache(),
+                trim_blocks=True,
+            )
+            self.environments[search_path] = env
+        return env
+
+    def _find(self, search_path, name):  # pylint: disable=no-self-use
+        for path in search_path:
+            filename = os.path.join(path, name)
+            if os.path.exists(filename):
+                return filename
+        return None
+
+    def _referenced(self, env, filename):
+        key = _stat_key(filename)
+        cached = self.references.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with open(filename, "r") as f_in:
+            ast = env.parse(f_in.read())
+        # None when the name is computed at render time
+        names = list(jinja2.meta.find_referenced_templates(ast))
+        self.references[filename] = (key, names)
+        return names
+
+    def signature(self, search_path, name):
+        """
+        Return the stat keys of the template and of all the templates it
+        extends or includes. Return None when a dependency cannot be
+        resolved statically: the result should then not be cached.
+        """
+        env = self.environment(search_path)
+        signature = []
+        seen = set()
+        names = [name]
+        while names:
+            current = names.pop()
+            if current is None:
+                return None
+            if current in seen:
+                continue
+            seen.add(current)
+            filename = self._find(search_path, current)
+            if filename is None:
+                return None
+            try:
+                referenced = self._referenced(env, filename)
+            except (OSError, jinja2.TemplateError):
+                return None
+            signature.append((filename, _stat_key(filename)))
+            names.extend(referenced)
+        return tuple(sorted(signature))
+
+    def render(self, search_path, hostname, job_ctx):
+        """
+        Render the device dictionary as a string.
+        raise: OSError, jinja2.TemplateError
+        """
+        env = self.environment(search_path)
+        template = env.get_template("%s.jinja2" % hostname)
+        return template.render(**job_ctx)
+
+    def load(self, search_path, hostname):
+        """
+        Render and parse the device dictionary without any job context.
+        The result is cached until one of the templates is modified. The
+        caller gets its own copy of the dictionary.
+        raise: OSError, jinja2.TemplateError, yaml.YAMLError
+        """
+        key = (search_path, hostname)
+        signature = self.signature(search_path, "%s.jinja2" % hostname)
+        cached = self.configurations.get(key)
+        if signature is not None and cached is not None and cached[0] == signature:
+            return copy.deepcopy(cached[1])
+
+        data = yaml.safe_load(self.render(search_path, hostname, {}))
+        if signature is not None:
+            self.configurations[key] = (signature, data)
+        else:
+            self.configurations.pop(key, None)
+        return copy.deepcopy(data)
+
+    def get_extends(self, filename):
+        """
+        Return the name of the template extended by the given device
+        dictionary (without the extension).
+        """
+        key = _stat_key(filename)
+        if key is None:
+            return None
+        cached = self.extends.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        logger = logging.getLogger("lava_scheduler_app")
+        hostname = os.path.splitext(os.path.basename(filename))[0]
+        extends = None
+        try:
+            with open(filename, "r") as f_in:
+                jinja_config = f_in.read()
+        except OSError:
+            return None
+        if jinja_config:
+            env = jinja2.Environment(  # nosec - YAML, not HTML, no XSS scope.
+                autoescape=False
+            )
+            try:
+                ast = env.parse(jinja_config)
+                nodes = list(ast.find_all(jinja2.nodes.Extends))
+                if len(nodes) != 1:
+                    logger.error("Found %d extends for %s", len(nodes), hostname)
+                else:
+                    extends = os.path.splitext(nodes[0].template.value)[0]
+            except jinja2.TemplateError as exc:
+                logger.error("Invalid template for %s: %s", hostname, str(exc))
+        self.extends[filename] = (key, extends)
+        return extends
+
+    def get_health_check(self, path, extends):
+        """
+        Return the content of the health-check for the given device-type
+        template, with either a .yaml or a .yml extension.
+        """
+        for ext in ["yaml", "yml"]:
+            filename = os.path.join(path, "%s.%s" % (extends, ext))
+            key = _stat_key(filename)
+            if key is None:
+                self.health_checks.pop(filename, None)
+                continue
+            cached = self.health_checks.get(filename)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            with contextlib.suppress(OSError):
+                with open(filename, "r") as f_in:
+                    content = f_in.read()
+                self.health_checks[filename] = (key, content)
+                return content
+            return None
+        return None
+
+
+# Shared by the whole process
+renderer = DeviceConfigRenderer()
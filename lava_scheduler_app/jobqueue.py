@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-memory view of the queue of test jobs waiting for a device.
+
+lava-master keeps one JobQueue for its whole life time. The queue is loaded
+once from the database and then kept up to date from the ".testjob" events
+emitted by send_event(). Jobs are bucketed by requested device-type, by
+required tags and by submitter so that, for a given device, only the buckets
+that the device can accept are walked.
+"""
+
+import heapq
+import time
+
+from django.contrib.auth.models import User
+
+from lava_scheduler_app.models import TestJob
+
+# Reload the full queue from the database at this interval (in seconds). This
+# protects against lost events (send_event() is non-blocking).
+RESYNC_INTERVAL = 600
+# The events are sent before the transaction is committed: a job that is not
+# yet visible is looked up again for this number of refreshes.
+UNSEEN_REFRESHES = 5
+
+
+class QueuedJob:  # pylint: disable=too-few-public-methods
+    """
+    Minimal representation of a queued TestJob.
+    The sort key mimics the ordering used by the database query:
+      "-state", "-priority", "submit_time", "target_group", "id"
+    """
+
+    __slots__ = ("id", "device_type", "tags", "submitter_id", "protocols", "key")
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, job_id, device_type, tags, submitter_id, protocols, key):
+        self.id = job_id
+        self.device_type = device_type
+        self.tags = tags
+        self.submitter_id = submitter_id
+        self.protocols = protocols
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    @classmethod
+    def from_job(cls, job, tags):
+        key = (
+            -job.state,
+            -job.priority,
+            job.submit_time,
+            # PostgreSQL sorts NULL last with ascending order
+            job.target_group is None,
+            job.target_group or "",
+            job.id,
+        )
+        return cls(
+            job.id,
+            job.requested_device_type_id,
+            frozenset(tags),
+            job.submitter_id,
+            frozenset(job.protocols or []),
+            key,
+        )
+
+
+class JobQueue:
+    """
+    Indexed queue of the submitted test jobs:
+      {device_type: {(tags, submitter_id): {job_id: QueuedJob}}}
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.sorted = {}
+        self.jobs = {}
+        self.users = {}
+        self.dirty = set()
+        self.unseen = {}
+        self.removed = set()
+        self.last_load = 0
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def _base_query(self):  # pylint: disable=no-self-use
+        query = TestJob.objects.filter(
+            state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING]
+        )
+        query = query.filter(actual_device__isnull=True)
+        return query.filter(requested_device_type__isnull=False)
+
+    def _load_jobs(self, query):
+        jobs = list(query)
+        tags = {}
+        through = TestJob.tags.through.objects.filter(testjob__in=query.values("id"))
+        for (job_id, tag_name) in through.values_list("testjob_id", "tag__name"):
+            tags.setdefault(job_id, set()).add(tag_name)
+
+        # Only load the unknown submitters
+        user_ids = {j.submitter_id for j in jobs} - set(self.users.keys())
+        if user_ids:
+            self.users.update(User.objects.in_bulk(list(user_ids)))
+
+        for job in jobs:
+            self._add(QueuedJob.from_job(job, tags.get(job.id, [])))
+        return {job.id for job in jobs}
+
+    def _add(self, entry):
+        self._discard(entry.id)
+        self.jobs[entry.id] = entry
+        bucket_key = (entry.tags, entry.submitter_id)
+        bucket = self.buckets.setdefault(entry.device_type, {})
+        bucket.setdefault(bucket_key, {})[entry.id] = entry
+        self.sorted.pop((entry.device_type, bucket_key), None)
+
+    def _discard(self, job_id):
+        entry = self.jobs.pop(job_id, None)
+        if entry is None:
+            return
+        buckets = self.buckets[entry.device_type]
+        bucket_key = (entry.tags, entry.submitter_id)
+        del buckets[bucket_key][job_id]
+        self.sorted.pop((entry.device_type, bucket_key), None)
+        if not buckets[bucket_key]:
+            del buckets[bucket_key]
+
+    def load(self):
+        """
+        (Re)load the full queue from the database.
+        """
+        self.buckets = {}
+        self.sorted = {}
+        self.jobs = {}
+        self.users = {}
+        self.dirty = set()
+        self.unseen = {}
+        self.removed = set()
+        self._load_jobs(self._base_query())
+        self.last_load = time.time()
+
+    def handle_event(self, topic, data):
+        """
+        Update the view from a lava-publisher event.
+        The database is only queried later, in refresh(), so that the
+        transaction that generated the event has time to be committed.
+        """
+        if not topic.endswith(".testjob"):
+            return
+        try:
+            job_id = int(data["job"])
+        except (KeyError, TypeError, ValueError):
+            return
+        if data.get("state") in ["Submitted", "Scheduling"]:
+            self.dirty.add(job_id)
+            self.removed.discard(job_id)
+        else:
+            self.removed.add(job_id)
+            self.dirty.discard(job_id)
+            self.unseen.pop(job_id, None)
+
+    def remove(self, job_id):
+        self.dirty.discard(job_id)
+        self.unseen.pop(job_id, None)
+        self._discard(job_id)
+
+    def refresh(self):
+        """
+        Apply the pending changes.
+        The cost is proportional to the number of events received since the
+        last call and not to the size of the queue.
+        """
+        if time.time() - self.last_load > RESYNC_INTERVAL:
+            self.load()
+            return
+        for job_id in self.removed:
+            self._discard(job_id)
+        self.removed = set()
+
+        if self.dirty:
+            dirty = list(self.dirty)
+            self.dirty = set()
+            for job_id in dirty:
+                self._discard(job_id)
+            loaded = self._load_jobs(self._base_query().filter(id__in=dirty))
+            # Look up the jobs that are not yet visible again on the next
+            # refreshes
+            for job_id in dirty:
+                refreshes = self.unseen.pop(job_id, 0) + 1
+                if job_id not in loaded and refreshes < UNSEEN_REFRESHES:
+                    self.unseen[job_id] = refreshes
+                    self.dirty.add(job_id)
+
+    def _sorted_bucket(self, device_type, bucket_key):
+        # Buckets are only sorted again when they were modified
+        key = (device_type, bucket_key)
+        if key not in self.sorted:
+            self.sorted[key] = sorted(self.buckets[device_type][bucket_key].values())
+        return self.sorted[key]
+
+    def candidates(self, device, device_tags, with_vlans=True):
+        """
+        Iterate, in scheduling order, on the queued job ids that the given
+        device could run: same device-type, the job tags are a subset of the
+        device tags and the submitter is allowed to submit to this device.
+        Jobs using the lava-vland protocol are skipped unless with_vlans.
+        """
+        buckets = self.buckets.get(device.device_type_id, {})
+        device_tags = frozenset(device_tags)
+        iterators = []
+        for bucket_key in list(buckets.keys()):
+            (tags, submitter_id) = bucket_key
+            if not tags.issubset(device_tags):
+                continue
+            user = self.users.get(submitter_id)
+            if user is None or not device.can_submit(user):
+                continue
+            iterators.append(self._sorted_bucket(device.device_type_id, bucket_key))
+        for entry in heapq.merge(*iterators):
+            if not with_vlans and "lava-vland" in entry.protocols:
+                continue
+            yield entry.id
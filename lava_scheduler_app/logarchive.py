@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compressed archive of the logs of the finished jobs.
+
+output.yaml is cut in blocks of BLOCK_SIZE bytes, compressed independently
+with zlib, so that any offset can be read by decompressing a single block:
+  output.yaml.z         concatenated compressed blocks
+  output.yaml.zidx      header | blocks | zlib(line offsets)
+                        header: magic, block size, size, lines, blocks
+                        blocks: (offset, compressed offset) for every block
+                                and for the end of the file
+                        line offsets: same content as output.idx
+
+The archive replaces output.yaml and output.idx, along with the binary log
+store (output.bin*, see logstore). open_log() and log_size() work on both
+forms.
+"""
+
+import array
+import bisect
+import contextlib
+import fcntl
+import io
+import os
+import struct
+import zlib
+
+ARCHIVE_NAME = "output.yaml.z"
+INDEX_NAME = "output.yaml.zidx"
+BLOCK_SIZE = 256 * 1024
+MAGIC = b"LZIX"
+HEADER_FORMAT = "=4sIQQI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+BLOCK_FORMAT = "=QQ"
+BLOCK_ENTRY_SIZE = struct.calcsize(BLOCK_FORMAT)
+OFFSET_FORMAT = "Q"
+
+
+class Archive:
+    def __init__(self, directory):
+        self.filename = os.path.join(directory, ARCHIVE_NAME)
+        with open(os.path.join(directory, INDEX_NAME), "rb") as f_idx:
+            data = f_idx.read()
+        (magic, self.block_size, self.size, self.lines, count) = struct.unpack(
+            HEADER_FORMAT, data[:HEADER_SIZE]
+        )
+        if magic != MAGIC:
+            raise OSError("Invalid log archive index '%s'" % self.filename)
+        end = HEADER_SIZE + (count + 1) * BLOCK_ENTRY_SIZE
+        blocks = list(struct.iter_unpack(BLOCK_FORMAT, data[HEADER_SIZE:end]))
+        self.offsets = [b[0] for b in blocks]
+        self.compressed = [b[1] for b in blocks]
+        self._line_offsets = None
+        self._index_data = data[end:]
+
+    def line_offset(self, line):
+        """
+        Return the offset of the given line, None after the last line.
+        """
+        if self._line_offsets is None:
+            self._line_offsets = array.array(OFFSET_FORMAT)
+            self._line_offsets.frombytes(zlib.decompress(self._index_data))
+            self._index_data = None
+        if 0 <= line < len(self._line_offsets):
+            return self._line_offsets[line]
+        return None
+
+    def line_count(self):
+        return self.lines
+
+    def read_block(self, f_archive, index):
+        f_archive.seek(self.compressed[index])
+        length = self.compressed[index + 1] - self.compressed[index]
+        return zlib.decompress(f_archive.read(length))
+
+    def open(self):
+        """
+        Return a (binary) file object on the uncompressed log.
+        """
+        return io.BufferedReader(ArchiveReader(self), buffer_size=self.block_size)
+
+
+class ArchiveReader(io.RawIOBase):
+    """
+    Seekable reader, only decompressing the blocks that are read.
+    """
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+        self.f_archive = open(archive.filename, "rb")
+        self.position = 0
+        self.block = None
+        self.block_index = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.archive.size
+        if offset < 0:
+            raise ValueError("negative seek position %d" % offset)
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.archive.size:
+            return 0
+        index = bisect.bisect_right(self.archive.offsets, self.position) - 1
+        if index != self.block_index:
+            self.block = self.archive.read_block(self.f_archive, index)
+            self.block_index = index
+        start = self.position - self.archive.offsets[index]
+        data = self.block[start : start + len(buffer)]
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.f_archive.close()
+        super().close()
+
+
+def is_archived(directory):
+    return os.path.exists(os.path.join(directory, INDEX_NAME))
+
+
+def log_exists(directory):
+    return os.path.exists(os.path.join(directory, "output.yaml")) or is_archived(
+        directory
+    )
+
+
+def log_size(directory):
+    """
+    Return the size of the (uncompressed) log, 0 if the log does not exist.
+    """
+    with contextlib.suppress(OSError):
+        return os.stat(os.path.join(directory, "output.yaml")).st_size
+    with contextlib.suppress(OSError):
+        with open(os.path.join(directory, INDEX_NAME), "rb") as f_idx:
+            return struct.unpack(HEADER_FORMAT, f_idx.read(HEADER_SIZE))[2]
+    return 0
+
+
+def open_log(directory):
+    """
+    Open the log (binary mode), whether it is archived or not.
+    raise: OSError
+    """
+    try:
+        return open(os.path.join(directory, "output.yaml"), "rb")
+    except FileNotFoundError:
+        if not is_archived(directory):
+            raise
+    return Archive(directory).open()
+
+
+def _remove_store(directory):
+    """
+    Remove the log store: the archived logs are queried without it.
+    """
+    lock = os.path.join(directory, "output.bin.lock")
+    if not os.path.exists(lock):
+        return
+    # Wait for the store updates in progress
+    with open(lock, "a") as f_lock:
+        fcntl.flock(f_lock, fcntl.LOCK_EX)
+        for name in os.listdir(directory):
+            if name.startswith("output.bin") and name != "output.bin.lock":
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(os.path.join(directory, name))
+        os.unlink(lock)
+
+
+def archive_log(directory, level=6):
+    """
+    Compress output.yaml and output.idx into the archive and remove them,
+    along with the log store.
+    Return (size, compressed size) or None if there is nothing to archive.
+    raise: OSError
+    """
+    filename = os.path.join(directory, "output.yaml")
+    if not os.path.exists(filename):
+        return None
+    size = os.stat(filename).st_size
+
+    # Reuse the line index written by lava-logs, if any
+    offsets = array.array(OFFSET_FORMAT)
+    idx_filename = os.path.join(directory, "output.idx")
+    index_data = None
+    with contextlib.suppress(OSError):
+        with open(idx_filename, "rb") as f_idx:
+            index_data = f_idx.read()
+        index_data = index_data[: len(index_data) - len(index_data) % offsets.itemsize]
+
+    blocks = []
+    compressed = 0
+    tmp_archive = os.path.join(directory, ARCHIVE_NAME + ".tmp")
+    with open(filename, "rb") as f_log:
+        with open(tmp_archive, "wb") as f_archive:
+            offset = 0
+            while True:
+                data = f_log.read(BLOCK_SIZE)
+                if not data:
+                    break
+                if index_data is None:
+                    # Offset of the start of every line, as written by lava-logs
+                    if offset == 0:
+                        offsets.append(0)
+                    start = 0
+                    while True:
+                        index = data.find(b"\n", start)
+                        if index == -1 or offset + index + 1 >= size:
+                            break
+                        offsets.append(offset + index + 1)
+                        start = index + 1
+                blocks.append((offset, compressed))
+                chunk = zlib.compress(data, level)
+                f_archive.write(chunk)
+                offset += len(data)
+                compressed += len(chunk)
+    blocks.append((size, compressed))
+    if index_data is not None:
+        offsets.frombytes(index_data)
+
+    tmp_index = os.path.join(directory, INDEX_NAME + ".tmp")
+    with open(tmp_index, "wb") as f_idx:
+        f_idx.write(
+            struct.pack(
+                HEADER_FORMAT, MAGIC, BLOCK_SIZE, size, len(offsets), len(blocks) - 1
+            )
+        )
+        for block in blocks:
+            f_idx.write(struct.pack(BLOCK_FORMAT, *block))
+        f_idx.write(zlib.compress(offsets.tobytes(), level))
+
+    # The index is renamed last: the archive is only used once complete.
+    os.rename(tmp_archive, os.path.join(directory, ARCHIVE_NAME))
+    os.rename(tmp_index, os.path.join(directory, INDEX_NAME))
+    os.unlink(filename)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(idx_filename)
+    _remove_store(directory)
+    return (size, compressed + os.stat(os.path.join(directory, INDEX_NAME)).st_size)
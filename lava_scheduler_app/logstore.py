@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Binary log store, built next to output.yaml.
+
+Every line of output.yaml is stored as a record:
+  timestamp (microseconds, int64) | level (uint8) | length (uint32) | data
+
+For the lines dumped by the dispatcher, data is the YAML of the message
+only, as the rest of the line can be rebuilt from the timestamp and the
+level. The lines that cannot be rebuilt byte for byte are stored as is
+(the RAW flag is set on the level). The conversion is then lossless.
+
+Along with the records:
+  output.bin.idx        offset of each record
+  output.bin.<level>    line numbers of the records of the given level
+  output.bin.time       (timestamp, line) every TIME_CHECKPOINT records
+  output.bin.json       state of the conversion
+  output.bin.actions    lines of each action, built lazily from the "info"
+                        records (see actions())
+
+The store is updated incrementally from output.yaml by update(), so that
+filtering by level, by time or by action becomes an index lookup.
+Archived logs (see logarchive) are rarely read: query() reads them
+directly, without building the store.
+"""
+
+import bisect
+import contextlib
+import datetime
+import fcntl
+import heapq
+import itertools
+import json
+import os
+import re
+import struct
+from collections import namedtuple
+
+from lava_scheduler_app.logarchive import Archive, is_archived, log_size, open_log
+
+LEVELS = [
+    "debug",
+    "info",
+    "warning",
+    "error",
+    "exception",
+    "target",
+    "input",
+    "feedback",
+    "results",
+    "event",
+]
+RAW = 0x80
+
+RECORD_FORMAT = "=qBI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+OFFSET_FORMAT = "=Q"
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+TIME_FORMAT = "=qQ"
+TIME_SIZE = struct.calcsize(TIME_FORMAT)
+TIME_CHECKPOINT = 256
+
+EPOCH = datetime.datetime(1970, 1, 1)
+LINE = re.compile(
+    rb'^- \{"dt": "(?P<dt>[^"]+)", "lvl": "(?P<lvl>[a-z]+)", "msg": (?P<msg>.*)\}\n$'
+)
+
+# Messages logged by the dispatcher at the start and at the end of each action
+ACTION = re.compile(rb'^"(?P<kind>start|end): (?P<level>[0-9.]+) (?P<name>[^ "]+)')
+
+LogRecord = namedtuple("LogRecord", ["line", "timestamp", "level", "data"])
+
+
+def timestamp(value):
+    """
+    Convert a datetime (naive, in UTC) to a store timestamp.
+    """
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def _parse_dt(value):
+    for fmt in ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"]:
+        with contextlib.suppress(ValueError):
+            return timestamp(datetime.datetime.strptime(value, fmt))
+    return None
+
+
+def _format_dt(ts):
+    return (EPOCH + datetime.timedelta(microseconds=ts)).isoformat()
+
+
+def level_name(level):
+    level &= ~RAW
+    return LEVELS[level - 1] if 0 < level <= len(LEVELS) else None
+
+
+def encode_line(line, last_timestamp=0):
+    """
+    Return (timestamp, level, data) for the given line of output.yaml.
+    """
+    match = LINE.match(line)
+    if match is None:
+        return (last_timestamp, RAW, line)
+    lvl = match.group("lvl").decode("utf-8")
+    level = LEVELS.index(lvl) + 1 if lvl in LEVELS else 0
+    dt = match.group("dt").decode("utf-8")
+    ts = _parse_dt(dt)
+    if ts is None:
+        return (last_timestamp, level | RAW, line)
+    record = (ts, level, match.group("msg"))
+    # Only keep the compact form when the line can be rebuilt
+    if level == 0 or _format_dt(ts) != dt or decode_line(*record) != line:
+        return (ts, level | RAW, line)
+    return record
+
+
+def decode_line(ts, level, data):
+    """
+    Rebuild the line of output.yaml.
+    """
+    if level & RAW:
+        return data
+    return b'- {"dt": "%s", "lvl": "%s", "msg": %s}\n' % (
+        _format_dt(ts).encode("utf-8"),
+        LEVELS[level - 1].encode("utf-8"),
+        data,
+    )
+
+
+class LogStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, suffix):
+        return os.path.join(self.directory, "output.%s" % suffix)
+
+    @contextlib.contextmanager
+    def _lock(self, exclusive):
+        with open(self._path("bin.lock"), "a") as f_lock:
+            fcntl.flock(f_lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f_lock, fcntl.LOCK_UN)
+
+    def _load_state(self):
+        try:
+            with open(self._path("bin.json"), "r") as f_state:
+                return json.load(f_state)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        tmp = self._path("bin.json.tmp")
+        with open(tmp, "w") as f_state:
+            json.dump(state, f_state)
+        os.rename(tmp, self._path("bin.json"))
+
+    def _files(self, state):
+        """
+        Return the expected size of every file for the given state.
+        """
+        files = {
+            "bin": state["bin"],
+            "bin.idx": state["lines"] * OFFSET_SIZE,
+            "bin.time": ((state["lines"] + TIME_CHECKPOINT - 1) // TIME_CHECKPOINT)
+            * TIME_SIZE,
+        }
+        for (lvl, count) in state["levels"].items():
+            files["bin.%s" % lvl] = count * OFFSET_SIZE
+        return files
+
+    def _reset(self):
+        with contextlib.suppress(OSError):
+            os.unlink(self._path("bin.json"))
+        for name in os.listdir(self.directory):
+            if name.startswith("output.bin") and name != "output.bin.lock":
+                os.unlink(os.path.join(self.directory, name))
+        return {"yaml": 0, "bin": 0, "lines": 0, "levels": {}, "last": 0}
+
+    def update(self):
+        """
+        Convert the lines appended to output.yaml since the last call.
+        Return the current state.
+        """
+        with self._lock(True):
+            return self._update()
+
+    def _update(self):
+        state = self._load_state()
+        yaml_size = log_size(self.directory)
+
+        if state is None or yaml_size < state["yaml"]:
+            state = self._reset()
+        else:
+            # Drop the data appended after the last saved state (crash) or
+            # start again if some data is missing.
+            for (suffix, size) in self._files(state).items():
+                current = _size(self._path(suffix))
+                if current < size:
+                    state = self._reset()
+                    break
+                elif current > size:
+                    os.truncate(self._path(suffix), size)
+
+        if yaml_size == state["yaml"]:
+            return state
+
+        levels = {}
+        with contextlib.ExitStack() as stack:
+            f_yaml = stack.enter_context(open_log(self.directory))
+            f_bin = stack.enter_context(open(self._path("bin"), "ab"))
+            f_idx = stack.enter_context(open(self._path("bin.idx"), "ab"))
+            f_time = stack.enter_context(open(self._path("bin.time"), "ab"))
+            f_yaml.seek(state["yaml"])
+            offset = state["bin"]
+            for line in f_yaml:
+                # Only convert complete lines
+                if not line.endswith(b"\n"):
+                    break
+                (ts, level, data) = encode_line(line, state["last"])
+                if state["lines"] % TIME_CHECKPOINT == 0:
+                    f_time.write(struct.pack(TIME_FORMAT, ts, state["lines"]))
+                f_idx.write(struct.pack(OFFSET_FORMAT, offset))
+                f_bin.write(struct.pack(RECORD_FORMAT, ts, level, len(data)))
+                f_bin.write(data)
+                lvl = level_name(level)
+                if lvl is not None:
+                    levels.setdefault(lvl, []).append(state["lines"])
+                offset += RECORD_SIZE + len(data)
+                state["yaml"] += len(line)
+                state["lines"] += 1
+                state["last"] = ts
+            state["bin"] = offset
+
+        for (lvl, lines) in levels.items():
+            with open(self._path("bin.%s" % lvl), "ab") as f_lvl:
+                f_lvl.write(struct.pack("=%dQ" % len(lines), *lines))
+            state["levels"][lvl] = state["levels"].get(lvl, 0) + len(lines)
+        self._save_state(state)
+        return state
+
+    def _read_index(self, suffix, fmt, size, start=0, end=None):
+        with open(self._path(suffix), "rb") as f_in:
+            f_in.seek(start * size)
+            data = f_in.read() if end is None else f_in.read((end - start) * size)
+        return [v[0] if len(v) == 1 else v for v in struct.iter_unpack(fmt, data)]
+
+    def _time_to_line(self, state, ts):
+        """
+        Return the first line with a timestamp greater or equal to ts.
+        Timestamps are expected to be increasing.
+        """
+        checkpoints = self._read_index("bin.time", TIME_FORMAT, TIME_SIZE)
+        if not checkpoints:
+            return 0
+        index = bisect.bisect_left([c[0] for c in checkpoints], ts)
+        line = checkpoints[max(0, index - 1)][1]
+        for record in self._records(state, range(line, state["lines"])):
+            if record.timestamp >= ts:
+                return record.line
+        return state["lines"]
+
+    def _records(self, state, lines):
+        with open(self._path("bin.idx"), "rb") as f_idx:
+            with open(self._path("bin"), "rb") as f_bin:
+                for line in lines:
+                    if line >= state["lines"]:
+                        return
+                    f_idx.seek(line * OFFSET_SIZE)
+                    f_bin.seek(struct.unpack(OFFSET_FORMAT, f_idx.read(OFFSET_SIZE))[0])
+                    (ts, level, length) = struct.unpack(
+                        RECORD_FORMAT, f_bin.read(RECORD_SIZE)
+                    )
+                    yield LogRecord(line, ts, level, f_bin.read(length))
+
+    def _current_state(self):
+        # The state is replaced atomically and the files are only appended:
+        # readers do not need the lock.
+        state = self._load_state()
+        if state is None or state["yaml"] != log_size(self.directory):
+            state = self.update()
+        return state
+
+    def actions(self, state=None):
+        """
+        Return {action level: [action name, first line, last line + 1]} for
+        the actions started in the log. The last line is None for the
+        actions that are still running.
+        The result is cached and only the new "info" records are parsed.
+        """
+        if state is None:
+            state = self._current_state()
+        count = state["levels"].get("info", 0)
+        try:
+            with open(self._path("bin.actions"), "r") as f_actions:
+                cache = json.load(f_actions)
+        except (OSError, ValueError):
+            cache = None
+        # The store was rebuilt since the last call
+        if cache is None or cache["info"] > count:
+            cache = {"info": 0, "actions": {}}
+        if cache["info"] == count:
+            return cache["actions"]
+
+        lines = self._read_index(
+            "bin.info", OFFSET_FORMAT, OFFSET_SIZE, cache["info"], count
+        )
+        actions = cache["actions"]
+        for record in self._records(state, lines):
+            _parse_action(actions, record)
+        cache["info"] = count
+
+        tmp = self._path("bin.actions.%d.tmp" % os.getpid())
+        with contextlib.suppress(OSError):
+            with open(tmp, "w") as f_actions:
+                json.dump(cache, f_actions)
+            os.rename(tmp, self._path("bin.actions"))
+        return actions
+
+    def query(
+        self,
+        start=0,
+        end=None,
+        levels=None,
+        start_time=None,
+        end_time=None,
+        actions=None,
+    ):
+        """
+        Return the records between the lines [start, end[, with the given
+        levels, with a timestamp in [start_time, end_time[ and logged by the
+        given actions (levels or names).
+        Return (records, next line) where the next line should be used as
+        start to only get the lines added later on.
+        """
+        if is_archived(self.directory):
+            return self._query_archive(
+                start, end, levels, start_time, end_time, actions
+            )
+        state = self._current_state()
+
+        end = state["lines"] if end is None else min(end, state["lines"])
+        if start_time is not None:
+            start = max(start, self._time_to_line(state, start_time))
+        if end_time is not None:
+            end = min(end, self._time_to_line(state, end_time))
+        if start >= end:
+            return ([], max(start, end))
+
+        if actions is None:
+            ranges = [[start, end]]
+        else:
+            ranges = _action_ranges(
+                self.actions(state), actions, start, end, state["lines"]
+            )
+
+        if levels is None:
+            lines = itertools.chain.from_iterable(range(*r) for r in ranges)
+        else:
+            indexes = []
+            for lvl in levels:
+                count = state["levels"].get(lvl, 0)
+                if not count:
+                    continue
+                indexes.append(
+                    self._read_index(
+                        "bin.%s" % lvl, OFFSET_FORMAT, OFFSET_SIZE, 0, count
+                    )
+                )
+            starts = [r[0] for r in ranges]
+
+            def in_ranges(line):
+                index = bisect.bisect_right(starts, line) - 1
+                return index >= 0 and line < ranges[index][1]
+
+            lines = (line for line in heapq.merge(*indexes) if in_ranges(line))
+        return (list(self._records(state, lines)), end)
+
+    def _archive_records(self):
+        with open_log(self.directory) as f_log:
+            last = 0
+            for (line, data) in enumerate(f_log):
+                if not data.endswith(b"\n"):
+                    return
+                (last, level, data) = encode_line(data, last)
+                yield LogRecord(line, last, level, data)
+
+    # pylint: disable=too-many-arguments
+    def _query_archive(self, start, end, levels, start_time, end_time, actions):
+        """
+        Same as query() for the archived logs, reading the archive instead of
+        the store.
+        """
+        count = Archive(self.directory).line_count()
+        # Resolve the time and action filters
+        times = {start_time: count, end_time: count}
+        found = {}
+        if start_time is not None or end_time is not None or actions is not None:
+            for record in self._archive_records():
+                for ts in [start_time, end_time]:
+                    if ts is not None and times[ts] == count and record.timestamp >= ts:
+                        times[ts] = record.line
+                if actions is not None and level_name(record.level) == "info":
+                    _parse_action(found, record)
+
+        end = count if end is None else min(end, count)
+        if start_time is not None:
+            start = max(start, times[start_time])
+        if end_time is not None:
+            end = min(end, times[end_time])
+        if start >= end:
+            return ([], max(start, end))
+
+        if actions is None:
+            ranges = [[start, end]]
+        else:
+            ranges = _action_ranges(found, actions, start, end, count)
+        starts = [r[0] for r in ranges]
+        records = []
+        for record in self._archive_records():
+            if not ranges or record.line >= ranges[-1][1]:
+                break
+            index = bisect.bisect_right(starts, record.line) - 1
+            if index < 0 or record.line >= ranges[index][1]:
+                continue
+            if levels is None or level_name(record.level) in levels:
+                records.append(record)
+        return (records, end)
+
+    def read(self, *args, **kwargs):
+        """
+        Same as query() but only return the records.
+        """
+        return self.query(*args, **kwargs)[0]
+
+    def read_yaml(self, **kwargs):
+        """
+        Same as read() but return the lines of output.yaml.
+        """
+        return b"".join(
+            decode_line(r.timestamp, r.level, r.data) for r in self.read(**kwargs)
+        ).decode("utf-8")
+
+    def export_yaml(self, filename):
+        """
+        Rebuild output.yaml from the records.
+        """
+        state = self.update()
+        with open(filename, "wb") as f_out:
+            for record in self._records(state, range(state["lines"])):
+                f_out.write(decode_line(record.timestamp, record.level, record.data))
+
+    def import_records(self, records):
+        """
+        Create output.yaml (and the store) from (timestamp, level, data)
+        records. output.yaml should not exist.
+        """
+        with open(self._path("yaml"), "xb") as f_out:
+            for (ts, level, data) in records:
+                f_out.write(decode_line(ts, level, data))
+        return self.update()
+
+
+def _parse_action(actions, record):
+    """
+    Update {action level: [action name, first line, last line + 1]} with the
+    given "info" record.
+    """
+    match = None if record.level & RAW else ACTION.match(record.data)
+    if match is None:
+        return
+    level = match.group("level").decode("utf-8")
+    if match.group("kind") == b"start":
+        name = match.group("name").decode("utf-8")
+        actions[level] = [name, record.line, None]
+    elif level in actions:
+        actions[level][2] = record.line + 1
+
+
+def _action_ranges(all_actions, actions, start, end, count):
+    """
+    Return the sorted and disjoint [start, end[ ranges of the lines of the
+    given actions (levels or names), within [start, end[.
+    """
+    ranges = []
+    for (level, (name, first, last)) in all_actions.items():
+        if level in actions or name in actions:
+            ranges.append((first, count if last is None else last))
+    merged = []
+    for (first, last) in sorted(ranges):
+        if merged and first <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return [
+        [max(start, first), min(end, last)]
+        for (first, last) in merged
+        if first < end and last > start
+    ]
+
+
+def _size(filename):
+    try:
+        return os.stat(filename).st_size
+    except OSError:
+        return 0
@@ -17,8 +17,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import datetime
 import pathlib
 import struct
+import yaml
+
+from lava_scheduler_app.logarchive import Archive, is_archived, log_exists
+from lava_scheduler_app.logstore import LEVELS, LogStore, decode_line, timestamp
 
 PACK_FORMAT = "=Q"
 PACK_SIZE = struct.calcsize(PACK_FORMAT)
@@ -47,29 +53,156 @@ def line_count(f_idx):
     return int(f_idx.tell() / PACK_SIZE)
 
 
-def read_logs(dir_name, start=0, end=None):
-    directory = pathlib.Path(dir_name)
+class _FileIndex:
+    def __init__(self, f_idx):
+        self.f_idx = f_idx
+
+    def line_offset(self, line):
+        return _get_line_offset(self.f_idx, line)
+
+    def line_count(self):
+        self.f_idx.seek(0, 2)
+        return line_count(self.f_idx)
+
+
+@contextlib.contextmanager
+def _open_logs(directory):
+    """
+    Yield (log file, line index) whether the log is archived or not.
+    """
+    if not (directory / "output.yaml").exists() and is_archived(str(directory)):
+        archive = Archive(str(directory))
+        with archive.open() as f_log:
+            yield (f_log, archive)
+        return
+
     if not (directory / "output.idx").exists():
         _build_index(directory)
-
     with open(str(directory / "output.idx"), "rb") as f_idx:
-        start_offset = _get_line_offset(f_idx, start)
+        with open(str(directory / "output.yaml"), "rb") as f_log:
+            yield (f_log, _FileIndex(f_idx))
+
+
+def read_logs(dir_name, start=0, end=None):
+    directory = pathlib.Path(dir_name)
+    with _open_logs(directory) as (f_log, index):
+        start_offset = index.line_offset(start)
         if start_offset is None:
             return ""
-        with open(str(directory / "output.yaml"), "rb") as f_log:
-            f_log.seek(start_offset)
-            if end is None:
-                return f_log.read().decode("utf-8")
-            end_offset = _get_line_offset(f_idx, end)
-            if end_offset is None:
-                return f_log.read().decode("utf-8")
-            if end_offset <= start_offset:
-                return ""
-            return f_log.read(end_offset - start_offset).decode("utf-8")
+        f_log.seek(start_offset)
+        if end is None:
+            return f_log.read().decode("utf-8")
+        end_offset = index.line_offset(end)
+        if end_offset is None:
+            return f_log.read().decode("utf-8")
+        if end_offset <= start_offset:
+            return ""
+        return f_log.read(end_offset - start_offset).decode("utf-8")
+
+
+def _log_timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return timestamp(value)
+    value = str(value).rstrip("Z")
+    for fmt in ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]:
+        with contextlib.suppress(ValueError):
+            return timestamp(datetime.datetime.strptime(value, fmt))
+    raise ValueError("Invalid date '%s'" % value)
+
+
+def query_logs(
+    dir_name,
+    start=0,
+    end=None,
+    levels=None,
+    start_time=None,
+    end_time=None,
+    actions=None,
+):
+    """
+    Return the log lines matching the filters, along with the line to use
+    as start to get the lines logged afterward: (data, next line).
+    The filters are resolved with the indexes of the LogStore, built lazily
+    next to the log file.
+    :param levels: list of log levels ("results", "error", ...)
+    :param start_time: datetime or ISO 8601 string in UTC
+    :param end_time: datetime or ISO 8601 string (excluded)
+    :param actions: list of action levels or names ("1.2", "http-download")
+    raise: ValueError for invalid filters, FileNotFoundError
+    """
+    if levels is not None:
+        unknown = set(levels) - set(LEVELS)
+        if unknown:
+            raise ValueError("Unknown log levels: %s" % ", ".join(sorted(unknown)))
+    directory = pathlib.Path(dir_name)
+    if not log_exists(str(directory)):
+        raise FileNotFoundError(str(directory / "output.yaml"))
+
+    store = LogStore(str(directory))
+    (records, next_line) = store.query(
+        start=start,
+        end=end,
+        levels=levels,
+        start_time=_log_timestamp(start_time),
+        end_time=_log_timestamp(end_time),
+        actions=actions,
+    )
+    data = b"".join(decode_line(r.timestamp, r.level, r.data) for r in records)
+    return (data.decode("utf-8"), next_line)
+
+
+def iter_logs(dir_name, start=0, end=None, needles=None):
+    """
+    Parse the log lines one by one, from line start to line end (excluded).
+    Yield (line number, data) where data is None for invalid lines.
+    When needles is set, the lines that do not contain any of the needles
+    are skipped without being parsed.
+    """
+    directory = pathlib.Path(dir_name)
+    with _open_logs(directory) as (f_log, index):
+        start_offset = index.line_offset(start)
+        if start_offset is None:
+            return
+        if end is None:
+            end = index.line_count()
+
+        f_log.seek(start_offset)
+        for number in range(start, end):
+            line = f_log.readline()
+            # Stop on partial lines (still being written)
+            if not line.endswith(b"\n"):
+                return
+            if needles is not None and not any(n in line for n in needles):
+                continue
+            try:
+                data = yaml.load(line, Loader=yaml.CLoader)
+            except yaml.YAMLError:
+                data = None
+            if isinstance(data, list) and len(data) == 1:
+                yield (number, data[0])
+            else:
+                yield (number, None)
 
 
 def write_logs(f_log, f_idx, line):
-    f_idx.write(struct.pack(PACK_FORMAT, f_log.tell()))
+    write_logs_batch(f_log, f_idx, [line])
+
+
+def write_logs_batch(f_log, f_idx, lines):
+    """
+    Append the lines to the log and the corresponding offsets to the index
+    with only one write (and flush) per file.
+    """
+    offsets = []
+    offset = f_log.tell()
+    for line in lines:
+        offsets.append(offset)
+        offset += len(line)
+    f_idx.write(struct.pack("=%dQ" % len(offsets), *offsets))
     f_idx.flush()
-    f_log.write(line)
+    f_log.write(b"".join(lines))
     f_log.flush()
@@ -23,58 +23,93 @@ from django.db.models import Q
 from django_restricted_resource.managers import RestrictedResourceQuerySet
 
 
+def user_visibility(user):
+    """
+    Return the visibility class of the user and the ids of their groups.
+    The result is kept on the user object, for the rest of the request, like
+    the permissions.
+    """
+    if not user or user.is_anonymous:
+        return ("anonymous", ())
+    visibility = getattr(user, "_job_visibility", None)
+    if visibility is not None:
+        return visibility
+
+    if (
+        user.is_superuser
+        or user.has_perm("lava_scheduler_app.cancel_resubmit_testjob")
+        or user.has_perm("lava_scheduler_app.change_device")
+    ):
+        visibility = ("all", ())
+    else:
+        groups = tuple(user.groups.values_list("id", flat=True))
+        visibility = ("user-%d" % user.id, groups)
+    user._job_visibility = visibility
+    return visibility
+
+
+def visibility_class(user):
+    """
+    Return a key shared by all the users that can see the same test jobs:
+    anonymous users, users that can see every job or a given user with their
+    current groups (so that the key changes with the group membership).
+    """
+    (visibility, groups) = user_visibility(user)
+    if not groups:
+        return visibility
+    return "%s-groups-%s" % (visibility, ",".join(str(g) for g in sorted(groups)))
+
+
+def visible_jobs_filter(user, prefix=""):
+    """
+    Return the conditions selecting the test jobs visible by the user, or None
+    when every job is visible. prefix is the path from the filtered model to
+    the test job, like "suite__job__" for the test cases.
+    """
+    from lava_scheduler_app.models import Device, TestJob
+
+    def cond(**kwargs):
+        return Q(**{prefix + key: value for (key, value) in kwargs.items()})
+
+    (visibility, groups) = user_visibility(user)
+    if visibility == "all":
+        return None
+    conditions = cond(is_public=True)
+    if visibility == "anonymous":
+        return conditions
+
+    # Sub-queries on small tables rather than joins that would duplicate the
+    # rows.
+    conditions |= (
+        cond(visibility=TestJob.VISIBLE_PUBLIC)
+        | cond(submitter=user)
+        | cond(actual_device__in=Device.objects.filter(user=user).values("pk"))
+    )
+    if groups:
+        # NOTE: this supposedly does OR and we need user to be in all the
+        # visibility groups if we allow multiple groups in field viewing
+        # groups.
+        group_jobs = TestJob.viewing_groups.through.objects.filter(
+            group_id__in=groups
+        ).values("testjob_id")
+        conditions |= cond(visibility=TestJob.VISIBLE_GROUP, id__in=group_jobs)
+    return conditions
+
+
 class RestrictedTestJobQuerySet(RestrictedResourceQuerySet):
     def visible_by_user(self, user):
-
-        from lava_scheduler_app.models import TestJob
-
-        conditions = Q()
-        # Pipeline jobs.
-        if not user or user.is_anonymous:
-            conditions = Q(is_public=True)
-        elif (
-            not user.is_superuser
-            and not user.has_perm("lava_scheduler_app.cancel_resubmit_testjob")
-            and not user.has_perm("lava_scheduler_app.change_device")
-        ):
-            # continue adding conditions only if user is not superuser and
-            # does not have admin permission for jobs or devices.
-            conditions = (
-                Q(is_public=True)
-                | Q(submitter=user)
-                | (~Q(actual_device=None) & Q(actual_device__user=user))
-                | Q(visibility=TestJob.VISIBLE_PUBLIC)
-                | Q(visibility=TestJob.VISIBLE_PERSONAL, submitter=user)
-                |
-                # NOTE: this supposedly does OR and we need user to be in
-                # all the visibility groups if we allow multiple groups in
-                # field viewing groups.
-                Q(
-                    visibility=TestJob.VISIBLE_GROUP,
-                    viewing_groups__in=user.groups.all(),
-                )
-            )
-
-        return self.filter(conditions)
+        conditions = visible_jobs_filter(user)
+        return self.all() if conditions is None else self.filter(conditions)
 
 
 class RestrictedTestCaseQuerySet(RestrictedResourceQuerySet):
     def visible_by_user(self, user):
-
-        from lava_scheduler_app.models import TestJob
-
-        jobs = TestJob.objects.filter(testsuite__testcase__in=self).visible_by_user(
-            user
-        )
-
-        return self.filter(suite__job__in=jobs)
+        # A single join on the test job, without going back to the test cases
+        conditions = visible_jobs_filter(user, "suite__job__")
+        return self.all() if conditions is None else self.filter(conditions)
 
 
 class RestrictedTestSuiteQuerySet(models.QuerySet):
     def visible_by_user(self, user):
-
-        from lava_scheduler_app.models import TestJob
-
-        jobs = TestJob.objects.filter(testsuite__in=self).visible_by_user(user)
-
-        return self.filter(job__in=jobs)
+        conditions = visible_jobs_filter(user, "job__")
+        return self.all() if conditions is None else self.filter(conditions)
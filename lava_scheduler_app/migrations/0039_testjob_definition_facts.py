@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import yaml
+
+
+# Copies of lava_common.timeout.Timeout.parse and
+# lava_scheduler_app.models._definition_facts at the time of this migration
+def _parse_timeout(data):
+    if not isinstance(data, dict):
+        return None
+    duration = datetime.timedelta(
+        days=data.get("days", 0),
+        hours=data.get("hours", 0),
+        minutes=data.get("minutes", 0),
+        seconds=data.get("seconds", 0),
+    )
+    if not duration:
+        return 30
+    return int(duration.total_seconds())
+
+
+def _definition_facts(job_data):
+    protocols = job_data.get("protocols") or {}
+    multinode = protocols.get("lava-multinode") or {}
+    vland = {}
+    for (vlan_name, vlan) in (protocols.get("lava-vland") or {}).items():
+        vland[vlan_name] = (vlan or {}).get("tags") or []
+    timeouts = {}
+    for (name, data) in (job_data.get("timeouts") or {}).items():
+        if name not in ["job", "action", "connection"]:
+            continue
+        timeout = _parse_timeout(data)
+        if timeout is not None:
+            timeouts[name] = timeout
+
+    return {
+        "context": job_data.get("context") or {},
+        "vland": vland,
+        "timeouts": timeouts,
+        "multinode_role": multinode.get("role"),
+        "essential": bool(multinode.get("essential", False)),
+        "host_role": job_data.get("host_role"),
+        "connection": "connection" in job_data,
+        "notify": job_data.get("notify"),
+    }
+
+
+def forwards_func(apps, schema_editor):
+    # Only the jobs that are not finished are used by the scheduler and
+    # lava-master. The facts of older jobs are computed when needed.
+    TestJob = apps.get_model("lava_scheduler_app", "TestJob")
+    for job in TestJob.objects.exclude(state=5).only("id", "definition"):
+        try:
+            job_data = yaml.safe_load(job.definition)
+        except yaml.YAMLError:
+            continue
+        if not isinstance(job_data, dict):
+            continue
+        facts = _definition_facts(job_data)
+        TestJob.objects.filter(id=job.id).update(
+            multinode_role=facts["multinode_role"],
+            protocols=list((job_data.get("protocols") or {}).keys()),
+            definition_facts=facts,
+        )
+
+
+def backwards_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lava_scheduler_app", "0038_set_default_device_health_maintenance")
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="testjob",
+            name="multinode_role",
+            field=models.CharField(
+                blank=True, default=None, editable=False, max_length=100, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="testjob",
+            name="protocols",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.CharField(max_length=100),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.AddField(
+            model_name="testjob",
+            name="definition_facts",
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                blank=True, default=dict, editable=False
+            ),
+        ),
+        migrations.RunPython(forwards_func, backwards_func),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+def counter(default):
+    return models.PositiveIntegerField(default=default, editable=False, null=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_scheduler_app", "0039_testjob_definition_facts")]
+
+    # The existing jobs get NULL counters (computed by the result_counters
+    # command) while the new jobs start at 0.
+    operations = [
+        migrations.AddField(
+            model_name="testjob", name="count_pass", field=counter(None)
+        ),
+        migrations.AddField(
+            model_name="testjob", name="count_fail", field=counter(None)
+        ),
+        migrations.AddField(
+            model_name="testjob", name="count_skip", field=counter(None)
+        ),
+        migrations.AddField(
+            model_name="testjob", name="count_unknown", field=counter(None)
+        ),
+        migrations.AlterField(
+            model_name="testjob", name="count_pass", field=counter(0)
+        ),
+        migrations.AlterField(
+            model_name="testjob", name="count_fail", field=counter(0)
+        ),
+        migrations.AlterField(
+            model_name="testjob", name="count_skip", field=counter(0)
+        ),
+        migrations.AlterField(
+            model_name="testjob", name="count_unknown", field=counter(0)
+        ),
+    ]
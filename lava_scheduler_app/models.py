@@ -26,6 +26,7 @@ import logging
 import os
 import uuid
 import gzip
+import io
 import simplejson
 import yaml
 from nose.tools import nottest
@@ -34,7 +35,7 @@ from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.admin.models import LogEntry, ADDITION, CHANGE
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
 from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.exceptions import (
@@ -55,8 +56,11 @@ from django_restricted_resource.models import (
 )
 
 from lava_common.exceptions import ConfigurationError
-from lava_results_app.utils import export_testcase
+from lava_common.timeout import Timeout
+from lava_results_app.utils import export_testcase, result_counts
 from lava_scheduler_app import utils
+from lava_scheduler_app.device_config import renderer
+from lava_scheduler_app.logarchive import is_archived, open_log
 from lava_scheduler_app.managers import RestrictedTestJobQuerySet
 from lava_scheduler_app.schema import SubmissionException, validate_device
 
@@ -805,21 +809,16 @@ class Device(RestrictedResource):
             except OSError:
                 return None
 
-        # Create the environment
-        env = jinja2.Environment(  # nosec - YAML, not HTML, no XSS scope.
-            autoescape=False,
-            loader=jinja2.FileSystemLoader(
-                [
-                    Device.CONFIG_PATH,
-                    os.path.join(os.path.dirname(Device.CONFIG_PATH), "device-types"),
-                ]
-            ),
-            trim_blocks=True,
+        search_path = (
+            Device.CONFIG_PATH,
+            os.path.join(os.path.dirname(Device.CONFIG_PATH), "device-types"),
         )
 
         try:
-            template = env.get_template("%s.jinja2" % self.hostname)
-            device_template = template.render(**job_ctx)
+            # The configuration without job context is cached
+            if not job_ctx and output_format == "dict":
+                return renderer.load(search_path, self.hostname)
+            device_template = renderer.render(search_path, self.hostname, job_ctx)
         except jinja2.TemplateError:
             return None
 
@@ -868,26 +867,9 @@ class Device(RestrictedResource):
             return False
 
     def get_extends(self):
-        jinja_config = self.load_configuration(output_format="raw")
-        if not jinja_config:
-            return None
-
-        env = jinja2.Environment(  # nosec - YAML, not HTML, no XSS scope.
-            autoescape=False
+        return renderer.get_extends(
+            os.path.join(Device.CONFIG_PATH, "%s.jinja2" % self.hostname)
         )
-        try:
-            ast = env.parse(jinja_config)
-            extends = list(ast.find_all(jinja2.nodes.Extends))
-            if len(extends) != 1:
-                logger = logging.getLogger("lava_scheduler_app")
-                logger.error("Found %d extends for %s", len(extends), self.hostname)
-                return None
-            else:
-                return os.path.splitext(extends[0].template.value)[0]
-        except jinja2.TemplateError as exc:
-            logger = logging.getLogger("lava_scheduler_app")
-            logger.error("Invalid template for %s: %s", self.hostname, str(exc))
-            return None
 
     def get_health_check(self):
         # Get the device dictionary
@@ -895,15 +877,7 @@ class Device(RestrictedResource):
         if not extends:
             return None
 
-        filename = os.path.join(Device.HEALTH_CHECK_PATH, "%s.yaml" % extends)
-        # Try if health check file is having a .yml extension
-        if not os.path.exists(filename):
-            filename = os.path.join(Device.HEALTH_CHECK_PATH, "%s.yml" % extends)
-        try:
-            with open(filename, "r") as f_in:
-                return f_in.read()
-        except OSError:
-            return None
+        return renderer.get_health_check(Device.HEALTH_CHECK_PATH, extends)
 
 
 class JobFailureTag(models.Model):
@@ -1059,6 +1033,40 @@ def _get_device_type(user, name):
     return device_type
 
 
+def _definition_facts(job_data):
+    """
+    Extract, from a job definition, the facts used by the scheduler and
+    lava-master:
+    * context: the job context used to render the device configuration
+    * vland: the tags required by each vlan {vlan_name: [tags]}
+    * timeouts: the job, action and connection timeouts in seconds
+    * multinode_role, essential, host_role and connection for multinode
+    * notify: the notification block
+    """
+    protocols = job_data.get("protocols") or {}
+    multinode = protocols.get("lava-multinode") or {}
+    vland = {}
+    for (vlan_name, vlan) in (protocols.get("lava-vland") or {}).items():
+        vland[vlan_name] = (vlan or {}).get("tags") or []
+    timeouts = {}
+    for (name, data) in (job_data.get("timeouts") or {}).items():
+        if name not in ["job", "action", "connection"]:
+            continue
+        with contextlib.suppress(ConfigurationError):
+            timeouts[name] = Timeout.parse(data)
+
+    return {
+        "context": job_data.get("context") or {},
+        "vland": vland,
+        "timeouts": timeouts,
+        "multinode_role": multinode.get("role"),
+        "essential": bool(multinode.get("essential", False)),
+        "host_role": job_data.get("host_role"),
+        "connection": "connection" in job_data,
+        "notify": job_data.get("notify"),
+    }
+
+
 # pylint: disable=too-many-arguments,too-many-locals
 def _create_pipeline_job(
     job_data,
@@ -1145,6 +1153,7 @@ def _create_pipeline_job(
         visibility=visibility,
         priority=priority,
     )
+    job.update_facts(job_data)
     job.save()
 
     # need a valid job (witha  primary_key )before tags and groups can be
@@ -1382,8 +1391,7 @@ class TestJob(RestrictedResource):
         """
         if not self.is_multinode or not self.definition:
             return False
-        job_data = yaml.safe_load(self.definition)
-        return "connection" in job_data
+        return self.facts.get("connection", False)
 
     tags = models.ManyToManyField(Tag, blank=True)
 
@@ -1625,6 +1633,44 @@ class TestJob(RestrictedResource):
 
     multinode_definition = models.TextField(editable=False, blank=True)
 
+    # Facts extracted from the definition at submission time. The scheduler
+    # and lava-master use them instead of parsing the definition again.
+    # See _definition_facts() for the content of definition_facts.
+    multinode_role = models.CharField(
+        max_length=100, null=True, blank=True, default=None, editable=False
+    )
+    protocols = ArrayField(
+        models.CharField(max_length=100), default=list, blank=True, editable=False
+    )
+    definition_facts = JSONField(default=dict, blank=True, editable=False)
+
+    # Number of test cases per result, see TestSuite
+    count_pass = models.PositiveIntegerField(null=True, default=0, editable=False)
+    count_fail = models.PositiveIntegerField(null=True, default=0, editable=False)
+    count_skip = models.PositiveIntegerField(null=True, default=0, editable=False)
+    count_unknown = models.PositiveIntegerField(null=True, default=0, editable=False)
+
+    def update_facts(self, job_data):
+        """
+        Extract the facts from the given job definition (as a dict).
+        The caller is responsible for saving the job.
+        """
+        self.definition_facts = _definition_facts(job_data)
+        self.multinode_role = self.definition_facts["multinode_role"]
+        self.protocols = list((job_data.get("protocols") or {}).keys())
+
+    @property
+    def facts(self):
+        """
+        Return the facts about the job definition.
+        Jobs submitted before the facts were stored are parsed once and the
+        result is kept on the instance.
+        """
+        if not self.definition_facts and self.definition:
+            with contextlib.suppress(yaml.YAMLError, AttributeError):
+                self.update_facts(yaml.safe_load(self.definition))
+        return self.definition_facts
+
     # calculated by the master validation process.
     pipeline_compatibility = models.IntegerField(default=0, editable=False)
 
@@ -1655,6 +1701,10 @@ class TestJob(RestrictedResource):
         output_path = os.path.join(self.output_dir, "output.yaml")
         if os.path.exists(output_path):
             return open(output_path, encoding="utf-8", errors="replace")
+        elif is_archived(self.output_dir):
+            return io.TextIOWrapper(
+                open_log(self.output_dir), encoding="utf-8", errors="replace"
+            )
         else:
             return None
 
@@ -1684,37 +1734,22 @@ class TestJob(RestrictedResource):
     def essential_role(self):  # pylint: disable=too-many-return-statements
         if not self.is_multinode:
             return False
-        data = yaml.safe_load(self.definition)
-        # would be nice to use reduce here but raising and catching TypeError is slower
-        # than checking 'if .. in ' - most jobs will return False.
-        if "protocols" not in data:
-            return False
-        if "lava-multinode" not in data["protocols"]:
-            return False
-        if "role" not in data["protocols"]["lava-multinode"]:
+        # The role is needed for the job to be essential
+        if self.facts.get("multinode_role") is None:
             return False
-        if "essential" not in data["protocols"]["lava-multinode"]:
-            return False
-        return data["protocols"]["lava-multinode"]["essential"]
+        return self.facts.get("essential", False)
 
     @property
-    def device_role(self):  # pylint: disable=too-many-return-statements
+    def device_role(self):
         if not self.is_multinode:
             return "Error"
-        try:
-            # For some old definition (when migrating from python2 to python3)
-            # includes "!!python/unicode" statements that are not accepted by
-            # yaml.safe_load().
-            data = yaml.safe_load(self.definition)
-        except yaml.YAMLError:
-            return "Error"
-        if "protocols" not in data:
-            return "Error"
-        if "lava-multinode" not in data["protocols"]:
-            return "Error"
-        if "role" not in data["protocols"]["lava-multinode"]:
+        # For some old definition (when migrating from python2 to python3)
+        # includes "!!python/unicode" statements that are not accepted by
+        # yaml.safe_load(). In this case, the facts are empty.
+        role = self.facts.get("multinode_role")
+        if role is None:
             return "Error"
-        return data["protocols"]["lava-multinode"]["role"]
+        return role
 
     def __str__(self):
         job_type = "health_check" if self.health_check else "test"
@@ -1962,16 +1997,13 @@ class TestJob(RestrictedResource):
     def lookup_worker(self):
         if not self.is_multinode:
             return None
-        try:
-            data = yaml.safe_load(self.definition)
-        except yaml.YAMLError:
-            return None
-        if "host_role" not in data:
+        host_role = self.facts.get("host_role")
+        if host_role is None:
             return None
         parent = None
         # the protocol requires a count of 1 for any role specified as a host_role
         for worker_job in self.sub_jobs_list:
-            if worker_job.device_role == data["host_role"]:
+            if worker_job.device_role == host_role:
                 parent = worker_job
                 break
         if not parent or not parent.actual_device:
@@ -2013,6 +2045,14 @@ class TestJob(RestrictedResource):
         else:
             return self.definition
 
+    def result_counts(self):
+        return result_counts(
+            self,
+            lambda: self.testsuite_set.order_by()
+            .values_list("testcase__result")
+            .annotate(models.Count("testcase__id")),
+        )
+
     def get_passfail_results(self):
         # Get pass fail results per lava_scheduler_app.testjob.
         results = {}
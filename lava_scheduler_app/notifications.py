@@ -205,10 +205,11 @@ def get_notification_args(job):
             # Format results.
             left_suites_count = {}
             for suite in left_suites_intersection:
+                counts = suite.result_counts()
                 left_suites_count[suite.name] = (
-                    suite.testcase_set.filter(result=TestCase.RESULT_PASS).count(),
-                    suite.testcase_set.filter(result=TestCase.RESULT_FAIL).count(),
-                    suite.testcase_set.filter(result=TestCase.RESULT_SKIP).count(),
+                    counts["pass"],
+                    counts["fail"],
+                    counts["skip"],
                 )
 
             right_suites_intersection = old_suites.filter(
@@ -218,10 +219,11 @@ def get_notification_args(job):
             # Format results.
             right_suites_count = {}
             for suite in right_suites_intersection:
+                counts = suite.result_counts()
                 right_suites_count[suite.name] = (
-                    suite.testcase_set.filter(result=TestCase.RESULT_PASS).count(),
-                    suite.testcase_set.filter(result=TestCase.RESULT_FAIL).count(),
-                    suite.testcase_set.filter(result=TestCase.RESULT_SKIP).count(),
+                    counts["pass"],
+                    counts["fail"],
+                    counts["skip"],
                 )
 
             args["query"]["left_suites_count"] = left_suites_count
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Set-based removal of test jobs.
+
+Deleting a job through the ORM loads every related row (suites, test cases,
+action data, ...) into memory before deleting them one table at a time. The
+statements below delete the rows of a whole chunk of jobs with one statement
+per table, children first, so that the cost is a fixed number of queries per
+chunk.
+
+The list of tables has to be kept in sync with the models: any row left
+pointing to a job makes the final DELETE fail on the foreign key constraint.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+
+from lava_results_app.models import (
+    ActionData,
+    BugLink,
+    NamedTestAttribute,
+    TestCase,
+    TestData,
+    TestSet,
+    TestSuite,
+)
+from lava_scheduler_app.models import (
+    Device,
+    Notification,
+    NotificationCallback,
+    NotificationRecipient,
+    TestJob,
+    TestJobUser,
+)
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _statements():
+    """
+    Return the list of (sql, model) to run, in order, for a chunk of jobs.
+    The statements use the named parameters:
+      jobs: list of job ids
+      job_ct, suite_ct, case_ct, data_ct: content types of the generic relations
+    """
+    suites = "SELECT id FROM %s WHERE job_id = ANY(%%(jobs)s)" % _table(TestSuite)
+    cases = "SELECT id FROM %s WHERE suite_id IN (%s)" % (_table(TestCase), suites)
+    data = "SELECT id FROM %s WHERE testjob_id = ANY(%%(jobs)s)" % _table(TestData)
+    notifications = "SELECT id FROM %s WHERE test_job_id = ANY(%%(jobs)s)" % _table(
+        Notification
+    )
+
+    statements = [
+        (
+            "DELETE FROM %s WHERE (content_type_id = %%(job_ct)s "
+            "AND object_id = ANY(%%(jobs)s)) "
+            "OR (content_type_id = %%(suite_ct)s AND object_id IN (%s)) "
+            "OR (content_type_id = %%(case_ct)s AND object_id IN (%s))"
+            % (_table(BugLink), suites, cases),
+            BugLink,
+        ),
+        (
+            "DELETE FROM %s WHERE testcase_id IN (%s) OR testdata_id IN (%s)"
+            % (_table(ActionData), cases, data),
+            ActionData,
+        ),
+        (
+            "DELETE FROM %s WHERE content_type_id = %%(data_ct)s "
+            "AND object_id IN (%s)" % (_table(NamedTestAttribute), data),
+            NamedTestAttribute,
+        ),
+        (
+            "DELETE FROM %s WHERE suite_id IN (%s)" % (_table(TestCase), suites),
+            TestCase,
+        ),
+        ("DELETE FROM %s WHERE suite_id IN (%s)" % (_table(TestSet), suites), TestSet),
+        ("DELETE FROM %s WHERE job_id = ANY(%%(jobs)s)" % _table(TestSuite), TestSuite),
+        (
+            "DELETE FROM %s WHERE testjob_id = ANY(%%(jobs)s)" % _table(TestData),
+            TestData,
+        ),
+        (
+            "DELETE FROM %s WHERE notification_id IN (%s)"
+            % (_table(NotificationRecipient), notifications),
+            NotificationRecipient,
+        ),
+        (
+            "DELETE FROM %s WHERE notification_id IN (%s)"
+            % (_table(NotificationCallback), notifications),
+            NotificationCallback,
+        ),
+        (
+            "DELETE FROM %s WHERE test_job_id = ANY(%%(jobs)s)" % _table(Notification),
+            Notification,
+        ),
+        (
+            "DELETE FROM %s WHERE test_job_id = ANY(%%(jobs)s)" % _table(TestJobUser),
+            TestJobUser,
+        ),
+    ]
+    for name in ["viewing_groups", "tags", "failure_tags"]:
+        field = TestJob._meta.get_field(name)
+        through = field.remote_field.through
+        statements.append(
+            (
+                "DELETE FROM %s WHERE %s = ANY(%%(jobs)s)"
+                % (_table(through), connection.ops.quote_name(field.m2m_column_name())),
+                through,
+            )
+        )
+    statements.extend(
+        [
+            (
+                "UPDATE %s SET last_health_report_job_id = NULL "
+                "WHERE last_health_report_job_id = ANY(%%(jobs)s)" % _table(Device),
+                Device,
+            ),
+            ("DELETE FROM %s WHERE id = ANY(%%(jobs)s)" % _table(TestJob), TestJob),
+        ]
+    )
+    return statements
+
+
+def delete_jobs(job_ids):
+    """
+    Delete the given jobs and all the related rows, in a single transaction.
+    The devices of the unfinished jobs are released. The output directories
+    are not removed.
+    Return {model label: number of rows}.
+    """
+    if not job_ids:
+        return {}
+    params = {
+        "jobs": list(job_ids),
+        "job_ct": ContentType.objects.get_for_model(TestJob).id,
+        "suite_ct": ContentType.objects.get_for_model(TestSuite).id,
+        "case_ct": ContentType.objects.get_for_model(TestCase).id,
+        "data_ct": ContentType.objects.get_for_model(TestData).id,
+    }
+    counts = {}
+    with transaction.atomic():
+        # Like testjob_pre_delete_handler for TestJob.delete(): release the
+        # devices of the jobs that did not finish.
+        unfinished = (
+            TestJob.objects.select_for_update()
+            .filter(id__in=params["jobs"])
+            .exclude(state=TestJob.STATE_FINISHED)
+        )
+        for job in unfinished:
+            job.go_state_finished(TestJob.HEALTH_CANCELED, True)
+        with connection.cursor() as cursor:
+            for (sql, model) in _statements():
+                cursor.execute(sql, params)
+                if sql.startswith("DELETE") and cursor.rowcount:
+                    counts[model._meta.label] = cursor.rowcount
+    return counts
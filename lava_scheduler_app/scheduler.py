@@ -18,13 +18,16 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
+import itertools
 import yaml
 
 from django.contrib.auth.models import User
 from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
-from lava_scheduler_app.dbutils import match_vlan_interface
+from lava_scheduler_app.dbutils import match_vlan_tags
 from lava_scheduler_app.models import (
     DeviceType,
     Device,
@@ -34,10 +37,19 @@ from lava_scheduler_app.models import (
     Worker,
 )
 
+# Number of queued jobs fetched at once from the database
+QUEUED_JOBS_BATCH_SIZE = 50
 
-def schedule(logger, available_dt=None):
+
+def schedule(logger, available_dt=None, queue=None):
+    """
+    Schedule health checks and test jobs.
+    :param queue: an optional lava_scheduler_app.jobqueue.JobQueue. When
+    given, the queued jobs are looked up in this in-memory view instead of
+    querying the whole queue for every device.
+    """
     (available_devices, jobs) = schedule_health_checks(logger, available_dt)
-    jobs.extend(schedule_jobs(logger, available_devices))
+    jobs.extend(schedule_jobs(logger, available_devices, queue))
     return jobs
 
 
@@ -79,6 +91,36 @@ def schedule_health_checks(logger, available_dt=None):
     return (available_devices, jobs)
 
 
+def health_checks_needed(dt, hostnames):
+    """
+    Return the set of hostnames, among the given devices of this device-type,
+    that need an health check.
+    The number of jobs and the time since the last health report are computed
+    for all devices in a single query.
+    """
+    query = Device.objects.filter(device_type=dt, hostname__in=hostnames)
+    query = query.annotate(last_hc_submit=F("last_health_report_job__submit_time"))
+    needed = Q(health__in=[Device.HEALTH_UNKNOWN, Device.HEALTH_LOOPING])
+    needed |= Q(last_health_report_job__isnull=True)
+    if dt.health_denominator == DeviceType.HEALTH_PER_JOB:
+        jobs = TestJob.objects.filter(
+            actual_device=OuterRef("pk"),
+            health_check=False,
+            start_time__gte=OuterRef("last_hc_submit"),
+        )
+        jobs = jobs.order_by().values("actual_device")
+        jobs = jobs.annotate(count=Count("pk")).values("count")
+        query = query.annotate(
+            jobs_since_hc=Coalesce(Subquery(jobs, output_field=IntegerField()), 0)
+        )
+        needed |= Q(jobs_since_hc__gte=dt.health_frequency)
+    else:
+        frequency = datetime.timedelta(hours=dt.health_frequency)
+        needed |= Q(last_hc_submit__lt=timezone.now() - frequency)
+
+    return set(query.filter(needed).values_list("hostname", flat=True))
+
+
 def schedule_health_checks_for_device_type(logger, dt):
     devices = dt.device_set.select_for_update()
     devices = devices.filter(state=Device.STATE_IDLE)
@@ -86,39 +128,33 @@ def schedule_health_checks_for_device_type(logger, dt):
     devices = devices.filter(
         health__in=[Device.HEALTH_GOOD, Device.HEALTH_UNKNOWN, Device.HEALTH_LOOPING]
     )
-    devices = devices.order_by("hostname")
+    devices = list(devices.order_by("hostname"))
 
-    print_header = True
+    # Only keep the devices with an health check
+    # get_health_check() is memoised by the device configuration renderer.
+    health_checks = {}
     available_devices = []
-    jobs = []
     for device in devices:
-        # Do we have an health check
         health_check = device.get_health_check()
         if health_check is None:
             available_devices.append(device.hostname)
-            continue
-
-        # Do we have to schedule an health check?
-        scheduling = False
-        if device.health in [Device.HEALTH_UNKNOWN, Device.HEALTH_LOOPING]:
-            scheduling = True
-        elif device.last_health_report_job is None:
-            scheduling = True
         else:
-            submit_time = device.last_health_report_job.submit_time
-            if dt.health_denominator == DeviceType.HEALTH_PER_JOB:
-                count = device.testjobs.filter(
-                    health_check=False, start_time__gte=submit_time
-                ).count()
+            health_checks[device.hostname] = health_check
 
-                scheduling = count >= dt.health_frequency
-            else:
-                frequency = datetime.timedelta(hours=dt.health_frequency)
-                now = timezone.now()
+    # Decide, in bulk, which devices need an health check
+    if health_checks:
+        needed = health_checks_needed(dt, list(health_checks.keys()))
+    else:
+        needed = set()
 
-                scheduling = submit_time + frequency < now
+    print_header = True
+    jobs = []
+    for device in devices:
+        if device.hostname not in health_checks:
+            continue
+        health_check = health_checks[device.hostname]
 
-        if not scheduling:
+        if device.hostname not in needed:
             available_devices.append(device.hostname)
             continue
 
@@ -182,8 +218,10 @@ def schedule_health_check(device, definition):
     return job.id
 
 
-def schedule_jobs(logger, available_devices):
+def schedule_jobs(logger, available_devices, queue=None):
     logger.info("scheduling jobs:")
+    if queue is not None:
+        queue.refresh()
     jobs = []
     for dt in DeviceType.objects.all().order_by("name"):
         # Check that some devices are available for this device-type
@@ -191,7 +229,9 @@ def schedule_jobs(logger, available_devices):
             continue
         with transaction.atomic():
             jobs.extend(
-                schedule_jobs_for_device_type(logger, dt, available_devices[dt.name])
+                schedule_jobs_for_device_type(
+                    logger, dt, available_devices[dt.name], queue
+                )
             )
 
     with transaction.atomic():
@@ -200,7 +240,7 @@ def schedule_jobs(logger, available_devices):
     return jobs
 
 
-def schedule_jobs_for_device_type(logger, dt, available_devices):
+def schedule_jobs_for_device_type(logger, dt, available_devices, queue=None):
     logger.debug("- %s", dt.name)
 
     devices = dt.device_set.select_for_update()
@@ -219,28 +259,65 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
         # IDLE between the two functions.
         if device.hostname not in available_devices:
             continue
-        new_job = schedule_jobs_for_device(logger, device)
+        new_job = schedule_jobs_for_device(logger, device, queue)
         if new_job is not None:
             jobs.append(new_job)
     return jobs
 
 
-def schedule_jobs_for_device(logger, device):
-    jobs = TestJob.objects.filter(
-        state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING]
+def _queued_jobs(device, queue, with_vlans):
+    """
+    Yield the jobs from the in-memory queue that this device can run. The
+    tags, submitter permissions and protocols were already checked by the
+    queue.
+    """
+    device_tags = device.tags.values_list("name", flat=True)
+    candidates = queue.candidates(device, device_tags, with_vlans)
+    while True:
+        job_ids = list(itertools.islice(candidates, QUEUED_JOBS_BATCH_SIZE))
+        if not job_ids:
+            return
+        jobs = TestJob.objects.filter(
+            state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING],
+            actual_device__isnull=True,
+        ).in_bulk(job_ids)
+        for job_id in job_ids:
+            job = jobs.get(job_id)
+            # The view is outdated: drop the job
+            if job is None:
+                queue.remove(job_id)
+                continue
+            yield job
+
+
+def schedule_jobs_for_device(logger, device, queue=None):
+    # Jobs requesting vlans can only run on devices with interfaces
+    device_dict = device.load_configuration()
+    with_vlans = bool(
+        device_dict and device_dict.get("parameters", {}).get("interfaces")
     )
-    jobs = jobs.filter(actual_device__isnull=True)
-    jobs = jobs.filter(requested_device_type__pk=device.device_type.pk)
-    jobs = jobs.order_by("-state", "-priority", "submit_time", "target_group", "id")
+
+    if queue is None:
+        jobs = TestJob.objects.filter(
+            state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING]
+        )
+        jobs = jobs.filter(actual_device__isnull=True)
+        jobs = jobs.filter(requested_device_type__pk=device.device_type.pk)
+        jobs = jobs.order_by("-state", "-priority", "submit_time", "target_group", "id")
+        if not with_vlans:
+            jobs = jobs.exclude(protocols__contains=["lava-vland"])
+    else:
+        jobs = _queued_jobs(device, queue, with_vlans)
 
     for job in jobs:
-        if not device.can_submit(job.submitter):
-            continue
+        if queue is None:
+            if not device.can_submit(job.submitter):
+                continue
 
-        device_tags = set(device.tags.all())
-        job_tags = set(job.tags.all())
-        if not job_tags.issubset(device_tags):
-            continue
+            device_tags = set(device.tags.all())
+            job_tags = set(job.tags.all())
+            if not job_tags.issubset(device_tags):
+                continue
 
         if not device.is_valid():
             prev_health_display = device.get_health_display()
@@ -257,9 +334,11 @@ def schedule_jobs_for_device(logger, device):
             )
             continue
 
-        job_dict = yaml.safe_load(job.definition)
-        if "protocols" in job_dict and "lava-vland" in job_dict["protocols"]:
-            if not match_vlan_interface(device, job_dict):
+        vland = job.facts.get("vland")
+        if vland:
+            if not with_vlans:
+                continue
+            if not match_vlan_tags(device, vland, device_dict):
                 continue
 
         logger.debug(
@@ -275,6 +354,8 @@ def schedule_jobs_for_device(logger, device):
         else:
             job.go_state_scheduled(device)
         job.save()
+        if queue is not None:
+            queue.remove(job.id)
         return job.id
     return None
 
@@ -308,8 +389,7 @@ def transition_multinode_jobs(logger):
             # build a list of all devices in this group
             if sub_job.dynamic_connection:
                 continue
-            definition = yaml.safe_load(sub_job.definition)
-            devices[str(sub_job.id)] = definition["protocols"]["lava-multinode"]["role"]
+            devices[str(sub_job.id)] = sub_job.facts["multinode_role"]
 
         for sub_job in sub_jobs:
             # apply the complete list to all jobs in this group
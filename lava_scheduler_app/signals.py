@@ -21,14 +21,20 @@ import datetime
 import simplejson
 import threading
 import uuid
-import yaml
 import zmq
 from zmq.utils.strtypes import b
 
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
-from django.db.models.signals import post_init, post_save, pre_delete, pre_save
+from django.db.models.signals import (
+    m2m_changed,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 
 from lava_scheduler_app.models import Device, TestJob, Worker
 from lava_scheduler_app.notifications import (
@@ -127,15 +133,15 @@ def testjob_notifications(sender, **kwargs):
     if job.state not in [TestJob.STATE_RUNNING, TestJob.STATE_FINISHED]:
         return
 
-    job_def = yaml.safe_load(job.definition)
-    if "notify" in job_def:
+    notify = job.facts.get("notify")
+    if notify:
         if notification_criteria(
-            job_def["notify"]["criteria"], job.state, job.health, job._old_health
+            notify["criteria"], job.state, job.health, job._old_health
         ):
             try:
                 job.notification
             except ObjectDoesNotExist:
-                create_notification(job, job_def["notify"])
+                create_notification(job, notify)
             send_notifications(job)
 
 
@@ -220,6 +226,17 @@ def worker_post_handler(sender, **kwargs):
         send_event(".worker", "lavaserver", data)
 
 
+def user_visibility_handler(sender, instance, **kwargs):
+    # Called when the permissions or the groups of a user may have changed
+    if isinstance(instance, User):
+        instance.__dict__.pop("_job_visibility", None)
+
+
+def user_m2m_handler(sender, instance, action, **kwargs):
+    if action in ["post_add", "post_remove", "post_clear"]:
+        user_visibility_handler(sender, instance)
+
+
 pre_delete.connect(
     testjob_pre_delete_handler,
     sender=TestJob,
@@ -239,6 +256,18 @@ pre_save.connect(
     weak=False,
     dispatch_uid="testjob_notifications",
 )
+# Invalidate the visibility kept on the user object
+post_save.connect(
+    user_visibility_handler,
+    sender=User,
+    weak=False,
+    dispatch_uid="user_visibility_handler",
+)
+for (through, uid) in [
+    (User.groups.through, "user_groups_handler"),
+    (User.user_permissions.through, "user_permissions_handler"),
+]:
+    m2m_changed.connect(user_m2m_handler, sender=through, weak=False, dispatch_uid=uid)
 
 # Only activate theses signals when EVENT_NOTIFICATION is in use
 if settings.EVENT_NOTIFICATION:
@@ -1,10 +1,13 @@
 # pylint: disable=ungrouped-imports
 
 import os
+import shutil
+import tempfile
 import yaml
 import jinja2
 import logging
 from django.db.models import Q
+from lava_scheduler_app.device_config import DeviceConfigRenderer
 from lava_scheduler_app.models import Device, DeviceType
 from lava_scheduler_app.dbutils import (
     load_devicetype_template,
@@ -296,3 +299,71 @@ class DeviceTypeTest(TestCaseWithFactory):
             {"beaglebone-black", "qemu"},
             set(active_device_types().values_list("name", flat=True)),
         )
+
+
+class DeviceConfigRendererTest(TestCaseWithFactory):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.devices = os.path.join(self.tmpdir, "devices")
+        self.device_types = os.path.join(self.tmpdir, "device-types")
+        os.mkdir(self.devices)
+        os.mkdir(self.device_types)
+        self.search_path = (self.devices, self.device_types)
+        self._write(self.device_types, "base.jinja2", "value: {{ value|default(1) }}\n")
+        self._write(self.devices, "dev-01.jinja2", "{% extends 'base.jinja2' %}\n")
+        self.renderer = DeviceConfigRenderer()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, path, name, data):
+        with open(os.path.join(path, name), "w") as f_out:
+            f_out.write(data)
+
+    def test_cached_configuration(self):
+        data = self.renderer.load(self.search_path, "dev-01")
+        self.assertEqual(data, {"value": 1})
+        # Callers get their own copy
+        data["value"] = 42
+        self.assertEqual(self.renderer.load(self.search_path, "dev-01"), {"value": 1})
+
+        # Modifying the device dictionary invalidates the cache
+        self._write(
+            self.devices,
+            "dev-01.jinja2",
+            "{% extends 'base.jinja2' %}\n{% set value = 2 %}\n",
+        )
+        self.assertEqual(self.renderer.load(self.search_path, "dev-01"), {"value": 2})
+
+        # Modifying the device-type template invalidates the cache
+        self._write(self.device_types, "base.jinja2", "other: {{ value|default(1) }}\n")
+        self.assertEqual(self.renderer.load(self.search_path, "dev-01"), {"other": 2})
+
+    def test_dynamic_include(self):
+        # The included template is only known at render time
+        self._write(
+            self.devices, "dev-01.jinja2", "{% include name|default('base.jinja2') %}\n"
+        )
+        self.assertIsNone(self.renderer.signature(self.search_path, "dev-01.jinja2"))
+        self.assertEqual(self.renderer.load(self.search_path, "dev-01"), {"value": 1})
+        self.assertNotIn((self.search_path, "dev-01"), self.renderer.configurations)
+
+    def test_render_with_context(self):
+        self.assertEqual(
+            self.renderer.render(self.search_path, "dev-01", {"value": 3}), "value: 3"
+        )
+
+    def test_extends_and_health_check(self):
+        filename = os.path.join(self.devices, "dev-01.jinja2")
+        self.assertEqual(self.renderer.get_extends(filename), "base")
+        self.assertEqual(self.renderer.get_health_check(self.tmpdir, "base"), None)
+        self._write(self.tmpdir, "base.yml", "job_name: hc\n")
+        self.assertEqual(
+            self.renderer.get_health_check(self.tmpdir, "base"), "job_name: hc\n"
+        )
+        self._write(self.tmpdir, "base.yaml", "job_name: hc2\n")
+        self.assertEqual(
+            self.renderer.get_health_check(self.tmpdir, "base"), "job_name: hc2\n"
+        )
@@ -0,0 +1,240 @@
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from lava_scheduler_app.logarchive import archive_log, log_size, open_log
+from lava_scheduler_app.logstore import RAW, LogStore, encode_line, timestamp
+from lava_scheduler_app.logutils import iter_logs, query_logs, read_logs
+
+
+class LogStoreTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = LogStore(self.tmpdir)
+        self.lines = []
+        start = datetime.datetime(2019, 1, 1)
+        for i in range(600):
+            dt = start + datetime.timedelta(seconds=i, microseconds=(i % 3) * 1000)
+            lvl = ["debug", "target", "results", "error"][i % 4]
+            if lvl == "results":
+                msg = '{"case": "case-%d", "definition": "lava", "result": "pass"}' % i
+            else:
+                msg = '"line %d"' % i
+            self.lines.append(
+                '- {"dt": "%s", "lvl": "%s", "msg": %s}\n' % (dt.isoformat(), lvl, msg)
+            )
+        # Lines that cannot be rebuilt from the compact form
+        self.lines.insert(5, "- not a dispatcher line\n")
+        self.lines.insert(7, '- {"dt": "now", "lvl": "info", "msg": "x"}\n')
+        self.data = "".join(self.lines).encode("utf-8")
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, data, mode="wb"):
+        with open(os.path.join(self.tmpdir, "output.yaml"), mode) as f_out:
+            f_out.write(data)
+
+    def test_encode_line(self):
+        (ts, level, data) = encode_line(self.lines[0].encode("utf-8"))
+        self.assertEqual(ts, timestamp(datetime.datetime(2019, 1, 1)))
+        self.assertEqual(data, b'"line 0"')
+        self.assertFalse(level & RAW)
+        (_, level, data) = encode_line(b"- not a dispatcher line\n")
+        self.assertTrue(level & RAW)
+        self.assertEqual(data, b"- not a dispatcher line\n")
+
+    def test_lossless(self):
+        self._write(self.data)
+        state = self.store.update()
+        self.assertEqual(state["lines"], len(self.lines))
+        self.assertLess(state["bin"], len(self.data))
+        output = os.path.join(self.tmpdir, "copy.yaml")
+        self.store.export_yaml(output)
+        with open(output, "rb") as f_in:
+            self.assertEqual(f_in.read(), self.data)
+
+    def test_incremental(self):
+        # Partial lines are only converted once complete
+        self._write(self.data[:1000] + b"- {")
+        first = self.store.update()["lines"]
+        self.assertEqual(first, self.data[:1000].count(b"\n"))
+        self._write(self.data)
+        self.assertEqual(self.store.update()["lines"], len(self.lines))
+        self.assertEqual(
+            self.store.read_yaml(start=first - 1), "".join(self.lines[first - 1 :])
+        )
+
+    def test_filters(self):
+        self._write(self.data)
+        records = self.store.read(levels=["results"])
+        self.assertEqual(len(records), 150)
+        self.assertTrue(all(b'"case": ' in r.data for r in records))
+
+        start = datetime.datetime(2019, 1, 1, 0, 5)
+        end = datetime.datetime(2019, 1, 1, 0, 6)
+        records = self.store.read(start_time=timestamp(start), end_time=timestamp(end))
+        self.assertEqual(len(records), 60)
+        self.assertEqual(records[0].timestamp, timestamp(start))
+        records = self.store.read(
+            levels=["error", "target"],
+            start_time=timestamp(start),
+            end_time=timestamp(end),
+        )
+        self.assertEqual(len(records), 30)
+        self.assertEqual(self.store.read(start=10, end=10), [])
+
+    def test_actions(self):
+        def line(i, lvl, msg):
+            return '- {"dt": "2019-01-01T00:00:%02d", "lvl": "%s", "msg": "%s"}\n' % (
+                i,
+                lvl,
+                msg,
+            )
+
+        lines = [
+            line(0, "info", "start: 1 tftp-deploy (timeout 00:10:00) [common]"),
+            line(1, "debug", "downloading"),
+            line(2, "info", "start: 1.1 http-download (timeout 00:05:00) [common]"),
+            line(3, "error", "failed"),
+            line(4, "info", "end: 1.1 http-download (duration 00:00:01) [common]"),
+            line(5, "info", "end: 1 tftp-deploy (duration 00:00:04) [common]"),
+            line(6, "info", "start: 2 boot-qemu (timeout 00:10:00) [common]"),
+            line(7, "target", "booting"),
+        ]
+        self._write("".join(lines).encode("utf-8"))
+        self.assertEqual(
+            self.store.actions(),
+            {
+                "1": ["tftp-deploy", 0, 6],
+                "1.1": ["http-download", 2, 5],
+                "2": ["boot-qemu", 6, None],
+            },
+        )
+        (records, next_line) = self.store.query(actions=["http-download"])
+        self.assertEqual([r.line for r in records], [2, 3, 4])
+        self.assertEqual(next_line, 8)
+        records = self.store.read(actions=["1", "2"], levels=["error", "target"])
+        self.assertEqual([r.line for r in records], [3, 7])
+
+        # Tail mode: only the new lines are returned
+        self._write(
+            line(8, "info", "end: 2 boot-qemu (duration 00:00:02)").encode("utf-8"),
+            "ab",
+        )
+        (records, next_line) = self.store.query(start=next_line, actions=["2"])
+        self.assertEqual([r.line for r in records], [8])
+        self.assertEqual(next_line, 9)
+        self.assertEqual(self.store.actions()["2"], ["boot-qemu", 6, 9])
+
+        # Same results with the archived logs
+        archive_log(self.tmpdir)
+        store = LogStore(self.tmpdir)
+        (records, next_line) = store.query(actions=["http-download"])
+        self.assertEqual([r.line for r in records], [2, 3, 4])
+        self.assertEqual(next_line, 9)
+        records = store.read(actions=["1", "2"], levels=["error", "target"])
+        self.assertEqual([r.line for r in records], [3, 7])
+
+    def test_query_logs(self):
+        self._write(self.data)
+        (data, next_line) = query_logs(
+            self.tmpdir,
+            levels=["error"],
+            start_time="2019-01-01T00:00:10",
+            end_time="2019-01-01T00:00:20Z",
+        )
+        self.assertEqual(data.count("\n"), 3)
+        self.assertTrue(data.startswith('- {"dt": "2019-01-01T00:00:11.'))
+        self.assertEqual(next_line, 22)
+        with self.assertRaises(ValueError):
+            query_logs(self.tmpdir, levels=["unknown"])
+        with self.assertRaises(ValueError):
+            query_logs(self.tmpdir, start_time="yesterday")
+
+
+class IterLogsTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmpdir, "output.yaml"), "wb") as f_out:
+            f_out.write(
+                b'- {"dt": "2019-01-01T00:00:00", "lvl": "info", "msg": "start: 1 tftp"}\n'
+                b'- {"dt": "2019-01-01T00:00:01", "lvl": "target", "msg": "hello"}\n'
+                b"- {invalid\n"
+                b'- {"dt": "2019-01-01T00:00:02", "lvl": "info", "msg": "end: 1 tftp"}\n'
+                b'- {"dt": "2019-01-01T00:00:03", "lvl": "info", "msg": "partial'
+            )
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_iter_logs(self):
+        lines = list(iter_logs(self.tmpdir))
+        self.assertEqual([n for (n, _) in lines], [0, 1, 2, 3])
+        self.assertEqual(lines[1][1]["msg"], "hello")
+        self.assertIsNone(lines[2][1])
+        self.assertEqual(list(iter_logs(self.tmpdir, start=1, end=2)), [lines[1]])
+
+    def test_needles(self):
+        lines = list(iter_logs(self.tmpdir, needles=[b"start: ", b"end: "]))
+        self.assertEqual([n for (n, _) in lines], [0, 3])
+
+
+class LogArchiveTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.lines = [
+            '- {"dt": "2019-01-01T00:%02d:%02d", "lvl": "%s", "msg": "line %d"}\n'
+            % (i // 60, i % 60, ["info", "target"][i % 2], i)
+            for i in range(6000)
+        ]
+        self.data = "".join(self.lines)
+        with open(os.path.join(self.tmpdir, "output.yaml"), "w") as f_out:
+            f_out.write(self.data)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_archive(self):
+        # The store is removed along with output.yaml
+        LogStore(self.tmpdir).update()
+        (size, compressed) = archive_log(self.tmpdir, level=1)
+        self.assertEqual(size, len(self.data))
+        self.assertLess(compressed, size)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "output.yaml")))
+        self.assertEqual(log_size(self.tmpdir), size)
+
+        with open_log(self.tmpdir) as f_log:
+            self.assertEqual(f_log.read().decode("utf-8"), self.data)
+        self.assertEqual(
+            read_logs(self.tmpdir, 4400, 4403), "".join(self.lines[4400:4403])
+        )
+        self.assertEqual(read_logs(self.tmpdir, 5999), self.lines[5999])
+        self.assertEqual(read_logs(self.tmpdir, 6000), "")
+        lines = list(iter_logs(self.tmpdir, start=10))
+        self.assertEqual(len(lines), 5990)
+        self.assertEqual(lines[0][1]["msg"], "line 10")
+        records = LogStore(self.tmpdir).read(levels=["target"], start=100, end=110)
+        self.assertEqual([r.line for r in records], [101, 103, 105, 107, 109])
+        (data, next_line) = query_logs(
+            self.tmpdir,
+            levels=["info"],
+            start_time="2019-01-01T00:29:50",
+            end_time="2019-01-01T00:29:54",
+        )
+        self.assertEqual(data, "".join(self.lines[1790:1794:2]))
+        self.assertEqual(next_line, 1794)
+        # The archived logs are queried without the store
+        self.assertEqual(
+            [n for n in os.listdir(self.tmpdir) if n.startswith("output.bin")], []
+        )
+        # Nothing left to archive
+        self.assertIsNone(archive_log(self.tmpdir))
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.contrib.auth.models import Group, User
+from django.db import models
+from django.test import TestCase
+
+from lava_results_app.models import (
+    ActionData,
+    BugLink,
+    MetaType,
+    NamedTestAttribute,
+    TestCase as ResultsTestCase,
+    TestData,
+    TestSet,
+    TestSuite,
+)
+from lava_scheduler_app.models import (
+    Device,
+    DeviceType,
+    JobFailureTag,
+    Notification,
+    NotificationCallback,
+    NotificationRecipient,
+    Tag,
+    TestJob,
+    TestJobUser,
+    Worker,
+)
+from lava_scheduler_app.purge import _statements, delete_jobs
+
+
+class TestPurge(TestCase):
+    def setUp(self):
+        self.worker = Worker.objects.create(
+            hostname="worker-01", state=Worker.STATE_ONLINE
+        )
+        self.device_type = DeviceType.objects.create(name="dt-01")
+        self.device = Device.objects.create(
+            hostname="device-01",
+            device_type=self.device_type,
+            worker_host=self.worker,
+            health=Device.HEALTH_GOOD,
+        )
+        self.user = User.objects.create(username="user-01")
+
+    def make_job(self, state=TestJob.STATE_FINISHED):
+        return TestJob.objects.create(
+            requested_device_type=self.device_type,
+            submitter=self.user,
+            user=self.user,
+            is_public=True,
+            definition="{}",
+            state=state,
+        )
+
+    def populate(self, job):
+        job.tags.add(Tag.objects.get_or_create(name="tag-01")[0])
+        job.viewing_groups.add(Group.objects.get_or_create(name="group-01")[0])
+        job.failure_tags.add(JobFailureTag.objects.get_or_create(name="failure-01")[0])
+        TestJobUser.objects.create(test_job=job, user=self.user, is_favorite=True)
+
+        suite = TestSuite.objects.create(job=job, name="suite")
+        test_set = TestSet.objects.create(suite=suite, name="set")
+        case = ResultsTestCase.objects.create(
+            suite=suite,
+            test_set=test_set,
+            name="case",
+            result=ResultsTestCase.RESULT_PASS,
+        )
+        data = TestData.objects.create(testjob=job)
+        NamedTestAttribute.objects.create(
+            content_object=data, name="attribute", value="value"
+        )
+        ActionData.objects.create(
+            action_name="action",
+            action_level="1.1",
+            action_summary="summary",
+            action_description="description",
+            meta_type=MetaType.objects.get_or_create(
+                name="action", metatype=MetaType.DEPLOY_TYPE
+            )[0],
+            testdata=data,
+            testcase=case,
+        )
+        for obj in [job, suite, case]:
+            BugLink.objects.create(
+                content_object=obj, url="https://example.com/%s" % obj.id
+            )
+
+        notification = Notification.objects.create(test_job=job)
+        NotificationRecipient.objects.create(notification=notification, user=self.user)
+        NotificationCallback.objects.create(
+            notification=notification, url="https://example.com/callback"
+        )
+
+    def test_delete_jobs(self):
+        job = self.make_job()
+        self.populate(job)
+        self.device.last_health_report_job = job
+        self.device.save()
+        # Not removed
+        other = self.make_job()
+        self.populate(other)
+
+        counts = delete_jobs([job.id])
+        self.assertEqual(counts[TestJob._meta.label], 1)
+
+        self.assertFalse(TestJob.objects.filter(id=job.id).exists())
+        self.assertFalse(TestSuite.objects.filter(job_id=job.id).exists())
+        self.assertFalse(TestData.objects.filter(testjob_id=job.id).exists())
+        self.assertFalse(Notification.objects.filter(test_job_id=job.id).exists())
+        self.assertFalse(TestJobUser.objects.filter(test_job_id=job.id).exists())
+        for model in [
+            ActionData,
+            BugLink,
+            NamedTestAttribute,
+            NotificationCallback,
+            NotificationRecipient,
+            ResultsTestCase,
+            TestSet,
+        ]:
+            self.assertEqual(model.objects.count(), 1, model._meta.label)
+        for name in ["viewing_groups", "tags", "failure_tags"]:
+            through = TestJob._meta.get_field(name).remote_field.through
+            self.assertEqual(through.objects.count(), 1, name)
+        self.device.refresh_from_db()
+        self.assertIsNone(self.device.last_health_report_job)
+
+    def test_release_device(self):
+        job = self.make_job(state=TestJob.STATE_RUNNING)
+        job.actual_device = self.device
+        job.save()
+        self.device.state = Device.STATE_RUNNING
+        self.device.save()
+
+        delete_jobs([job.id])
+        self.assertFalse(TestJob.objects.filter(id=job.id).exists())
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.state, Device.STATE_IDLE)
+
+    def test_statements_cover_the_models(self):
+        # Every model that the ORM would delete (or update) with a job should
+        # be handled by the statements, otherwise the final DELETE fails.
+        handled = set(model for (_, model) in _statements())
+
+        def walk(model, seen):
+            if model in seen:
+                return
+            seen.add(model)
+            for field in model._meta.many_to_many:
+                self.assertIn(field.remote_field.through, handled, field)
+            for field in model._meta.private_fields:
+                if field.is_relation and field.related_model is not None:
+                    self.assertIn(field.related_model, handled, field)
+                    walk(field.related_model, seen)
+            # Including the hidden relations (related_name="+")
+            relations = [
+                field
+                for field in model._meta.get_fields(include_hidden=True)
+                if field.auto_created and not field.concrete and field.is_relation
+            ]
+            for rel in relations:
+                if rel.many_to_many:
+                    self.assertIn(rel.through, handled, rel)
+                    continue
+                self.assertIn(rel.related_model, handled, rel)
+                if rel.on_delete is models.CASCADE:
+                    walk(rel.related_model, seen)
+
+        walk(TestJob, set())
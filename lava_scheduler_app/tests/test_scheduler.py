@@ -28,8 +28,13 @@ from django.test import TestCase
 from django.utils import timezone
 
 from lava_dispatcher.tests.utils import DummyLogger
-from lava_scheduler_app.models import Device, DeviceType, TestJob, Worker
-from lava_scheduler_app.scheduler import schedule, schedule_health_checks
+from lava_scheduler_app.jobqueue import JobQueue, UNSEEN_REFRESHES
+from lava_scheduler_app.models import Device, DeviceType, Tag, TestJob, Worker
+from lava_scheduler_app.scheduler import (
+    health_checks_needed,
+    schedule,
+    schedule_health_checks,
+)
 
 
 def _minimal_valid_job(self):
@@ -372,6 +377,51 @@ class TestHealthCheckScheduling(TestCase):
         self.assertTrue(current_hc.health_check)
         self.assertEqual(current_hc.state, TestJob.STATE_SCHEDULED)
 
+    def test_health_checks_needed(self):
+        hostnames = ["panda01", "panda02", "panda03"]
+        self.device01.health = Device.HEALTH_GOOD
+        self.device01.save()
+        self.device03.health = Device.HEALTH_GOOD
+        self.device03.save()
+
+        # device01 never ran an health check and device02 is unknown
+        self.device_type01.health_denominator = DeviceType.HEALTH_PER_HOUR
+        self.device_type01.health_frequency = 24
+        self.device_type01.save()
+        self.assertEqual(
+            health_checks_needed(self.device_type01, hostnames), {"panda01", "panda02"}
+        )
+        self.last_hc03.submit_time = timezone.now() - timedelta(hours=25)
+        self.last_hc03.save()
+        self.assertEqual(
+            health_checks_needed(self.device_type01, hostnames),
+            {"panda01", "panda02", "panda03"},
+        )
+
+        self.device_type01.health_denominator = DeviceType.HEALTH_PER_JOB
+        self.device_type01.health_frequency = 2
+        self.device_type01.save()
+        self.assertEqual(
+            health_checks_needed(self.device_type01, hostnames), {"panda01", "panda02"}
+        )
+        for _ in range(0, 2):
+            TestJob.objects.create(
+                actual_device=self.device03,
+                user=self.user,
+                submitter=self.user,
+                start_time=timezone.now(),
+                is_public=True,
+                state=TestJob.STATE_FINISHED,
+                health=TestJob.HEALTH_COMPLETE,
+            )
+        self.assertEqual(
+            health_checks_needed(self.device_type01, hostnames),
+            {"panda01", "panda02", "panda03"},
+        )
+        self.assertEqual(
+            health_checks_needed(self.device_type01, ["panda03"]), {"panda03"}
+        )
+
 
 class TestVisibility(TestCase):
     def setUp(self):
@@ -728,3 +778,143 @@ class TestPriorities(TestCase):
         self._check_job(jobs[2], TestJob.STATE_SCHEDULED, self.device01)
         self._check_job(jobs[3], TestJob.STATE_SUBMITTED)
         self._check_job(jobs[4], TestJob.STATE_SUBMITTED)
+
+
+class TestJobQueue(TestCase):
+    def setUp(self):
+        Device.CONFIG_PATH = os.path.abspath(
+            os.path.join(
+                os.path.dirname(__file__),
+                "..",
+                "..",
+                "lava_scheduler_app",
+                "tests",
+                "devices",
+            )
+        )
+        self.worker01 = Worker.objects.create(
+            hostname="worker-01", state=Worker.STATE_ONLINE
+        )
+        self.device_type01 = DeviceType.objects.create(name="panda")
+        self.device01 = Device.objects.create(
+            hostname="panda01",
+            device_type=self.device_type01,
+            worker_host=self.worker01,
+            health=Device.HEALTH_GOOD,
+            is_public=True,
+        )
+        self.user = User.objects.create(username="user-01")
+        self.original_health_check = Device.get_health_check
+        # Disable health checks
+        Device.get_health_check = lambda cls: None
+
+    def tearDown(self):
+        Device.get_health_check = self.original_health_check
+
+    def _create_job(self, priority):
+        return TestJob.objects.create(
+            requested_device_type=self.device_type01,
+            user=self.user,
+            submitter=self.user,
+            is_public=True,
+            definition=_minimal_valid_job(None),
+            priority=priority,
+        )
+
+    def test_load_and_order(self):
+        jobs = [self._create_job(p) for p in [TestJob.LOW, TestJob.HIGH, 40]]
+        queue = JobQueue()
+        queue.refresh()
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(
+            list(queue.candidates(self.device01, [])),
+            [jobs[1].id, jobs[2].id, jobs[0].id],
+        )
+
+    def test_tags(self):
+        tag = Tag.objects.create(name="usb")
+        job01 = self._create_job(TestJob.HIGH)
+        job01.tags.add(tag)
+        job02 = self._create_job(TestJob.LOW)
+        queue = JobQueue()
+        queue.refresh()
+        self.assertEqual(list(queue.candidates(self.device01, [])), [job02.id])
+        self.assertEqual(
+            list(queue.candidates(self.device01, ["usb"])), [job01.id, job02.id]
+        )
+
+    def test_events(self):
+        queue = JobQueue()
+        queue.refresh()
+        self.assertEqual(len(queue), 0)
+
+        job01 = self._create_job(TestJob.MEDIUM)
+        queue.handle_event(
+            "org.lavasoftware.testjob", {"job": job01.id, "state": "Submitted"}
+        )
+        queue.refresh()
+        self.assertEqual(list(queue.candidates(self.device01, [])), [job01.id])
+
+        queue.handle_event(
+            "org.lavasoftware.testjob", {"job": job01.id, "state": "Canceling"}
+        )
+        queue.refresh()
+        self.assertEqual(len(queue), 0)
+
+    def test_events_before_commit(self):
+        queue = JobQueue()
+        queue.refresh()
+
+        # The event is received before the job is visible
+        job01 = self._create_job(TestJob.MEDIUM)
+        job01.state = TestJob.STATE_SCHEDULED
+        job01.save()
+        queue.handle_event(
+            "org.lavasoftware.testjob", {"job": job01.id, "state": "Submitted"}
+        )
+        queue.refresh()
+        self.assertEqual(len(queue), 0)
+        job01.state = TestJob.STATE_SUBMITTED
+        job01.save()
+        queue.refresh()
+        self.assertEqual(list(queue.candidates(self.device01, [])), [job01.id])
+        self.assertEqual(queue.unseen, {})
+
+        # The job is dropped after some refreshes
+        queue.handle_event("org.lavasoftware.testjob", {"job": 0, "state": "Submitted"})
+        for _ in range(UNSEEN_REFRESHES):
+            queue.refresh()
+        self.assertEqual(queue.dirty, set())
+        self.assertEqual(queue.unseen, {})
+
+    def test_vland(self):
+        job01 = self._create_job(TestJob.HIGH)
+        job01.protocols = ["lava-vland"]
+        job01.save()
+        job02 = self._create_job(TestJob.LOW)
+        queue = JobQueue()
+        queue.refresh()
+        self.assertEqual(
+            list(queue.candidates(self.device01, [])), [job01.id, job02.id]
+        )
+        self.assertEqual(
+            list(queue.candidates(self.device01, [], with_vlans=False)), [job02.id]
+        )
+
+    def test_schedule(self):
+        jobs = [self._create_job(p) for p in [TestJob.LOW, TestJob.HIGH]]
+        queue = JobQueue()
+        log = DummyLogger()
+        self.assertEqual(schedule(log, queue=queue), [jobs[1].id])
+        jobs[1].refresh_from_db()
+        self.assertEqual(jobs[1].state, TestJob.STATE_SCHEDULED)
+        self.assertEqual(jobs[1].actual_device, self.device01)
+        self.assertEqual(list(queue.candidates(self.device01, [])), [jobs[0].id])
+
+        # The view is outdated: the job was canceled without any event
+        jobs[0].go_state_canceling()
+        jobs[0].save()
+        jobs[1].go_state_finished(TestJob.HEALTH_COMPLETE)
+        jobs[1].save()
+        self.assertEqual(schedule(log, queue=queue), [])
+        self.assertEqual(len(queue), 0)
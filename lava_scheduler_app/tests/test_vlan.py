@@ -115,6 +115,21 @@ class TestVlandDevices(TestCaseWithFactory):
                 match_vlan_interface(self.cubie2, yaml.safe_load(job.definition))
             )
 
+    def test_definition_facts(self):
+        user = self.factory.make_user()
+        vlan_job = TestJob.from_yaml_and_user(
+            yaml.dump(self.factory.make_vland_job()), user
+        )
+        roles = {}
+        for job in vlan_job:
+            self.assertIn("lava-vland", job.protocols)
+            self.assertIn("lava-multinode", job.protocols)
+            self.assertEqual(job.multinode_role, job.facts["multinode_role"])
+            self.assertEqual(job.device_role, job.multinode_role)
+            roles[job.multinode_role] = job.facts["vland"]
+        self.assertEqual(roles["client"], {"vlan_one": ["RJ45", "10M"]})
+        self.assertEqual(roles["server"], {"vlan_two": ["RJ45", "100M"]})
+
     def test_jinja_template(self):
         yaml_data = self.factory.bbb1.load_configuration()
         self.assertIn("parameters", yaml_data)
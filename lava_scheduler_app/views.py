@@ -28,6 +28,7 @@ import os
 import simplejson
 import tarfile
 import re
+import uuid
 import yaml
 
 from django import forms
@@ -76,7 +77,8 @@ from lava_scheduler_app.dbutils import (
     testjob_submission,
     validate_job,
 )
-from lava_scheduler_app.logutils import read_logs
+from lava_scheduler_app.logarchive import log_exists
+from lava_scheduler_app.logutils import iter_logs, read_logs
 from lava_scheduler_app.templatetags.utils import udecode
 
 from lava.utils.lavatable import LavaView
@@ -1229,6 +1231,10 @@ def job_submit(request):
         return render(request, "lava_scheduler_app/job_submit.html", response_data)
 
 
+# Number of log lines rendered at once by job_detail
+LOG_CHUNK_SIZE = 1000
+
+
 @BreadCrumb("{pk}", parent=job_list, needs=["pk"])
 def job_detail(request, pk):
     job = get_restricted_job(request.user, pk, request=request)
@@ -1281,36 +1287,13 @@ def job_detail(request, pk):
         "job_tags": job.tags.all(),
     }
 
-    try:
-        with open(os.path.join(job.output_dir, "output.yaml"), "r") as f_in:
-            # Compute the size of the file
-            f_in.seek(0, 2)
-            job_file_size = f_in.tell()
-
-            if job_file_size >= job.size_limit:
-                log_data = []
-                data["size_warning"] = job.size_limit
-            else:
-                # Go back to the start and load the file
-                f_in.seek(0, 0)
-                log_data = yaml.load(f_in, Loader=yaml.CLoader)
-    except OSError:
-        log_data = []
-    except yaml.YAMLError:
-        log_data = None
-
-    if log_data:
-        test_case_count = TestCase.objects.filter(suite__job=job).count()
-        if test_case_count <= settings.TESTCASE_COUNT_LIMIT:
-            results = {
-                (t.suite.name, t.name): t.id
-                for t in TestCase.objects.filter(suite__job=job).select_related("suite")
-            }
-            # list all related results
-            for line in [line for line in log_data if line["lvl"] == "results"]:
-                key = (line["msg"].get("definition"), line["msg"].get("case"))
-                if key in results:
-                    line["msg"]["case_id"] = results[key]
+    results = {}
+    test_case_count = TestCase.objects.filter(suite__job=job).count()
+    if test_case_count <= settings.TESTCASE_COUNT_LIMIT:
+        results = {
+            (t.suite.name, t.name): t.id
+            for t in TestCase.objects.filter(suite__job=job).select_related("suite")
+        }
 
     # Get lava.job result if available
     lava_job_result = None
@@ -1322,21 +1305,58 @@ def job_detail(request, pk):
         if lava_job_obj.result == TestCase.RESULT_FAIL:
             lava_job_result = lava_job_obj.action_metadata
 
+    # The page is rendered around markers that are replaced by the log lines
+    # and by the number of lines, once streamed.
+    lines_marker = uuid.uuid4().hex
+    position_marker = uuid.uuid4().hex
     data.update(
         {
-            "log_data": log_data if log_data else [],
-            "invalid_log_data": log_data is None,
             "lava_job_result": lava_job_result,
+            "log_lines_marker": lines_marker,
+            "log_position_marker": position_marker,
         }
     )
+    page = render_to_string("lava_scheduler_app/job.html", data, request=request)
+    (head, tail) = page.split(lines_marker, 1)
+
+    def stream():
+        yield head
+        position = 0
+        chunk = []
+        for (number, line) in _job_log_lines(job):
+            position = number + 1
+            if not isinstance(line, dict):
+                continue
+            # Link the results to the test cases
+            if line.get("lvl") == "results" and isinstance(line.get("msg"), dict):
+                key = (line["msg"].get("definition"), line["msg"].get("case"))
+                if key in results:
+                    line["msg"]["case_id"] = results[key]
+            chunk.append((number, line))
+            if len(chunk) >= LOG_CHUNK_SIZE:
+                yield render_to_string(
+                    "lava_scheduler_app/_job_log_lines.html",
+                    {"job": job, "log_data": chunk},
+                )
+                chunk = []
+        if chunk:
+            yield render_to_string(
+                "lava_scheduler_app/_job_log_lines.html",
+                {"job": job, "log_data": chunk},
+            )
+        yield tail.replace(position_marker, str(position))
+
+    return StreamingHttpResponse(stream())
 
-    return render(request, "lava_scheduler_app/job.html", data)
+
+def _job_log_lines(job):
+    with contextlib.suppress(OSError):
+        yield from iter_logs(job.output_dir)
 
 
 @BreadCrumb("Definition", parent=job_detail, needs=["pk"])
 def job_definition(request, pk):
     job = get_restricted_job(request.user, pk, request=request)
-    log_file = job.output_file()
     description = description_data(job)
     return render(
         request,
@@ -1344,7 +1364,7 @@ def job_definition(request, pk):
         {
             "job": job,
             "pipeline": description.get("pipeline", []),
-            "job_file_present": bool(log_file),
+            "job_file_present": log_exists(job.output_dir),
             "bread_crumb_trail": BreadCrumbTrail.leading_to(job_definition, pk=pk),
             "show_cancel": job.can_cancel(request.user),
             "show_fail": job.state == TestJob.STATE_CANCELING
@@ -1379,13 +1399,12 @@ def job_definition_plain(request, pk):
 @BreadCrumb("Multinode definition", parent=job_detail, needs=["pk"])
 def multinode_job_definition(request, pk):
     job = get_restricted_job(request.user, pk, request=request)
-    log_file = job.output_file()
     return render(
         request,
         "lava_scheduler_app/multinode_job_definition.html",
         {
             "job": job,
-            "job_file_present": bool(log_file),
+            "job_file_present": log_exists(job.output_dir),
             "bread_crumb_trail": BreadCrumbTrail.leading_to(
                 multinode_job_definition, pk=pk
             ),
@@ -1539,11 +1558,7 @@ def job_status(request, pk):
 
 def job_timing(request, pk):
     job = get_restricted_job(request.user, pk, request=request)
-    try:
-        logs = yaml.load(
-            open(os.path.join(job.output_dir, "output.yaml")), Loader=yaml.CLoader
-        )
-    except OSError:
+    if not log_exists(job.output_dir):
         raise Http404
 
     # start and end patterns
@@ -1558,9 +1573,10 @@ def job_timing(request, pk):
     total_duration = 0
     max_duration = 0
     summary = []
-    for line in logs:
+    # Only the start and end lines are parsed, one at a time
+    for (_, line) in iter_logs(job.output_dir, needles=[b"start: ", b"end: "]):
         # Only parse debug and info levels
-        if line["lvl"] not in ["debug", "info"]:
+        if not isinstance(line, dict) or line.get("lvl") not in ["debug", "info"]:
             continue
 
         # Will raise if the log message is a python object
@@ -128,6 +128,18 @@ class LAVADaemonCommand(BaseCommand):
 
 
 def watch_directory(directory):
+    return watch_directories([directory])
+
+
+def watch_directories(directories, inotify_fd=None):
+    """
+    Watch the given directories using inotify.
+    Directories that are already watched by this file descriptor are
+    skipped by the kernel while missing directories are ignored.
+    :param inotify_fd: the file descriptor to add the watches to. A new one
+    is created when None.
+    :return: the inotify file descriptor or None if no directory is watched
+    """
     IN_MODIFY = 0x00000002
     IN_ATTRIB = 0x00000004
     IN_MOVED_FROM = 0x00000040
@@ -148,13 +160,19 @@ def watch_directory(directory):
         | IN_MOVE_SELF
     )
 
-    # watch a directory using inotify
-    # return the corresponding file descriptor
     libc_name = ctypes.util.find_library("c")
     libc = ctypes.cdll.LoadLibrary(libc_name)
 
     # create the inotify file descriptor
-    inotify_fd = libc.inotify_init()
-    # watch the "test" directory
-    ret = libc.inotify_add_watch(inotify_fd, directory.encode("utf-8"), IN_EVENTS)
-    return None if ret == -1 else inotify_fd
+    watched = inotify_fd is not None
+    if inotify_fd is None:
+        inotify_fd = libc.inotify_init()
+        if inotify_fd == -1:
+            return None
+    for directory in directories:
+        ret = libc.inotify_add_watch(inotify_fd, directory.encode("utf-8"), IN_EVENTS)
+        watched = watched or ret != -1
+    if not watched:
+        os.close(inotify_fd)
+        return None
+    return inotify_fd
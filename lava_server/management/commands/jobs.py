@@ -17,7 +17,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import datetime
+import os
 import re
 from shutil import rmtree
 import time
@@ -27,7 +29,9 @@ from django.core.management.base import BaseCommand, CommandError, CommandParser
 from django.db import transaction
 from django.utils import timezone
 
+from lava_scheduler_app.logarchive import archive_log
 from lava_scheduler_app.models import TestJob
+from lava_scheduler_app.purge import delete_jobs
 
 
 class Command(BaseCommand):
@@ -59,6 +63,31 @@ class Command(BaseCommand):
         )
         sub.required = True
 
+        compress = sub.add_parser(
+            "compress",
+            help="Compress the logs of the finished jobs. The logs are still "
+            "available from the web interface and the APIs.",
+        )
+        compress.add_argument(
+            "--older-than",
+            default="1d",
+            type=str,
+            help="Compress the logs of the jobs finished before this. The time "
+            "is of the form: 1h (one hour) or 2d (two days). Default: 1d.",
+        )
+        compress.add_argument(
+            "--dry-run",
+            default=False,
+            action="store_true",
+            help="Do not compress any log, simulate the output",
+        )
+        compress.add_argument(
+            "--slow",
+            default=False,
+            action="store_true",
+            help="Be nice with the system by sleeping regularly",
+        )
+
         fail = sub.add_parser(
             "fail",
             help="Force the job status in the database. Keep "
@@ -108,7 +137,28 @@ class Command(BaseCommand):
             "--slow",
             default=False,
             action="store_true",
-            help="Be nice with the system by sleeping regularly",
+            help="Be nice with the system by sleeping after each chunk as long "
+            "as the database took to remove it",
+        )
+        rm.add_argument(
+            "--chunk-size",
+            default=1000,
+            type=int,
+            help="Number of jobs removed in each transaction. Default: 1000.",
+        )
+        rm.add_argument(
+            "--workers",
+            default=4,
+            type=int,
+            help="Number of threads removing the output directories. Default: 4.",
+        )
+        rm.add_argument(
+            "--checkpoint",
+            default=None,
+            type=str,
+            help="File recording the progress. When the file exists, only the "
+            "jobs after the last removed job are considered, allowing to resume "
+            "an interrupted run with the same filters.",
         )
 
     def handle(self, *_, **options):
@@ -120,10 +170,65 @@ class Command(BaseCommand):
                 options["state"],
                 options["dry_run"],
                 options["slow"],
+                options["chunk_size"],
+                options["workers"],
+                options["checkpoint"],
+            )
+        elif options["sub_command"] == "compress":
+            self.handle_compress(
+                options["older_than"], options["dry_run"], options["slow"]
             )
         elif options["sub_command"] == "fail":
             self.handle_fail(options["job_id"])
 
+    def parse_older_than(self, older_than):  # pylint: disable=no-self-use
+        pattern = re.compile(r"^(?P<time>\d+)(?P<unit>(h|d))$")
+        match = pattern.match(older_than)
+        if match is None:
+            raise CommandError("Invalid older-than format")
+
+        if match.groupdict()["unit"] == "d":
+            return datetime.timedelta(days=int(match.groupdict()["time"]))
+        return datetime.timedelta(hours=int(match.groupdict()["time"]))
+
+    def handle_compress(self, older_than, simulate, slow):
+        delta = self.parse_older_than(older_than)
+        jobs = (
+            TestJob.objects.filter(
+                state=TestJob.STATE_FINISHED, end_time__lt=(timezone.now() - delta)
+            )
+            .order_by("id")
+            .only("id", "submit_time")
+        )
+        (total, compressed) = (0, 0)
+        last_id = 0
+        while True:
+            batch = list(jobs.filter(id__gt=last_id)[:100])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for job in batch:
+                if simulate:
+                    if os.path.exists(os.path.join(job.output_dir, "output.yaml")):
+                        self.stdout.write("* %d: %s" % (job.id, job.output_dir))
+                    continue
+                try:
+                    sizes = archive_log(job.output_dir)
+                except OSError as exc:
+                    self.stderr.write(
+                        "* %d: unable to compress the logs: %s" % (job.id, str(exc))
+                    )
+                    continue
+                if sizes is None:
+                    continue
+                self.stdout.write("* %d: %d => %d bytes" % (job.id, sizes[0], sizes[1]))
+                total += sizes[0]
+                compressed += sizes[1]
+            if slow:
+                self.stdout.write("sleeping 2s...")
+                time.sleep(2)
+        self.stdout.write("Compressed %d bytes into %d bytes" % (total, compressed))
+
     def handle_fail(self, job_id):
         try:
             with transaction.atomic():
@@ -133,24 +238,39 @@ class Command(BaseCommand):
         except TestJob.DoesNotExist:
             raise CommandError("TestJob '%d' does not exists" % job_id)
 
-    def handle_rm(self, older_than, submitter, state, simulate, slow):
+    def read_checkpoint(self, filename):  # pylint: disable=no-self-use
+        try:
+            with open(filename, "r") as f_in:
+                return int(f_in.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as exc:
+            raise CommandError("Invalid checkpoint '%s': %s" % (filename, str(exc)))
+
+    def write_checkpoint(self, filename, last_id):  # pylint: disable=no-self-use
+        with open(filename + ".tmp", "w") as f_out:
+            f_out.write("%d\n" % last_id)
+        os.rename(filename + ".tmp", filename)
+
+    def handle_rm(
+        self,
+        older_than,
+        submitter,
+        state,
+        simulate,
+        slow,
+        chunk_size,
+        workers,
+        checkpoint,
+    ):
         if not older_than and not submitter and not state:
             raise CommandError("You should specify at least one filtering option")
-
-        if simulate:
-            transaction.set_autocommit(False)
+        if chunk_size < 1 or workers < 1:
+            raise CommandError("The chunk size and the workers should be positive")
 
         jobs = TestJob.objects.all().order_by("id")
         if older_than is not None:
-            pattern = re.compile(r"^(?P<time>\d+)(?P<unit>(h|d))$")
-            match = pattern.match(older_than)
-            if match is None:
-                raise CommandError("Invalid older-than format")
-
-            if match.groupdict()["unit"] == "d":
-                delta = datetime.timedelta(days=int(match.groupdict()["time"]))
-            else:
-                delta = datetime.timedelta(hours=int(match.groupdict()["time"]))
+            delta = self.parse_older_than(older_than)
             jobs = jobs.filter(end_time__lt=(timezone.now() - delta))
 
         if submitter is not None:
@@ -163,29 +283,68 @@ class Command(BaseCommand):
         if state is not None:
             jobs = jobs.filter(state=self.job_state[state])
 
-        self.stdout.write("Removing %d jobs:" % jobs.count())
+        last_id = 0
+        if checkpoint is not None:
+            last_id = self.read_checkpoint(checkpoint)
+            if last_id:
+                self.stdout.write("Resuming after job %d" % last_id)
 
-        while True:
-            count = 0
-            for job in jobs[0:100]:
-                count += 1
+        self.stdout.write("Removing %d jobs:" % jobs.filter(id__gt=last_id).count())
+        jobs = jobs.only("id", "end_time", "submit_time")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                # Keyset pagination on the id, so the dry-run also progresses
+                chunk = list(jobs.filter(id__gt=last_id)[:chunk_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                directories = []
+                for job in chunk:
+                    directories.append(job.output_dir)
+                    self.stdout.write(
+                        "* %d (%s): %s" % (job.id, job.end_time, directories[-1])
+                    )
+                if simulate:
+                    continue
+
+                # Remove the rows before the directories: if the transaction
+                # fails, the logs are kept.
+                start = time.monotonic()
+                counts = delete_jobs([job.id for job in chunk])
+                elapsed = time.monotonic() - start
+                removed = counts.pop(TestJob._meta.label, 0)
                 self.stdout.write(
-                    "* %d (%s): %s" % (job.id, job.end_time, job.output_dir)
+                    "  -> %d jobs and %d related rows removed in %.1fs"
+                    % (removed, sum(counts.values()), elapsed)
                 )
-                try:
-                    if not simulate:
-                        rmtree(job.output_dir)
-                except OSError as exc:
-                    self.stderr.write(
-                        "  -> Unable to remove the directory: %s" % str(exc)
-                    )
-                job.delete()
 
-            if count == 0:
-                break
-            if slow:
-                self.stdout.write("sleeping 2s...")
-                time.sleep(2)
+                errors = pool.map(remove_directory, directories)
+                for (directory, error) in zip(directories, errors):
+                    if error is not None:
+                        self.stderr.write(
+                            "  -> Unable to remove the directory '%s': %s"
+                            % (directory, error)
+                        )
+
+                if checkpoint is not None:
+                    self.write_checkpoint(checkpoint, last_id)
+
+                if slow:
+                    # Throttle on the time taken by the database for this
+                    # chunk: the slower the database, the longer the pause.
+                    self.stdout.write("sleeping %.1fs..." % elapsed)
+                    time.sleep(elapsed)
+
 
-        if simulate:
-            transaction.rollback()
+def remove_directory(directory):
+    """
+    Remove the directory, returning the error message if any.
+    """
+    try:
+        rmtree(directory)
+    except FileNotFoundError:
+        return None
+    except OSError as exc:
+        return str(exc)
+    return None
@@ -22,8 +22,13 @@
 import contextlib
 import logging
 import os
+import re
+import shutil
+import signal
+import tempfile
 import time
 import yaml
+import zlib
 import zmq
 import zmq.auth
 from zmq.utils.strtypes import u
@@ -32,13 +37,18 @@ from django.conf import settings
 from django.db import connection, transaction
 from django.db.utils import DatabaseError, InterfaceError, OperationalError
 
-from lava_results_app.models import TestCase
+from lava_results_app.metastore import MetadataStore
+from lava_results_app.models import TestCase, update_result_counters
 from lava_server.cmdutils import LAVADaemonCommand, watch_directory
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.signals import send_event
 from lava_scheduler_app.utils import mkdir
-from lava_scheduler_app.logutils import line_count, write_logs
-from lava_results_app.dbutils import map_scanned_results, create_metadata_store
+from lava_scheduler_app.logutils import line_count, write_logs_batch
+from lava_results_app.dbutils import (
+    ResultsCache,
+    create_metadata_store,
+    map_scanned_results,
+)
 
 
 # Constants
@@ -46,23 +56,78 @@ FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
 TIMEOUT = 10
 BULK_CREATE_TIMEOUT = 10
 FD_TIMEOUT = 60
+STATS_INTERVAL = 60
+# Flush the buffered logs of a job above this size (in bytes)
+FLUSH_SIZE = 1024 * 1024
+# Check that the worker is alive at this interval while its shard is full
+SHARD_TIMEOUT = 1
+# When leaving, maximum time to send the last messages to the workers and
+# then for the workers to flush them. The total should stay below the
+# TimeoutStopSec of the service.
+SHARD_LINGER = 10
+WORKERS_STOP_TIMEOUT = 30
+
+# Log lines are dumped by the dispatcher as:
+#   {"dt": "<date>", "lvl": "<level>", "msg": <message>}
+# For these levels, only the level is needed, so the line can be written
+# without parsing the message.
+PLAIN_LEVELS = ["debug", "info", "warning", "error", "exception", "target", "input"]
+PLAIN_LINE = re.compile(r'^\{"dt": "[^"]*", "lvl": "(?P<lvl>[a-z]+)", "msg": .*\}$')
+
+
+def plain_level(message):
+    """
+    Return the level of the log line if the line does not need to be parsed,
+    None otherwise.
+    """
+    match = PLAIN_LINE.match(message)
+    if match is None or match.group("lvl") not in PLAIN_LEVELS:
+        return None
+    return match.group("lvl")
 
 
 class JobHandler:  # pylint: disable=too-few-public-methods
     def __init__(self, job):
+        self.job = job
         self.output_dir = job.output_dir
+        # Suites and test sets of the job, loaded on the first result
+        self.results = None
         self.output = open(os.path.join(self.output_dir, "output.yaml"), "ab")
         self.index = open(os.path.join(self.output_dir, "output.idx"), "ab")
         self.last_usage = time.time()
+        self.last_flush = time.time()
         self.markers = {}
+        # Packed store of the "extra" metadata of the results
+        self.metadata = MetadataStore(self.output_dir)
+        # Lines not yet written to the log file
+        self.pending = []
+        self.pending_size = 0
+        self.lines = line_count(self.index)
 
     def write(self, message):
-        write_logs(self.output, self.index, (message + "\n").encode("utf-8"))
+        line = (message + "\n").encode("utf-8")
+        self.pending.append(line)
+        self.pending_size += len(line)
+        self.lines += 1
+
+    def flush(self):
+        """
+        Write the pending lines and return the number of lines written.
+        """
+        self.metadata.flush()
+        count = len(self.pending)
+        if count:
+            write_logs_batch(self.output, self.index, self.pending)
+            self.pending = []
+            self.pending_size = 0
+        self.last_flush = time.time()
+        return count
 
     def line_count(self):
-        return line_count(self.index)
+        return self.lines
 
     def close(self):
+        self.flush()
         self.index.close()
         self.output.close()
 
@@ -84,11 +149,25 @@ class Command(LAVADaemonCommand):
         self.cert_dir_path = None
         # List of logs
         self.jobs = {}
-        # Keep test cases in memory
+        # Keep test cases in memory, along with the caches of the suites and
+        # test sets that should be saved before them
         self.test_cases = []
+        self.results_caches = set()
         # Master status
         self.last_ping = 0
         self.ping_interval = TIMEOUT
+        # Log batching
+        self.batch_size = 1000
+        self.flush_interval = 1
+        # Sharding: the front process routes the messages to the workers
+        self.workers = []
+        self.workers_dir = None
+        self.dead_workers = set()
+        self.shards = []
+        self.front_pid = None
+        # Throughput counters, reset at every STATS_INTERVAL
+        self.stats = {"messages": 0, "batches": 0, "plain": 0, "lines": 0, "writes": 0}
+        self.last_stats = time.time()
 
     def add_arguments(self, parser):
         super().add_arguments(parser)
@@ -124,10 +203,33 @@ class Command(LAVADaemonCommand):
             help="Directory for slaves certificates",
         )
 
+        logs = parser.add_argument_group("logs")
+        logs.add_argument(
+            "--batch-size",
+            default=1000,
+            type=int,
+            help="Maximum number of messages processed at once. Default: 1000",
+        )
+        logs.add_argument(
+            "--flush-interval",
+            default=1,
+            type=float,
+            help="Maximum delay (in seconds) before writing the logs to disk. Use 0 to write every line directly. Default: 1",
+        )
+        logs.add_argument(
+            "--workers",
+            default=0,
+            type=int,
+            help="Number of worker processes. The messages are routed to the workers by job id. Default: 0 (no workers)",
+        )
+
     def handle(self, *args, **options):
         # Initialize logging.
         self.setup_logging("lava-logs", options["level"], options["log_file"], FORMAT)
 
+        self.batch_size = max(1, options["batch_size"])
+        self.flush_interval = max(0, options["flush_interval"])
+
         self.logger.info("[INIT] Dropping privileges")
         if not self.drop_privileges(options["user"], options["group"]):
             self.logger.error("[INIT] Unable to drop privileges")
@@ -138,6 +240,10 @@ class Command(LAVADaemonCommand):
         with open(filename, "w") as output:
             yaml.dump(options, output)
 
+        # Start the workers before creating any zmq context
+        if options["workers"] > 1:
+            self.start_workers(options["workers"])
+
         # Create the sockets
         context = zmq.Context()
         self.log_socket = context.socket(zmq.PULL)
@@ -189,6 +295,11 @@ class Command(LAVADaemonCommand):
         self.log_socket.bind(options["socket"])
         self.controler.connect(options["master_socket"])
 
+        for index in range(len(self.workers)):
+            shard = context.socket(zmq.PUSH)
+            shard.bind(self.worker_endpoint(index))
+            self.shards.append(shard)
+
         # Poll on the sockets. This allow to have a
         # nice timeout along with polling.
         self.poller = zmq.Poller()
@@ -225,28 +336,176 @@ class Command(LAVADaemonCommand):
         # Empty the queue
         try:
             while self.wait_for_messages(True):
-                # Flush test cases cache for every iteration because we might
-                # get killed soon.
+                # Flush logs and test cases cache for every iteration because
+                # we might get killed soon.
+                self.flush_logs(force=True)
                 self.flush_test_cases()
         except BaseException as exc:
             self.logger.error("[EXIT] Unknown exception raised, leaving!")
             self.logger.exception(exc)
         finally:
             # Last flush
+            self.flush_logs(force=True)
             self.flush_test_cases()
             self.logger.info("[EXIT] Closing the logging socket: the queue is empty")
             self.log_socket.close()
+            # Send the last messages to the workers, without waiting forever
+            # for a dead worker
+            for shard in self.shards:
+                shard.close(linger=SHARD_LINGER * 1000)
             if options["encrypt"]:
                 self.auth.stop()
             context.term()
+            # The shards are drained: the workers can now handle the last
+            # messages and leave
+            self.stop_workers()
+
+    def worker_endpoint(self, index):
+        return "ipc://%s" % os.path.join(self.workers_dir, "worker-%d" % index)
+
+    def start_workers(self, count):
+        self.workers_dir = tempfile.mkdtemp(prefix="lava-logs-")
+        front_pid = os.getpid()
+        # The database connection should not be shared with the workers
+        connection.close()
+        for index in range(count):
+            pid = os.fork()
+            if pid == 0:
+                self.front_pid = front_pid
+                ret = 0
+                try:
+                    self.handle_worker(index)
+                except BaseException as exc:
+                    self.logger.error("[WORKER %d] Unknown exception raised", index)
+                    self.logger.exception(exc)
+                    ret = 1
+                finally:
+                    os._exit(ret)  # pylint: disable=protected-access
+            self.logger.info("[INIT] Started worker %d (pid %d)", index, pid)
+            self.workers.append(pid)
+
+    def stop_workers(self):
+        alive = [
+            pid
+            for (index, pid) in enumerate(self.workers)
+            if index not in self.dead_workers
+        ]
+        for pid in alive:
+            with contextlib.suppress(OSError):
+                os.kill(pid, signal.SIGTERM)
+        # Let the workers flush their last messages, without waiting forever
+        deadline = time.time() + WORKERS_STOP_TIMEOUT
+        while alive and time.time() < deadline:
+            for pid in alive[:]:
+                try:
+                    (ret, _) = os.waitpid(pid, os.WNOHANG)
+                except OSError:
+                    ret = pid
+                if ret != 0:
+                    alive.remove(pid)
+            if alive:
+                time.sleep(0.1)
+        for pid in alive:
+            self.logger.error(
+                "[EXIT] worker (pid %d) is still running, killing it", pid
+            )
+            with contextlib.suppress(OSError):
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+        self.workers = []
+        self.dead_workers = set()
+        if self.workers_dir is not None:
+            shutil.rmtree(self.workers_dir, ignore_errors=True)
+
+    def workers_alive(self):
+        for (index, pid) in enumerate(self.workers):
+            if index in self.dead_workers:
+                continue
+            with contextlib.suppress(OSError):
+                (ret, _) = os.waitpid(pid, os.WNOHANG)
+                if ret == 0:
+                    continue
+            self.logger.error("[POLL] worker %d (pid %d) is dead, leaving", index, pid)
+            self.dead_workers.add(index)
+        return not self.dead_workers
+
+    def route_message(self, msg):
+        """
+        Send the message to the worker of the job.
+        Return False if the worker is dead and the message is dropped.
+        """
+        index = zlib.crc32(msg[0]) % len(self.shards)
+        shard = self.shards[index]
+        # Never block on the shard: the queue of a dead worker is never
+        # emptied
+        while index not in self.dead_workers:
+            try:
+                shard.send_multipart(msg, zmq.NOBLOCK)
+                return True
+            except zmq.error.Again:
+                # The worker is late or dead
+                self.workers_alive()
+                shard.poll(SHARD_TIMEOUT * 1000, zmq.POLLOUT)
+        return False
+
+    def handle_worker(self, index):
+        """
+        Worker process: handle the messages routed by the front process.
+        Every worker has its own file handlers, test cases cache and
+        database connection.
+        """
+        self.logger.info("[WORKER %d] listening for logs", index)
+        self.workers = []
+        context = zmq.Context()
+        self.log_socket = context.socket(zmq.PULL)
+        self.log_socket.connect(self.worker_endpoint(index))
+        self.poller = zmq.Poller()
+        self.poller.register(self.log_socket, zmq.POLLIN)
+        (self.pipe_r, _) = self.setup_zmq_signal_handler()
+        self.poller.register(self.pipe_r, zmq.POLLIN)
+
+        try:
+            self.main_loop()
+        except BaseException as exc:
+            self.logger.error("[WORKER %d] Unknown exception raised", index)
+            self.logger.exception(exc)
+
+        # Handle the messages sent by the front process while leaving
+        try:
+            while self.wait_for_messages(True):
+                self.flush_logs(force=True)
+                self.flush_test_cases()
+        finally:
+            self.flush_logs(force=True)
+            self.flush_test_cases()
+            self.logger.info("[WORKER %d] leaving", index)
+            self.log_socket.close(linger=0)
+            context.term()
 
     def flush_test_cases(self):
-        if not self.test_cases:
+        if not self.test_cases and not self.results_caches:
             return
 
+        # The test cases reference the "extra" metadata stores
+        for handler in self.jobs.values():
+            try:
+                handler.metadata.flush()
+            except OSError as exc:
+                self.logger.error(
+                    "[%d] Unable to flush the metadata store: %s", handler.job.id, exc
+                )
+
         # Try to save into the database
         try:
-            TestCase.objects.bulk_create(self.test_cases)
+            # Create the new suites and test sets first
+            for cache in self.results_caches:
+                cache.save()
+            self.results_caches = set()
+            ResultsCache.prepare(self.test_cases)
+            with transaction.atomic():
+                TestCase.objects.bulk_create(self.test_cases)
+                # bulk_create does not send the post_save signals
+                update_result_counters(self.test_cases)
             self.logger.info("Saving %d test cases", len(self.test_cases))
             self.test_cases = []
         except DatabaseError as exc:
@@ -258,12 +517,63 @@ class Command(LAVADaemonCommand):
             saved = 0
             for tc in self.test_cases:
                 with contextlib.suppress(DatabaseError):
+                    if tc.suite.id is None:
+                        tc.suite.save()
+                    if tc.test_set is not None and tc.test_set.id is None:
+                        tc.test_set.suite_id = tc.suite.id
+                        tc.test_set.save()
+                    ResultsCache.prepare([tc])
                     tc.save()
                     saved += 1
             self.logger.info(
                 "%d test cases saved, %d dropped", saved, len(self.test_cases) - saved
             )
             self.test_cases = []
+            # The caches are now out of sync with the database
+            for handler in self.jobs.values():
+                handler.results = None
+            self.results_caches = set()
+
+    def flush_job_logs(self, job_id):
+        lines = self.jobs[job_id].flush()
+        if lines:
+            self.stats["lines"] += lines
+            self.stats["writes"] += 1
+
+    def flush_logs(self, force=False):
+        """
+        Write the logs that have been buffered for longer than the flush
+        interval.
+        """
+        now = time.time()
+        for (job_id, handler) in self.jobs.items():
+            if handler.pending and (
+                force or now - handler.last_flush >= self.flush_interval
+            ):
+                self.flush_job_logs(job_id)
+
+    def log_stats(self, now):
+        elapsed = now - self.last_stats
+        self.last_stats = now
+        stats = self.stats
+        self.stats = {key: 0 for key in stats}
+        if not stats["messages"]:
+            return
+        if self.shards:
+            self.logger.info(
+                "[STATS] %.1f messages/s routed to %d workers, %.1f messages per batch",
+                stats["messages"] / elapsed,
+                len(self.shards),
+                stats["messages"] / max(1, stats["batches"]),
+            )
+            return
+        self.logger.info(
+            "[STATS] %.1f lines/s, %.1f messages per batch, %.1f lines per write, %d%% not parsed",
+            stats["lines"] / elapsed,
+            stats["messages"] / max(1, stats["batches"]),
+            stats["lines"] / max(1, stats["writes"]),
+            100 * stats["plain"] / stats["messages"],
+        )
 
     def main_loop(self):
         last_gc = time.time()
@@ -274,6 +584,9 @@ class Command(LAVADaemonCommand):
         while self.wait_for_messages(False):
             now = time.time()
 
+            # Write the buffered logs
+            self.flush_logs()
+
             # Dump TestCase into the database
             if now - last_bulk_create > BULK_CREATE_TIMEOUT:
                 last_bulk_create = now
@@ -286,11 +599,24 @@ class Command(LAVADaemonCommand):
                 for job_id in list(self.jobs.keys()):
                     if now - self.jobs[job_id].last_usage > FD_TIMEOUT:
                         self.logger.info("[%s] closing log file", job_id)
+                        self.flush_job_logs(job_id)
                         self.jobs[job_id].close()
                         del self.jobs[job_id]
 
+            # Throughput counters
+            if now - self.last_stats > STATS_INTERVAL:
+                self.log_stats(now)
+
+            # Workers: leave when the front process is dead
+            if self.front_pid is not None and os.getppid() != self.front_pid:
+                self.logger.error("[POLL] the front process is dead, leaving")
+                break
+            # Front: leave when a worker is dead
+            if not self.workers_alive():
+                break
+
             # Ping the master
-            if now - self.last_ping > self.ping_interval:
+            if self.controler is not None and now - self.last_ping > self.ping_interval:
                 self.logger.debug("PING => master")
                 self.last_ping = now
                 self.controler.send_multipart([b"master", b"PING"])
@@ -298,7 +624,11 @@ class Command(LAVADaemonCommand):
     def wait_for_messages(self, leaving):
         try:
             try:
-                sockets = dict(self.poller.poll(TIMEOUT * 1000))
+                # Wake up in time to write the buffered logs
+                timeout = TIMEOUT
+                if any(handler.pending for handler in self.jobs.values()):
+                    timeout = min(TIMEOUT, self.flush_interval)
+                sockets = dict(self.poller.poll(timeout * 1000))
             except zmq.error.ZMQError as exc:
                 self.logger.error("[POLL] zmq error: %s", str(exc))
                 return True
@@ -345,14 +675,72 @@ class Command(LAVADaemonCommand):
         return True
 
     def logging_socket(self):
-        msg = self.log_socket.recv_multipart()
-        try:
-            (job_id, message) = (
-                u(m) for m in msg
-            )  # pylint: disable=unbalanced-tuple-unpacking
-        except ValueError:
-            # do not let a bad message stop the master.
-            self.logger.error("[POLL] failed to parse log message, skipping: %s", msg)
+        # Drain the socket: the messages are then handled in one go
+        messages = []
+        with contextlib.suppress(zmq.error.Again):
+            while len(messages) < self.batch_size:
+                messages.append(self.log_socket.recv_multipart(zmq.NOBLOCK))
+        self.stats["batches"] += 1
+        self.stats["messages"] += len(messages)
+
+        # Front process: route the messages by job id. The messages of a
+        # given job are always handled by the same worker, in order.
+        if self.shards:
+            dropped = sum(not self.route_message(msg) for msg in messages)
+            if dropped:
+                self.logger.error(
+                    "[POLL] dropping %d messages for the dead workers", dropped
+                )
+            return
+
+        parsed = []
+        for msg in messages:
+            try:
+                (job_id, message) = (
+                    u(m) for m in msg
+                )  # pylint: disable=unbalanced-tuple-unpacking
+            except ValueError:
+                # do not let a bad message stop the master.
+                self.logger.error(
+                    "[POLL] failed to parse log message, skipping: %s", msg
+                )
+                continue
+            parsed.append((job_id, message))
+
+        # Open the log files of the new jobs with only one query
+        new_jobs = {job_id for (job_id, _) in parsed if job_id not in self.jobs}
+        if new_jobs:
+            self.open_jobs(new_jobs)
+
+        now = time.time()
+        for (job_id, message) in parsed:
+            self.handle_message(job_id, message, now)
+
+        # Write directly when batching is disabled
+        if not self.flush_interval:
+            self.flush_logs(force=True)
+
+    def open_jobs(self, job_ids):
+        ids = [int(job_id) for job_id in job_ids if job_id.isdigit()]
+        for job in TestJob.objects.filter(id__in=ids):
+            job_id = str(job.id)
+            if job_id not in job_ids:
+                continue
+            self.logger.info("[%s] receiving logs from a new job", job_id)
+            # Create the sub directories (if needed)
+            mkdir(job.output_dir)
+            self.jobs[job_id] = JobHandler(job)
+
+    def handle_message(self, job_id, message, now):
+        # Find the handler (if available)
+        if job_id not in self.jobs:
+            self.logger.error("[%s] unknown job id", job_id)
+            return
+
+        # Plain log lines: only write them
+        if plain_level(message) is not None:
+            self.stats["plain"] += 1
+            self.write_job_logs(job_id, message, now)
             return
 
         try:
@@ -376,20 +764,6 @@ class Command(LAVADaemonCommand):
             )
             return
 
-        # Find the handler (if available)
-        if job_id not in self.jobs:
-            # Query the database for the job
-            try:
-                job = TestJob.objects.get(id=job_id)
-            except TestJob.DoesNotExist:
-                self.logger.error("[%s] unknown job id", job_id)
-                return
-
-            self.logger.info("[%s] receiving logs from a new job", job_id)
-            # Create the sub directories (if needed)
-            mkdir(job.output_dir)
-            self.jobs[job_id] = JobHandler(job)
-
         # For 'event', send an event and log as 'debug'
         if message_lvl == "event":
             self.logger.debug("[%s] event: %s", job_id, message_msg)
@@ -416,24 +790,24 @@ class Command(LAVADaemonCommand):
             )
             return
 
-        # Mark the file handler as used
-        self.jobs[job_id].last_usage = time.time()
-        # The format is a list of dictionaries
-        self.jobs[job_id].write("- %s" % message)
+        self.write_job_logs(job_id, message, now)
 
         if message_lvl == "results":
-            try:
-                job = TestJob.objects.get(pk=job_id)
-            except TestJob.DoesNotExist:
-                self.logger.error("[%s] unknown job id", job_id)
-                return
-            meta_filename = create_metadata_store(message_msg, job)
+            handler = self.jobs[job_id]
+            if handler.results is None:
+                handler.results = ResultsCache(handler.job)
+            meta_filename = create_metadata_store(
+                message_msg, handler.job, handler.metadata
+            )
             new_test_case = map_scanned_results(
                 results=message_msg,
-                job=job,
-                markers=self.jobs[job_id].markers,
+                job=handler.job,
+                markers=handler.markers,
                 meta_filename=meta_filename,
+                cache=handler.results,
             )
+            if handler.results.dirty():
+                self.results_caches.add(handler.results)
 
             if new_test_case is None:
                 self.logger.warning(
@@ -447,7 +821,8 @@ class Command(LAVADaemonCommand):
                 message_msg.get("definition") == "lava"
                 and message_msg.get("case") == "job"
             ):
-                # Flush cached test cases
+                # Flush cached test cases and logs
+                self.flush_job_logs(job_id)
                 self.flush_test_cases()
 
                 if message_msg.get("result") == "pass":
@@ -475,6 +850,15 @@ class Command(LAVADaemonCommand):
 
         # n.b. logging here would produce a log entry for every message in every job.
 
+    def write_job_logs(self, job_id, message, now):
+        handler = self.jobs[job_id]
+        # Mark the file handler as used
+        handler.last_usage = now
+        # The format is a list of dictionaries
+        handler.write("- %s" % message)
+        if handler.pending_size >= FLUSH_SIZE:
+            self.flush_job_logs(job_id)
+
     def controler_socket(self):
         msg = self.controler.recv_multipart()
         try:
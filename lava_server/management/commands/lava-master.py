@@ -19,6 +19,7 @@
 
 # pylint: disable=wrong-import-order
 
+import concurrent.futures
 import contextlib
 import errno
 import jinja2
@@ -39,10 +40,11 @@ from django.utils import timezone
 
 from lava_results_app.models import TestCase, TestSuite
 from lava_scheduler_app.dbutils import parse_job_description
+from lava_scheduler_app.jobqueue import JobQueue
 from lava_scheduler_app.models import TestJob, Worker
 from lava_scheduler_app.scheduler import schedule
 from lava_scheduler_app.utils import mkdir
-from lava_server.cmdutils import LAVADaemonCommand, watch_directory
+from lava_server.cmdutils import LAVADaemonCommand, watch_directories, watch_directory
 
 
 # pylint: disable=no-member,bad-continuation
@@ -159,11 +161,18 @@ class Command(LAVADaemonCommand):
         self.poller = None
         self.pipe_r = None
         self.inotify_fd = None
+        # Configuration files cache, invalidated by inotify
+        self.config_fd = None
+        self.config_cache = {}
+        # Pool of threads preparing the START messages
+        self.start_pool = None
         # List of logs
         # List of known dispatchers. At startup do not load this from the
         # database. This will help to know if the slave as restarted or not.
         self.dispatchers = {"lava-logs": SlaveDispatcher("lava-logs", online=False)}
         self.events = {"canceling": set(), "available_dt": set()}
+        # In-memory view of the queue, updated from the events
+        self.queue = JobQueue()
 
     def add_arguments(self, parser):
         super().add_arguments(parser)
@@ -196,6 +205,14 @@ class Command(LAVADaemonCommand):
             help="Directory for slaves certificates",
         )
 
+        jobs = parser.add_argument_group("jobs")
+        jobs.add_argument(
+            "--start-workers",
+            default=4,
+            type=int,
+            help="Number of threads preparing the job configurations. Default: 4",
+        )
+
     def send_status(self, hostname):
         """
         The master crashed, send a STATUS message to get the current state of jobs
@@ -270,6 +287,7 @@ class Command(LAVADaemonCommand):
             self.logger.error("Invalid event: %s", msg)
             return True
 
+        self.queue.handle_event(topic, data)
         if topic.endswith(".testjob"):
             if data["state"] == "Canceling":
                 self.events["canceling"].add(int(data["job"]))
@@ -416,28 +434,63 @@ class Command(LAVADaemonCommand):
         # no need for the dispatcher to retain comments
         return yaml.dump(job_def)
 
-    def save_job_config(self, job, device_cfg, env_str, env_dut_str, dispatcher_cfg):
+    def load_config(self, filename, fallback=None):
+        """
+        Cached version of load_optional_yaml_file.
+        The cache is dropped each time inotify reports a modification in the
+        configuration directories. Without inotify, nothing is cached.
+        """
+        if self.config_fd is None:
+            return load_optional_yaml_file(filename, fallback)
+        key = (filename, fallback)
+        if key not in self.config_cache:
+            self.config_cache[key] = load_optional_yaml_file(filename, fallback)
+        return self.config_cache[key]
+
+    def watch_config(self):
+        """
+        Watch the configuration directories (including the per-dispatcher
+        directories) with inotify.
+        """
+        directories = [os.path.dirname(ENV_PATH), DISPATCHERS_PATH]
+        with contextlib.suppress(OSError):
+            directories.extend(
+                [e.path for e in os.scandir(DISPATCHERS_PATH) if e.is_dir()]
+            )
+        self.config_fd = watch_directories(directories, self.config_fd)
+
+    def save_job_config(
+        self, job, job_def, device_cfg, env_str, env_dut_str, dispatcher_cfg
+    ):
+        """
+        Save the configuration files of the job.
+        The definition and the device configuration are already dumped.
+        """
         output_dir = job.output_dir
         mkdir(output_dir)
-        with open(os.path.join(output_dir, "job.yaml"), "w") as f_out:
-            f_out.write(self.export_definition(job))
-        with open(os.path.join(output_dir, "device.yaml"), "w") as f_out:
-            yaml.dump(device_cfg, f_out)
-        if env_str:
-            with open(os.path.join(output_dir, "env.yaml"), "w") as f_out:
-                f_out.write(env_str)
-        if env_dut_str:
-            with open(os.path.join(output_dir, "env.dut.yaml"), "w") as f_out:
-                f_out.write(env_dut_str)
-        if dispatcher_cfg:
-            with open(os.path.join(output_dir, "dispatcher.yaml"), "w") as f_out:
-                f_out.write(dispatcher_cfg)
-
-    def start_job(self, job):
-        # Load job definition to get the variables for template
-        # rendering
-        job_def = yaml.safe_load(job.definition)
-        job_ctx = job_def.get("context", {})
+        files = [
+            ("job.yaml", job_def),
+            ("device.yaml", device_cfg),
+            ("env.yaml", env_str),
+            ("env.dut.yaml", env_dut_str),
+            ("dispatcher.yaml", dispatcher_cfg),
+        ]
+        for (name, data) in files:
+            if data:
+                with open(os.path.join(output_dir, name), "w") as f_out:
+                    f_out.write(data)
+
+    def prepare_job(self, job, sub_jobs):
+        """
+        Render the configuration and save the files of the job (and of the
+        dynamic connections). Return the list of START messages to send.
+        This function is called by the pool of threads: it should not access
+        the database, so the device, the worker and the sub jobs should
+        already be loaded.
+        raise: the same exceptions as Device.load_configuration
+        """
+        # Variables for template rendering, extracted at submission time
+        job_ctx = job.facts.get("context", {})
 
         device = job.actual_device
         worker = device.worker_host
@@ -447,76 +500,113 @@ class Command(LAVADaemonCommand):
 
         # Try to load the dispatcher specific files and then fallback to the
         # default configuration files.
-        env_str = load_optional_yaml_file(
+        env_str = self.load_config(
             os.path.join(DISPATCHERS_PATH, worker.hostname, "env.yaml"), ENV_PATH
         )
-        env_dut_str = load_optional_yaml_file(
+        env_dut_str = self.load_config(
             os.path.join(DISPATCHERS_PATH, worker.hostname, "env.dut.yaml"),
             ENV_DUT_PATH,
         )
-        dispatcher_cfg = load_optional_yaml_file(
+        dispatcher_cfg = self.load_config(
             os.path.join(DISPATCHERS_PATH, worker.hostname, "dispatcher.yaml"),
             os.path.join(DISPATCHERS_PATH, "%s.yaml" % worker.hostname),
         )
 
-        self.save_job_config(job, device_cfg, env_str, env_dut_str, dispatcher_cfg)
-        self.logger.info(
-            "[%d] START => %s (%s)", job.id, worker.hostname, device.hostname
+        messages = []
+        job_def = self.export_definition(job)
+        device_str = yaml.dump(device_cfg)
+        self.save_job_config(
+            job, job_def, device_str, env_str, env_dut_str, dispatcher_cfg
         )
-        send_multipart_u(
-            self.controler,
-            [
-                worker.hostname,
-                "START",
-                str(job.id),
-                self.export_definition(job),
-                yaml.dump(device_cfg),
-                dispatcher_cfg,
-                env_str,
-                env_dut_str,
-            ],
+        messages.append(
+            (
+                job,
+                "[%d] START => %s (%s)" % (job.id, worker.hostname, device.hostname),
+                [
+                    worker.hostname,
+                    "START",
+                    str(job.id),
+                    job_def,
+                    device_str,
+                    dispatcher_cfg,
+                    env_str,
+                    env_dut_str,
+                ],
+            )
         )
 
         # For multinode jobs, start the dynamic connections
-        parent = job
-        for sub_job in job.sub_jobs_list:
-            if sub_job == parent or not sub_job.dynamic_connection:
-                continue
-
+        for sub_job in sub_jobs:
             # inherit only enough configuration for dynamic_connection operation
-            self.logger.info(
-                "[%d] Trimming dynamic connection device configuration.", sub_job.id
+            min_device_cfg = device.minimise_configuration(device_cfg)
+            sub_job_def = self.export_definition(sub_job)
+            min_device_str = yaml.dump(min_device_cfg)
+            self.save_job_config(
+                sub_job,
+                sub_job_def,
+                min_device_str,
+                env_str,
+                env_dut_str,
+                dispatcher_cfg,
+            )
+            messages.append(
+                (
+                    sub_job,
+                    "[%d] START => %s (connection)" % (sub_job.id, worker.hostname),
+                    [
+                        worker.hostname,
+                        "START",
+                        str(sub_job.id),
+                        sub_job_def,
+                        min_device_str,
+                        dispatcher_cfg,
+                        env_str,
+                        env_dut_str,
+                    ],
+                )
             )
-            min_device_cfg = parent.actual_device.minimise_configuration(device_cfg)
+        return messages
 
-            self.save_job_config(
-                sub_job, min_device_cfg, env_str, env_dut_str, dispatcher_cfg
+    def start_job_failed(self, job, exc):
+        """
+        Return the error message for the exceptions raised by prepare_job, or
+        raise the exception again if it's unexpected.
+        """
+        if isinstance(exc, jinja2.TemplateNotFound):
+            self.logger.error("[%d] Template not found: '%s'", job.id, exc.message)
+            return "Template not found: '%s'" % exc.message
+        elif isinstance(exc, jinja2.TemplateSyntaxError):
+            self.logger.error(
+                "[%d] Template syntax error in '%s', line %d: %s",
+                job.id,
+                exc.name,
+                exc.lineno,
+                exc.message,
             )
-            self.logger.info(
-                "[%d] START => %s (connection)", sub_job.id, worker.hostname
+            return "Template syntax error in '%s', line %d: %s" % (
+                exc.name,
+                exc.lineno,
+                exc.message,
             )
-            send_multipart_u(
-                self.controler,
-                [
-                    worker.hostname,
-                    "START",
-                    str(sub_job.id),
-                    self.export_definition(sub_job),
-                    yaml.dump(min_device_cfg),
-                    dispatcher_cfg,
-                    env_str,
-                    env_dut_str,
-                ],
+        elif isinstance(exc, OSError):
+            self.logger.error(
+                "[%d] Unable to read '%s': %s", job.id, exc.filename, exc.strerror
             )
+            return "Cannot open '%s': %s" % (exc.filename, exc.strerror)
+        elif isinstance(exc, yaml.YAMLError):
+            self.logger.error("[%d] Unable to parse job definition: %s", job.id, exc)
+            return "Cannot parse job definition: %s" % exc
+        raise exc
 
     def start_jobs(self, jobs=None):
         """
         Loop on all scheduled jobs and send the START message to the slave.
+        The configurations are rendered and saved by a pool of threads,
+        without holding any lock. The state of each job is then checked again
+        while holding the row lock, before sending the START message.
         """
-        # make the request atomic
-        query = TestJob.objects.select_for_update()
         # Only select test job that are ready
-        query = query.filter(state=TestJob.STATE_SCHEDULED)
+        query = TestJob.objects.filter(state=TestJob.STATE_SCHEDULED)
         # Only start jobs on online workers
         query = query.filter(actual_device__worker_host__state=Worker.STATE_ONLINE)
         # exclude test job without a device: they are special test jobs like
@@ -525,57 +615,69 @@ class Command(LAVADaemonCommand):
         # Allow for partial scheduling
         if jobs is not None:
             query = query.filter(id__in=jobs)
+        query = query.select_related("actual_device", "actual_device__worker_host")
 
-        # Loop on all jobs
+        # Stage 1: prepare the configurations in the pool of threads
+        futures = []
         for job in query:
-            msg = None
+            # The sub jobs are loaded here as the threads should not access
+            # the database.
+            sub_jobs = [
+                sub_job
+                for sub_job in job.sub_jobs_list
+                if sub_job != job and sub_job.dynamic_connection
+            ]
+            futures.append(
+                (job, self.start_pool.submit(self.prepare_job, job, sub_jobs))
+            )
+
+        # Stage 2: transitions and messages
+        for (job, future) in futures:
+            # Wait for the configuration before locking the job row
+            (messages, error) = (None, None)
             try:
-                self.start_job(job)
-            except jinja2.TemplateNotFound as exc:
-                self.logger.error("[%d] Template not found: '%s'", job.id, exc.message)
-                msg = "Template not found: '%s'" % exc.message
-            except jinja2.TemplateSyntaxError as exc:
-                self.logger.error(
-                    "[%d] Template syntax error in '%s', line %d: %s",
-                    job.id,
-                    exc.name,
-                    exc.lineno,
-                    exc.message,
-                )
-                msg = "Template syntax error in '%s', line %d: %s" % (
-                    exc.name,
-                    exc.lineno,
-                    exc.message,
-                )
-            except OSError as exc:
-                self.logger.error(
-                    "[%d] Unable to read '%s': %s", job.id, exc.filename, exc.strerror
-                )
-                msg = "Cannot open '%s': %s" % (exc.filename, exc.strerror)
-            except yaml.YAMLError as exc:
-                self.logger.error(
-                    "[%d] Unable to parse job definition: %s", job.id, exc
-                )
-                msg = "Cannot parse job definition: %s" % exc
-
-            if msg:
-                # Add the error as lava.job result
-                metadata = {
-                    "case": "job",
-                    "definition": "lava",
-                    "error_type": "Infrastructure",
-                    "error_msg": msg,
-                    "result": "fail",
-                }
-                suite, _ = TestSuite.objects.get_or_create(name="lava", job=job)
-                TestCase.objects.create(
-                    name="job",
-                    suite=suite,
-                    result=TestCase.RESULT_FAIL,
-                    metadata=yaml.dump(metadata),
-                )
-                job.go_state_finished(TestJob.HEALTH_INCOMPLETE, True)
-                job.save()
+                messages = future.result()
+            except (jinja2.TemplateError, OSError, yaml.YAMLError) as exc:
+                error = exc
+
+            with transaction.atomic():
+                try:
+                    locked = TestJob.objects.select_for_update().get(id=job.id)
+                except TestJob.DoesNotExist:
+                    continue
+                # The job was canceled in the meantime
+                if locked.state != TestJob.STATE_SCHEDULED:
+                    continue
+
+                if error is not None:
+                    msg = self.start_job_failed(locked, error)
+                    # Add the error as lava.job result
+                    metadata = {
+                        "case": "job",
+                        "definition": "lava",
+                        "error_type": "Infrastructure",
+                        "error_msg": msg,
+                        "result": "fail",
+                    }
+                    suite, _ = TestSuite.objects.get_or_create(name="lava", job=locked)
+                    TestCase.objects.create(
+                        name="job",
+                        suite=suite,
+                        result=TestCase.RESULT_FAIL,
+                        metadata=yaml.dump(metadata),
+                    )
+                    locked.go_state_finished(TestJob.HEALTH_INCOMPLETE, True)
+                    locked.save()
+                    continue
+
+                for (sub_job, log, msg) in messages:
+                    if sub_job != job:
+                        self.logger.info(
+                            "[%d] Trimming dynamic connection device configuration.",
+                            sub_job.id,
+                        )
+                    self.logger.info(log)
+                    send_multipart_u(self.controler, msg)
 
     def cancel_jobs(self, partial=False):
         # make the request atomic
@@ -676,6 +778,16 @@ class Command(LAVADaemonCommand):
         if self.inotify_fd is not None:
             self.poller.register(os.fdopen(self.inotify_fd), zmq.POLLIN)
 
+        self.logger.debug("[INIT] Watching the configuration files")
+        self.watch_config()
+        if self.config_fd is None:
+            self.logger.warning("[INIT] Unable to watch the configuration files")
+        else:
+            self.poller.register(self.config_fd, zmq.POLLIN)
+        self.start_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=options["start_workers"]
+        )
+
         # Translate signals into zmq messages
         (self.pipe_r, _) = self.setup_zmq_signal_handler()
         self.poller.register(self.pipe_r, zmq.POLLIN)
@@ -695,6 +807,7 @@ class Command(LAVADaemonCommand):
             )
             self.controler.close(linger=0)
             self.event_socket.close(linger=0)
+            self.start_pool.shutdown(wait=False)
             if options["encrypt"]:
                 self.auth.stop()
             context.term()
@@ -753,6 +866,17 @@ class Command(LAVADaemonCommand):
                         domain="*", location=options["slaves_certs"]
                     )
 
+                # Configuration files were modified
+                if (
+                    self.config_fd is not None
+                    and sockets.get(self.config_fd) == zmq.POLLIN
+                ):
+                    os.read(self.config_fd, 4096)
+                    self.logger.debug("[CONFIG] Configuration files modified")
+                    self.config_cache = {}
+                    # Watch the newly created directories
+                    self.watch_config()
+
                 # Check dispatchers status
                 now = time.time()
                 if now - last_dispatcher_check > PING_INTERVAL:
@@ -774,11 +898,10 @@ class Command(LAVADaemonCommand):
                 # CANCEL and START messages
                 if time.time() - last_schedule > SCHEDULE_INTERVAL:
                     if self.dispatchers["lava-logs"].online:
-                        schedule(self.logger)
+                        schedule(self.logger, queue=self.queue)
 
                         # Dispatch scheduled jobs
-                        with transaction.atomic():
-                            self.start_jobs()
+                        self.start_jobs()
                     else:
                         self.logger.warning("lava-logs is offline: can't schedule jobs")
 
@@ -796,11 +919,12 @@ class Command(LAVADaemonCommand):
                         self.events["canceling"] = set()
                     # Schedule for available device-types
                     if self.events["available_dt"]:
-                        jobs = schedule(self.logger, self.events["available_dt"])
+                        jobs = schedule(
+                            self.logger, self.events["available_dt"], self.queue
+                        )
                         self.events["available_dt"] = set()
                         # Dispatch scheduled jobs
-                        with transaction.atomic():
-                            self.start_jobs(jobs)
+                        self.start_jobs(jobs)
 
             except (OperationalError, InterfaceError):
                 self.logger.info("[RESET] database connection reset.")